@@ -0,0 +1,193 @@
+"""
+whatprovides benchmark.py
+
+This script generates a synthetic site-packages tree and measures each stage of the pipeline
+(walk, decode, match, filter, print) and the end-to-end CLI separately.
+Results are written as JSON, so they can be compared across commits:
+
+ python benchmark.py --output before.json
+ python benchmark.py --output after.json --compare before.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from typing import List, Dict, Callable, Any, Optional
+from whatprovides import get_python_files, get_files_lines, get_declarations, filter_declaration, FileLine, \
+    Declaration
+
+SCRIPT_DIR: str = os.path.dirname(os.path.abspath(__file__))
+
+#: a name which is declared in some of generated files, it is used as the search string
+SEARCH: str = 'NeedleParser'
+
+#: code of the CLI run by the end-to-end benchmark
+CLI_CODE: str = 'from whatprovides.cli import main; main()'
+
+
+def generate_tree(
+        root: str,
+        files: int,
+        depth: int,
+        lines: int,
+        density: float,
+        non_utf8: float,
+        seed: int,
+        no_cookie: float = 0.5,
+) -> None:
+    """
+    Generates a synthetic tree of python packages
+
+    :param root: a folder to generate the tree in
+    :param files: a count of python files
+    :param depth: a maximum depth of packages
+    :param lines: a count of lines in each file
+    :param density: a share of lines which are declarations
+    :param non_utf8: a share of files encoded in cp1251
+    :param seed: a seed of the random generator, the same seed generates the same tree
+    :param no_cookie: a share of cp1251 files without a coding cookie, their encoding is detected by chardet
+    """
+    rnd: random.Random = random.Random(seed)
+    for file_index in range(files):
+        package_path: str = os.path.join(
+            root, *['package%i' % rnd.randrange(10) for _ in range(rnd.randint(1, depth))]
+        )
+        os.makedirs(package_path, exist_ok=True)
+        is_non_utf8: bool = rnd.random() < non_utf8
+        if not is_non_utf8:
+            code: List[str] = ['# -*- coding: utf-8 -*-\n']
+        elif rnd.random() < no_cookie:
+            code = ['# a legacy module without a coding cookie\n']
+        else:
+            code = ['# -*- coding: cp1251 -*-\n']
+        for line_index in range(lines - 1):
+            if rnd.random() >= density:
+                code.append('    value = compute(%i, "строка")  # comment\n' % line_index)
+                continue
+            name: str = SEARCH if rnd.random() < 0.01 else 'name_%i_%i' % (file_index, line_index)
+            kind: int = rnd.randrange(3)
+            if kind == 0:
+                code.append('%s = %i\n' % (name, line_index))
+            elif kind == 1:
+                code.append('def %s(*args, **kwargs):\n' % name)
+            else:
+                code.append('class %s(object):\n' % name)
+        with open(os.path.join(package_path, 'module%i.py' % file_index), 'wb') as f:
+            f.write(''.join(code).encode('cp1251' if is_non_utf8 else 'utf-8'))
+
+
+def measure(function: Callable[[], Any], repeat: int) -> float:
+    """
+    Returns the best time of *repeat* calls of a function in seconds
+    """
+    best: float = float('inf')
+    for _ in range(repeat):
+        started: float = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run_cli(root: str, args: List[str], env: Dict[str, str]) -> None:
+    subprocess.run(
+        [sys.executable, '-c', CLI_CODE, '--path', root] + args,
+        check=True, stdout=subprocess.DEVNULL, env=env, cwd=SCRIPT_DIR,
+    )
+
+
+def run_benchmark(root: str, repeat: int, counts: Dict[str, int]) -> Dict[str, float]:
+    """
+    Measures stages of the pipeline and the end-to-end CLI on a tree
+
+    :param root: a folder of the synthetic tree
+    :param repeat: a count of repeats of each measurement, the best time is reported
+    :param counts: a map to store counts of files, lines, declarations and found declarations
+    :return: a map of names of stages to times in seconds
+    """
+    results: Dict[str, float] = {}
+    file_paths: List[str] = list(get_python_files([root]))
+    file_lines: List[FileLine] = list(get_files_lines(file_paths))
+    declarations: List[Declaration] = list(get_declarations(file_lines))
+    found: List[Declaration] = list(filter_declaration(SEARCH, declarations))
+    results['walk'] = measure(lambda: list(get_python_files([root])), repeat)
+    results['decode'] = measure(lambda: list(get_files_lines(file_paths)), repeat)
+    results['match'] = measure(lambda: list(get_declarations(file_lines)), repeat)
+    results['filter'] = measure(lambda: list(filter_declaration(SEARCH, declarations)), repeat)
+    results['print'] = measure(lambda: print(*declarations, sep='\n', file=io.StringIO()), repeat)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env: Dict[str, str] = dict(os.environ, WHATPROVIDES_CACHE=os.path.join(cache_dir, 'index.sqlite3'))
+        results['cli_no_cache'] = measure(lambda: run_cli(root, ['--no-cache', '--no-daemon', SEARCH], env), repeat)
+        results['cli_index_build'] = measure(lambda: run_cli(root, ['--rebuild', SEARCH], env), repeat)
+        results['cli_index_query'] = measure(lambda: run_cli(root, ['--no-daemon', SEARCH], env), repeat)
+    counts.update(files=len(file_paths), lines=len(file_lines), declarations=len(declarations), found=len(found))
+    return results
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        ).stdout.decode().strip()
+    except OSError:
+        return ''
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float]) -> None:
+    """
+    Prints times of stages and their ratios to the baseline
+    """
+    for stage, value in results.items():
+        old: Optional[float] = baseline.get(stage)
+        ratio: str = '%.2fx' % (value / old) if old else '-'
+        print('%-16s %12.4f %12s %8s' % (stage, value, '%.4f' % old if old is not None else '-', ratio))
+
+
+def main():
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=2000, help='a count of python files')
+    parser.add_argument('--depth', type=int, default=4, help='a maximum depth of packages')
+    parser.add_argument('--lines', type=int, default=200, help='a count of lines in each file')
+    parser.add_argument('--density', type=float, default=0.2, help='a share of lines which are declarations')
+    parser.add_argument('--non-utf8', type=float, default=0.05, help='a share of non utf-8 files')
+    parser.add_argument('--no-cookie', type=float, default=0.5,
+                        help='a share of non utf-8 files without a coding cookie (decoded using chardet)')
+    parser.add_argument('--seed', type=int, default=1, help='a seed of the tree generator')
+    parser.add_argument('--repeat', type=int, default=3, help='a count of repeats, the best time is reported')
+    parser.add_argument('--output', help='a path to write results as JSON')
+    parser.add_argument('--compare', help='a path to results of a previous run to compare with')
+    args: argparse.Namespace = parser.parse_args()
+    parameters: Dict[str, Any] = {
+        'files': args.files, 'depth': args.depth, 'lines': args.lines, 'density': args.density,
+        'non_utf8': args.non_utf8, 'no_cookie': args.no_cookie, 'seed': args.seed, 'repeat': args.repeat,
+    }
+    with tempfile.TemporaryDirectory() as root:
+        generate_tree(
+            root, files=args.files, depth=args.depth, lines=args.lines, density=args.density,
+            non_utf8=args.non_utf8, seed=args.seed, no_cookie=args.no_cookie,
+        )
+        counts: Dict[str, int] = {}
+        results: Dict[str, float] = run_benchmark(root, repeat=args.repeat, counts=counts)
+    report: Dict[str, Any] = {
+        'commit': get_commit(),
+        'python': sys.version.split()[0],
+        'parameters': parameters,
+        'counts': counts,
+        'results': results,
+    }
+    baseline: Dict[str, float] = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    compare(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
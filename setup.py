@@ -23,7 +23,7 @@ setup(
     long_description=long_description,
     long_description_content_type='text/x-rst',
     entry_points={
-        'console_scripts': ['whatprovides=whatprovides:main'],
+        'console_scripts': ['whatprovides=whatprovides.cli:main'],
     },
     install_requires=[
         'chardet',
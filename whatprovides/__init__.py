@@ -1,5 +1,26 @@
 """
 whatprovides __init__.py
+
+Names of the core module (*whatprovides.whatprovides*) are exported by the package.
+On python 3.7+ the core is imported at the first access to a name (PEP 562),
+so the command line interface (*whatprovides.cli*) does not import it before arguments are parsed.
 """
-#import whatprovides
-from .whatprovides import *
+import sys
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name: str):
+        import importlib
+        core = importlib.import_module('.whatprovides', __name__)
+        if name == '__all__':  # from whatprovides import *
+            return [core_name for core_name in vars(core) if not core_name.startswith('_')]
+        if name in globals():  # a submodule, it is set by the import, e.g. whatprovides.whatprovides
+            return globals()[name]
+        try:
+            return getattr(core, name)
+        except AttributeError:
+            raise AttributeError('module %r has no attribute %r' % (__name__, name)) from None
+
+    def __dir__():
+        return sorted(set(globals()) | set(__getattr__('__all__')))
+else:
+    from .whatprovides import *
@@ -0,0 +1,6 @@
+"""
+whatprovides __main__.py, runs the command line interface by *python -m whatprovides*
+"""
+from .cli import main
+
+main()
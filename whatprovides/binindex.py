@@ -0,0 +1,422 @@
+"""
+This module provides a memory-mapped binary index of declarations for 'whatprovides' project
+
+The binary index is a compact read only copy of the declarations index for a list of search paths.
+It is mapped into memory and queried by a binary search, so an exact or a prefix lookup of a name
+reads only a few pages of the file and does not deserialize anything else.
+
+The file consists of a header, a table of strings, a table of names and a table of records.
+All strings (names, module paths and type tags) are stored once in a string pool,
+the table of strings holds an offset and a length of each string in the pool.
+The table of names is sorted by UTF-8 bytes of names, each entry holds an id of a name string
+and a range of its records. Records of a name hold ids of a type tag and a module path
+in order of search paths.
+
+For completions of prefixes names are ranked by the best of their declarations:
+by a position of a search path in the PYTHON PATH, then by a type of a declaration (see *TYPE_RANKS*).
+The table of completions holds positions of names and of their best records sorted by ranks, then by names,
+the table of partitions holds ranges of the table of completions with the same rank.
+So top completions are found by a binary search in each partition in order of ranks,
+it stops as soon as enough completions are found.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import os
+import sys
+import time
+import mmap
+import struct
+import hashlib
+from typing import List, Dict, Set, Tuple, Iterator, Optional
+from .whatprovides import DeclarationType, get_declaration_types, Declaration, get_search_path
+
+#: a magic of the binary index file
+MAGIC: bytes = b'WPBI'
+
+#: a version of the format, files of another version are not read
+FORMAT_VERSION: int = 2
+
+#: a magic, a version, a generation of the declarations index, counts of strings, names, records and partitions
+HEADER: struct.Struct = struct.Struct('<4sI8sIIII')
+
+#: an offset of a string in the pool and its length
+STRING: struct.Struct = struct.Struct('<II')
+
+#: an id of a name string, an index of the first record of the name and a count of its records
+NAME: struct.Struct = struct.Struct('<III')
+
+#: an id of a type tag string and an id of a module path string
+RECORD: struct.Struct = struct.Struct('<II')
+
+#: a position of a name in the table of names and an index of its best record
+COMPLETION: struct.Struct = struct.Struct('<II')
+
+#: a rank, an index of the first completion with this rank and a count of completions
+PARTITION: struct.Struct = struct.Struct('<III')
+
+#: ranks of types of declarations in completions, classes go first
+TYPE_RANKS: Dict[str, int] = {'class': 0, 'def': 1, 'var': 2, 'ext': 3, 'sym': 4}
+
+#: a default count of completions
+COMPLETIONS_LIMIT: int = 20
+
+#: an age in seconds of the binary index which is used without a refresh of the declarations index
+#: if no search path was modified after it was written (e.g. by installing a package)
+FRESH_TIME: float = 60.0
+
+
+def get_rank(declaration_type: DeclarationType, root_position: int) -> int:
+    """
+    Returns a rank of a declaration in completions, a declaration with a lower rank goes first
+
+    :param declaration_type: a type of the declaration
+    :type declaration_type: DeclarationType
+    :param root_position: a position of a search path of the declaration in the PYTHON PATH
+    :type root_position: int
+    :return: the rank
+    :rtype: int
+    """
+    return root_position * (len(TYPE_RANKS) + 1) + TYPE_RANKS.get(declaration_type.name, len(TYPE_RANKS))
+
+
+def get_root_position(module_path: str, search_paths: List[str], positions: Dict[str, int]) -> int:
+    """
+    Returns a position of a search path of a module in the PYTHON PATH, positions of modules are cached
+
+    :param module_path: a path to a module
+    :type module_path: str
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param positions: a cache of positions of modules
+    :type positions: Dict[str, int]
+    :return: the position or the count of search paths if the module is not in search paths
+    :rtype: int
+    """
+    position: Optional[int] = positions.get(module_path)
+    if position is None:
+        root: str = get_search_path(module_path, search_paths)
+        position = search_paths.index(root) if root else len(search_paths)
+        positions[module_path] = position
+    return position
+
+
+def get_binary_index_path(cache_path: str, search_paths: List[str]) -> str:
+    """
+    Returns a path to the binary index of search paths next to the declarations index,
+    different lists of search paths get different files
+
+    :param cache_path: A path to the declarations index file
+    :type cache_path: str
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :return: a path to the binary index file
+    :rtype: str
+    """
+    key: str = hashlib.sha1('\0'.join(search_paths).encode('utf-8', 'replace')).hexdigest()
+    return os.path.join(os.path.dirname(cache_path), 'index-%s.bin' % key[:12])
+
+
+def is_fresh(index_path: str, search_paths: List[str], fresh_time: float = FRESH_TIME) -> bool:
+    """
+    Checks that the binary index was written (or checked) less than *fresh_time* seconds ago
+    and no search path was modified after that, only search paths are checked, not python files in them,
+    so a change of a nested python file is found up to *fresh_time* seconds later,
+    unless the declarations index is refreshed by another process (see *get_index_generation*)
+
+    :param index_path: a path to the binary index
+    :type index_path: str
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param fresh_time: a maximal age of the binary index in seconds
+    :type fresh_time: float
+    :return: True if the binary index can be used without a refresh
+    :rtype: bool
+    """
+    try:
+        written: float = os.stat(index_path).st_mtime
+    except OSError:
+        return False
+    if not 0.0 <= time.time() - written <= fresh_time:
+        return False
+    for search_path in search_paths:
+        try:
+            if os.stat(search_path).st_mtime >= written:
+                return False
+        except OSError:
+            pass  # a missing search path does not provide declarations
+    return True
+
+
+def get_index_generation(cache_path: str) -> str:
+    """
+    Returns the generation of the declarations index (see *cache.DeclarationIndex.get_generation*),
+    the database is opened read only, its schema is not checked and it is not created
+
+    :param cache_path: A path to the declarations index
+    :type cache_path: str
+    :return: the generation or an empty string if the declarations index can not be read
+    :rtype: str
+    """
+    import sqlite3
+    from urllib.parse import quote
+    try:
+        connection: sqlite3.Connection = sqlite3.connect('file:%s?mode=ro' % quote(cache_path), uri=True, timeout=30)
+        try:
+            row: Optional[Tuple[str]] = connection.execute(
+                "SELECT value FROM meta WHERE key = 'generation'"
+            ).fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return ''
+    return row[0] if row else ''
+
+
+def write_binary_index(
+        index_path: str,
+        declarations: Iterator[Declaration],
+        generation: str,
+        search_paths: Optional[List[str]] = None,
+) -> int:
+    """
+    Writes declarations to a binary index file, the file is replaced atomically
+
+    :param index_path: A path to the binary index file
+    :type index_path: str
+    :param declarations: declarations in order of search paths
+    :type declarations: Iterator[Declaration]
+    :param generation: A generation of the declarations index, see *DeclarationIndex.get_generation*
+    :type generation: str
+    :param search_paths: search paths in order of the PYTHON PATH, they rank completions
+    :type search_paths: Optional[List[str]]
+    :return: a count of written declarations
+    :rtype: int
+    """
+    search_paths = search_paths or []
+    positions: Dict[str, int] = {}  # a module path: a position of its search path
+    string_ids: Dict[str, int] = {}
+    records: Dict[str, List[Tuple[int, int]]] = {}  # a name: records in order of declarations
+    best: Dict[str, Tuple[int, int]] = {}  # a name: a rank and an index of the best record
+    for declaration in declarations:
+        string_ids.setdefault(declaration.name, len(string_ids))
+        type_id: int = string_ids.setdefault(declaration.declaration_type.name, len(string_ids))
+        path_id: int = string_ids.setdefault(declaration.module_path, len(string_ids))
+        name_records: List[Tuple[int, int]] = records.setdefault(declaration.name, [])
+        rank: Tuple[int, int] = (
+            get_rank(declaration.declaration_type, get_root_position(declaration.module_path, search_paths, positions)),
+            len(name_records),
+        )
+        if declaration.name not in best or rank < best[declaration.name]:
+            best[declaration.name] = rank
+        name_records.append((type_id, path_id))
+    pool: bytearray = bytearray()
+    strings: bytearray = bytearray()
+    for string in string_ids:
+        encoded: bytes = string.encode('utf-8', 'surrogatepass')
+        strings += STRING.pack(len(pool), len(encoded))
+        pool += encoded
+    names: bytearray = bytearray()
+    packed_records: bytearray = bytearray()
+    count: int = 0
+    sorted_names: List[str] = sorted(records, key=lambda name: name.encode('utf-8', 'surrogatepass'))
+    for name in sorted_names:
+        names += NAME.pack(string_ids[name], count, len(records[name]))
+        for type_id, path_id in records[name]:
+            packed_records += RECORD.pack(type_id, path_id)
+        count += len(records[name])
+    completions: bytearray = bytearray()
+    partitions: List[List[int]] = []  # ranks, indexes of first completions and counts of completions
+    for position in sorted(range(len(sorted_names)), key=lambda position: best[sorted_names[position]][0]):
+        rank, record = best[sorted_names[position]]
+        if not partitions or partitions[-1][0] != rank:
+            partitions.append([rank, len(completions) // COMPLETION.size, 0])
+        partitions[-1][2] += 1
+        completions += COMPLETION.pack(position, record)
+    temp_path: str = '%s.%i.tmp' % (index_path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(
+                MAGIC, FORMAT_VERSION, bytes.fromhex(generation), len(string_ids), len(records), count,
+                len(partitions),
+            ))
+            f.write(strings)
+            f.write(names)
+            f.write(packed_records)
+            f.write(completions)
+            for partition in partitions:
+                f.write(PARTITION.pack(*partition))
+            f.write(pool)
+        os.replace(temp_path, index_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return count
+
+
+class BinaryIndex:
+    """
+    A read only memory-mapped binary index of declarations, see *write_binary_index*
+
+    :param index_path: A path to the binary index file
+    :type index_path: str
+    :raises OSError: if the file can not be read
+    :raises ValueError: if the file is not a binary index of the current format
+    """
+
+    def __init__(self, index_path: str):
+        with open(index_path, 'rb') as f:
+            self.data: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < HEADER.size:
+            self.data.close()
+            raise ValueError('"%s" is not a binary index' % index_path)
+        magic, version, generation, strings_count, self.names_count, records_count, partitions_count = \
+            HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.data.close()
+            raise ValueError('"%s" is not a binary index of version %i' % (index_path, FORMAT_VERSION))
+        #: a generation of the declarations index which the file was written from
+        self.generation: str = generation.hex()
+        self.strings_offset: int = HEADER.size
+        self.names_offset: int = self.strings_offset + strings_count * STRING.size
+        self.records_offset: int = self.names_offset + self.names_count * NAME.size
+        self.completions_offset: int = self.records_offset + records_count * RECORD.size
+        self.partitions_offset: int = self.completions_offset + self.names_count * COMPLETION.size
+        self.pool_offset: int = self.partitions_offset + partitions_count * PARTITION.size
+        #: ranks, indexes of first completions and counts of completions with the same rank
+        self.partitions: List[Tuple[int, int, int]] = list(PARTITION.iter_unpack(
+            self.data[self.partitions_offset:self.pool_offset]
+        ))
+        #: decoded strings by ids, only strings of found declarations are decoded
+        self._strings: Dict[int, str] = {}
+        self._types: Dict[str, DeclarationType] = {
+            declaration_type.name: declaration_type for declaration_type in get_declaration_types()
+        }
+
+    def close(self) -> None:
+        """
+        Unmaps the file
+        """
+        self.data.close()
+
+    def _get_string(self, string_id: int) -> bytes:
+        offset, length = STRING.unpack_from(self.data, self.strings_offset + string_id * STRING.size)
+        return self.data[self.pool_offset + offset:self.pool_offset + offset + length]
+
+    def _get_name(self, position: int) -> bytes:
+        return self._get_string(NAME.unpack_from(self.data, self.names_offset + position * NAME.size)[0])
+
+    def _decode(self, string_id: int) -> str:
+        string: Optional[str] = self._strings.get(string_id)
+        if string is None:
+            string = sys.intern(self._get_string(string_id).decode('utf-8', 'surrogatepass'))
+            self._strings[string_id] = string
+        return string
+
+    def _bisect(self, name: bytes) -> int:
+        """
+        Returns a position of the first name in the sorted table of names which is not less than *name*
+        """
+        low: int = 0
+        high: int = self.names_count
+        while low < high:
+            middle: int = (low + high) // 2
+            if self._get_name(middle) < name:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _get_declarations(self, position: int) -> Iterator[Declaration]:
+        name_id, first, count = NAME.unpack_from(self.data, self.names_offset + position * NAME.size)
+        name: str = self._decode(name_id)
+        start: int = self.records_offset + first * RECORD.size
+        for type_id, path_id in RECORD.iter_unpack(self.data[start:start + count * RECORD.size]):
+            declaration_type: Optional[DeclarationType] = self._types.get(self._decode(type_id))
+            if declaration_type:
+                yield Declaration(declaration_type=declaration_type, name=name, module_path=self._decode(path_id))
+
+    def lookup(self, name: str, prefix: bool = False) -> Iterator[Declaration]:
+        """
+        This generator yields declarations with a name or with names starting with a prefix,
+        declarations are ordered by names, declarations of a name are in order of search paths
+
+        :param name: A name or a prefix of names
+        :type name: str
+        :param prefix: *name* is a prefix of names
+        :type prefix: bool
+        :return: a generator of declarations
+        :rtype: Iterator[Declaration]
+        """
+        encoded: bytes = name.encode('utf-8', 'surrogatepass')
+        position: int = self._bisect(encoded)
+        while position < self.names_count:
+            found: bytes = self._get_name(position)
+            if found != encoded and not (prefix and found.startswith(encoded)):
+                break
+            yield from self._get_declarations(position)
+            position += 1
+
+    def _get_declaration(self, position: int, record: int) -> Optional[Declaration]:
+        name_id, first, _ = NAME.unpack_from(self.data, self.names_offset + position * NAME.size)
+        type_id, path_id = RECORD.unpack_from(self.data, self.records_offset + (first + record) * RECORD.size)
+        declaration_type: Optional[DeclarationType] = self._types.get(self._decode(type_id))
+        if declaration_type is None:
+            return None
+        return Declaration(
+            declaration_type=declaration_type, name=self._decode(name_id), module_path=self._decode(path_id),
+        )
+
+    def _get_completion(self, index: int) -> Tuple[int, int]:
+        return COMPLETION.unpack_from(self.data, self.completions_offset + index * COMPLETION.size)
+
+    def complete(
+            self,
+            prefix: str,
+            limit: int = COMPLETIONS_LIMIT,
+            types: Optional[Set[str]] = None,
+    ) -> List[Declaration]:
+        """
+        Returns top completions of a prefix: the best declaration of each name starting with the prefix,
+        names are ranked by a position of a search path in the PYTHON PATH, then by a type of a declaration,
+        names with the same rank are in order of names
+
+        :param prefix: A prefix of names
+        :type prefix: str
+        :param limit: a maximal count of completions
+        :type limit: int
+        :param types: names of types of best declarations to complete (e.g. {'class', 'def'}), all types by default
+        :type types: Optional[Set[str]]
+        :return: a list of declarations
+        :rtype: List[Declaration]
+        """
+        encoded: bytes = prefix.encode('utf-8', 'surrogatepass')
+        type_ranks: Optional[Set[int]] = None if types is None else {
+            TYPE_RANKS.get(name, len(TYPE_RANKS)) for name in types
+        }
+        completions: List[Declaration] = []
+        for rank, first, count in self.partitions:
+            if len(completions) >= limit:
+                break
+            if type_ranks is not None and rank % (len(TYPE_RANKS) + 1) not in type_ranks:
+                continue
+            low: int = first
+            high: int = first + count
+            while low < high:  # the first name of the partition which is not less than the prefix
+                middle: int = (low + high) // 2
+                if self._get_name(self._get_completion(middle)[0]) < encoded:
+                    low = middle + 1
+                else:
+                    high = middle
+            while low < first + count and len(completions) < limit:
+                position, record = self._get_completion(low)
+                if not self._get_name(position).startswith(encoded):
+                    break
+                declaration: Optional[Declaration] = self._get_declaration(position, record)
+                if declaration:
+                    completions.append(declaration)
+                low += 1
+        return completions
@@ -0,0 +1,314 @@
+"""
+This module extracts declarations from cached bytecode for 'whatprovides' project
+
+Python compiles imported modules to *__pycache__/<name>.<cache tag>.pyc*.
+If a pyc file was written by the running interpreter and it is up to date with its source,
+declarations of the module are read from the module code object loaded by *marshal*
+instead of decoding the source and matching its lines with regexes.
+Instructions of the module code object are executed at the module level, so names stored by them
+are module level declarations, including declarations nested in *if* and *try* blocks
+and multi-line ones, which line regexes miss.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import os
+import sys
+import dis
+import marshal
+import importlib.util
+from types import CodeType
+from typing import List, Dict, Set, Tuple, Optional, Callable
+from .whatprovides import DeclarationType, declaration_types, Declaration, DecodeCallback
+
+#: a code object with this flag is a function (or a lambda, a comprehension), otherwise it is a class body
+CO_NEWLOCALS: int = 0x2
+
+STORE_OPS: Set[int] = {dis.opmap['STORE_NAME'], dis.opmap['STORE_GLOBAL']}
+LOAD_CONST: int = dis.opmap['LOAD_CONST']
+DELETE_NAME: int = dis.opmap['DELETE_NAME']
+IMPORT_NAME: int = dis.opmap['IMPORT_NAME']
+COMPARE_OP: int = dis.opmap['COMPARE_OP']
+BINARY_OP: int = dis.opmap.get('BINARY_OP', -1)
+EXTENDED_ARG: int = dis.EXTENDED_ARG
+#: a placeholder of inline caches of instructions (python 3.11+)
+CACHE: Optional[int] = dis.opmap.get('CACHE')
+
+#: instructions between *IMPORT_NAME* and stores of imported names (e.g. *import a.b as c*, *from a import b, c*)
+IMPORT_OPS: Set[int] = {
+    dis.opmap[name] for name in ('IMPORT_FROM', 'LOAD_ATTR', 'ROT_TWO', 'SWAP', 'POP_TOP') if name in dis.opmap
+}
+
+UNPACK_OPS: Set[int] = {dis.opmap['UNPACK_SEQUENCE'], dis.opmap['UNPACK_EX']}
+
+#: a name stored after these instructions is a loop or a context manager variable, not a declaration
+NOT_DECLARATION_OPS: Set[int] = {
+    dis.opmap[name] for name in ('FOR_ITER', 'SETUP_WITH', 'BEFORE_WITH') if name in dis.opmap
+}
+
+#: instructions of augmented assignments (e.g. *x += 1*) before python 3.11, the stored name was declared before
+INPLACE_OPS: Set[int] = {op for name, op in dis.opmap.items() if name.startswith('INPLACE_')}
+#: arguments of *BINARY_OP* of augmented assignments (python 3.11+)
+INPLACE_ARGS: Set[int] = {
+    index for index, (name, _) in enumerate(getattr(dis, '_nb_ops', ())) if name.startswith('NB_INPLACE_')
+}
+
+#: instructions which match an exception of an *except* clause (python 3.9+)
+EXCEPTION_MATCH_OPS: Set[int] = {
+    dis.opmap[name] for name in ('JUMP_IF_NOT_EXC_MATCH', 'CHECK_EXC_MATCH', 'CHECK_EG_MATCH') if name in dis.opmap
+}
+#: an argument of *COMPARE_OP* which matches an exception (python 3.8 and earlier)
+EXCEPTION_MATCH_COMPARE: int = dis.cmp_op.index('exception match') if 'exception match' in dis.cmp_op else -1
+#: instructions between the match of an exception and the store of the name of *except ... as name*
+HANDLER_OPS: Set[int] = {op for name, op in dis.opmap.items() if name.startswith('POP_JUMP')} | {dis.opmap['POP_TOP']}
+
+
+def get_pyc_path(file_path: str) -> str:
+    """
+    Returns a path to the pyc file of a python file cached by the running interpreter
+
+    :param file_path: A path to a python file
+    :type file_path: str
+    :return: a path to the pyc file or an empty string if the interpreter does not cache bytecode
+    :rtype: str
+    """
+    try:
+        return importlib.util.cache_from_source(file_path)
+    except (NotImplementedError, ValueError):
+        return ''
+
+
+def load_code(file_path: str) -> Optional[CodeType]:
+    """
+    Loads the module code object of a python file from its pyc file.
+    The pyc file must be written by the running interpreter (its magic number)
+    and it must be up to date with the source: by the modification time and the size of the source
+    or by the hash of the source (PEP 552)
+
+    :param file_path: A path to a python file
+    :type file_path: str
+    :return: a code object or None if there is no valid and up to date pyc file
+    :rtype: Optional[CodeType]
+    """
+    pyc_path: str = get_pyc_path(file_path)
+    if not pyc_path:
+        return None
+    try:
+        with open(pyc_path, 'rb') as f:
+            data: bytes = f.read()
+        if data[:4] != importlib.util.MAGIC_NUMBER:
+            return None
+        if sys.version_info < (3, 7):
+            header: bytes = data[4:12]
+            body: int = 12
+            flags: int = 0
+        else:
+            flags = int.from_bytes(data[4:8], 'little')
+            header = data[8:16]
+            body = 16
+        if flags & 0b01:  # a hash based pyc file
+            if flags & 0b10:  # the hash must be checked
+                with open(file_path, 'rb') as f:
+                    if header != importlib.util.source_hash(f.read()):
+                        return None
+        else:
+            stat: os.stat_result = os.stat(file_path)
+            if header != (
+                    (int(stat.st_mtime) & 0xFFFFFFFF).to_bytes(4, 'little')
+                    + (stat.st_size & 0xFFFFFFFF).to_bytes(4, 'little')
+            ):
+                return None
+        code: CodeType = marshal.loads(data[body:])
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+    return code if isinstance(code, CodeType) else None
+
+
+def get_instructions(co_code: bytes) -> List[Tuple[int, int, int]]:
+    """
+    Returns instructions of a code, arguments of *EXTENDED_ARG* are joined with arguments of next instructions,
+    inline caches are skipped
+
+    :param co_code: bytes of a code object
+    :type co_code: bytes
+    :return: a list of offsets, operations and arguments of instructions
+    :rtype: List[Tuple[int, int, int]]
+    """
+    instructions: List[Tuple[int, int, int]] = []
+    extended: int = 0
+    for offset in range(0, len(co_code), 2):
+        op: int = co_code[offset]
+        arg: int = co_code[offset + 1] | extended
+        if op == EXTENDED_ARG:
+            extended = arg << 8
+            continue
+        extended = 0
+        if op != CACHE:
+            instructions.append((offset, op, arg))
+    return instructions
+
+
+def is_cleanup(instructions: List[Tuple[int, int, int]], index: int, consts: tuple) -> bool:
+    """
+    Checks that a store is a part of *name = None; del name*, the compiler adds it
+    at the end of an *except ... as name* clause
+
+    :param instructions: instructions of a code, see *get_instructions*
+    :type instructions: List[Tuple[int, int, int]]
+    :param index: an index of a store instruction
+    :type index: int
+    :param consts: constants of the code
+    :type consts: tuple
+    :return: True if the store is preceded by loading of None and followed by deletion of the stored name
+    :rtype: bool
+    """
+    if index == 0 or index + 1 == len(instructions):
+        return False
+    _, loaded, loaded_arg = instructions[index - 1]
+    _, deleted, deleted_arg = instructions[index + 1]
+    return (
+            loaded == LOAD_CONST and consts[loaded_arg] is None
+            and deleted == DELETE_NAME and deleted_arg == instructions[index][2]
+    )
+
+
+def get_code_declarations(
+        code: CodeType,
+        types: Dict[str, DeclarationType],
+        module_path: str,
+        accept: Optional[Callable[[str], bool]] = None,
+) -> List[Declaration]:
+    """
+    Returns declarations stored by instructions of a module code object.
+    A name stored right after a function or a class is made is a *def* or a *class* declaration,
+    a variable is declared by the first store of its name (augmented assignments, e.g. *x += 1*, do not declare it).
+    Imported names, loop and context manager variables and names of *except ... as name* are not declarations
+
+    :param code: a module code object
+    :type code: CodeType
+    :param types: declaration types by names (var, def, class)
+    :type types: Dict[str, DeclarationType]
+    :param module_path: a path to the python file of the module
+    :type module_path: str
+    :param accept: an optional predicate for names of declarations
+    :type accept: Optional[Callable[[str], bool]]
+    :return: a list of declarations in order of instructions
+    :rtype: List[Declaration]
+    """
+    names = code.co_names
+    consts = code.co_consts
+    instructions: List[Tuple[int, int, int]] = get_instructions(code.co_code)
+    found: List[Tuple[int, Declaration]] = []  # offsets of stores and declarations
+    variables: Set[str] = set()  # names of found variables
+    handlers: Dict[str, Optional[Tuple[int, Declaration]]] = {}  # names of *except ... as name*: their stores
+    made: Optional[CodeType] = None  # the last loaded code object of a function or a class
+    importing: bool = False
+    matching: bool = False  # an exception was matched, the next store is the name of *except ... as name*
+    previous: int = -1
+    augmented: bool = False  # the previous instruction is an operation of an augmented assignment
+    for index, (offset, op, arg) in enumerate(instructions):
+        if op in STORE_OPS:
+            name: str = names[arg]
+            if name in handlers and is_cleanup(instructions, index, consts):
+                handler: Optional[Tuple[int, Declaration]] = handlers[name]
+                if handler is not None:  # the variable was declared by *except ... as name*
+                    found.remove(handler)
+                    variables.discard(name)
+                    handlers[name] = None
+            else:
+                handlers.pop(name, None)
+                type_name: str = 'var'
+                if importing or previous in NOT_DECLARATION_OPS or name == '__doc__' and offset < 8:
+                    type_name = ''  # an import, a loop variable or a docstring of the module
+                elif made is not None and not made.co_name.startswith('<'):  # not a lambda or a comprehension
+                    type_name = 'def' if made.co_flags & CO_NEWLOCALS else 'class'
+                elif name in variables or augmented:
+                    type_name = ''  # the variable was declared before
+                declaration_type: Optional[DeclarationType] = types.get(type_name)
+                stored: Optional[Tuple[int, Declaration]] = None
+                if declaration_type and (accept is None or accept(name)):
+                    stored = (offset, Declaration(
+                        declaration_type=declaration_type, name=sys.intern(name), module_path=module_path,
+                    ))
+                    found.append(stored)
+                    if type_name == 'var':
+                        variables.add(name)
+                if matching:
+                    handlers[name] = stored if type_name == 'var' else None
+            made = None
+            matching = False
+        elif op == LOAD_CONST and isinstance(consts[arg], CodeType):
+            made = consts[arg]
+        elif op == IMPORT_NAME:
+            importing = True
+        elif op in EXCEPTION_MATCH_OPS or op == COMPARE_OP and arg == EXCEPTION_MATCH_COMPARE:
+            matching = True
+        elif op not in HANDLER_OPS:
+            matching = False
+        if importing and op != IMPORT_NAME and op not in IMPORT_OPS and op not in STORE_OPS:
+            importing = False
+        if op not in UNPACK_OPS and op not in STORE_OPS:
+            previous = op  # all names unpacked by *for a, b in ...* are loop variables
+            augmented = op in INPLACE_OPS or op == BINARY_OP and arg in INPLACE_ARGS
+    return sort_by_lines(code, found)
+
+
+def sort_by_lines(code: CodeType, found: List[Tuple[int, Declaration]]) -> List[Declaration]:
+    """
+    Sorts declarations by numbers of source lines of their stores,
+    the compiler can place code after the code of following lines (e.g. *except* blocks since python 3.11)
+
+    :param code: a module code object
+    :type code: CodeType
+    :param found: offsets of store instructions and declarations in order of offsets
+    :type found: List[Tuple[int, Declaration]]
+    :return: a list of declarations in order of source lines
+    :rtype: List[Declaration]
+    """
+    starts: List[Tuple[int, int]] = [(offset, line) for offset, line in dis.findlinestarts(code) if line is not None]
+    lines: List[Tuple[int, int, Declaration]] = []
+    index: int = 0
+    line: int = 0
+    for position, (offset, declaration) in enumerate(found):
+        while index < len(starts) and starts[index][0] <= offset:
+            line = starts[index][1]
+            index += 1
+        lines.append((line, position, declaration))
+    lines.sort(key=lambda item: item[:2])
+    return [declaration for _, _, declaration in lines]
+
+
+def get_bytecode_declarations(
+        file_path: str,
+        accept: Optional[Callable[[str], bool]] = None,
+        on_decode: Optional[DecodeCallback] = None,
+) -> Optional[List[Declaration]]:
+    """
+    Returns declarations of a python file read from its up to date pyc file.
+    Declaration types other than the built-in *var*, *def* and *class* can not be matched in bytecode,
+    so None is returned if *declaration_types* were extended
+
+    :param file_path: A path to a python file
+    :type file_path: str
+    :param accept: an optional predicate for names of declarations
+    :type accept: Optional[Callable[[str], bool]]
+    :param on_decode: an optional callback, which receives a path to a file,
+        an encoding ('-') and the 'bytecode' strategy, if declarations were read from bytecode
+    :type on_decode: Optional[DecodeCallback]
+    :return: a list of declarations or None if the source must be scanned
+    :rtype: Optional[List[Declaration]]
+    """
+    types: Dict[str, DeclarationType] = {
+        declaration_type.name: declaration_type for declaration_type in declaration_types
+    }
+    if not types.keys() <= {'var', 'def', 'class'}:
+        return None
+    code: Optional[CodeType] = load_code(file_path)
+    if code is None:
+        return None
+    if on_decode:
+        on_decode(file_path, '-', 'bytecode')
+    return get_code_declarations(code, types, file_path, accept=accept)
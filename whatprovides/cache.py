@@ -0,0 +1,538 @@
+"""
+This module provides a persistent on-disk index of declarations for 'whatprovides' project
+
+Declarations are stored in an *SQLite* database per content of python files (a hash of bytes of a file),
+a file is stored with the *mtime*, the *size* and the content.
+On each refresh only files which were changed since the last run are hashed,
+a file is scanned only if its content is not in the index yet, so identical files
+(e.g. the same package installed in many virtual environments) are scanned and stored once.
+Declarations read from bytecode differ from declarations matched in sources (see *bytecode*),
+so a content is stored per the way it was scanned and a search with *bytecode=False* never gets bytecode rows.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import os
+import sys
+import sqlite3
+import hashlib
+from typing import List, Dict, Tuple, Iterator, Iterable, Optional, Callable
+from .whatprovides import DeclarationType, get_declaration_types, Declaration, DecodeCallback
+from .whatprovides import CACHE_PATH_ENV  # noqa: F401 re-exported, the variable was defined here before
+from .parallel import scan_files
+from .prefetch import stat_python_files
+from .trigram import get_trigrams, get_query_trigrams, get_min_shared
+from .dists import Distribution, get_distribution_folders, get_search_path_distributions
+
+#: a version of the database schema, the index is rebuilt if the stored version is different
+SCHEMA_VERSION: int = 6
+
+#: a maximal count of variables of a query, old versions of SQLite do not allow more than 999
+MAX_VARIABLES: int = 500
+
+#: tables of the index
+TABLES: Tuple[str, ...] = (
+    'declarations', 'names', 'trigrams', 'files', 'contents', 'distribution_roots', 'distribution_files',
+)
+
+
+def get_file_hash(file_path: str) -> Optional[str]:
+    """
+    Returns a hash of the content of a file
+
+    :param file_path: A path to a file
+    :type file_path: str
+    :return: a hex digest or None if the file can not be read
+    :rtype: Optional[str]
+    """
+    digest = hashlib.sha1()
+    try:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class DeclarationIndex:
+    """
+    A persistent index of declarations keyed by a path, an mtime and a size of a python file or a zip archive,
+    declarations are shared by files with the same content
+
+    :param cache_path: A path to the index file
+    :type cache_path: str
+    :param check_same_thread: allow only the creating thread to use the index,
+        other threads can use it if calls are serialized (e.g. by a lock of the daemon)
+    :type check_same_thread: bool
+    """
+
+    def __init__(self, cache_path: str, check_same_thread: bool = True):
+        self.cache_path: str = cache_path
+        cache_dir: str = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.connection: sqlite3.Connection = sqlite3.connect(
+            cache_path, timeout=30, check_same_thread=check_same_thread,
+        )
+        #: ids of names, they are loaded at the first change of the index
+        self._name_ids: Optional[Dict[str, int]] = None
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        """
+        Creates tables of the index, drops them first if the schema version was changed
+        """
+        connection: sqlite3.Connection = self.connection
+        connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        row: Optional[Tuple[str]] = connection.execute(
+            "SELECT value FROM meta WHERE key = 'schema_version'"
+        ).fetchone()
+        if row and row[0] != str(SCHEMA_VERSION):
+            for table in TABLES:
+                connection.execute('DROP TABLE IF EXISTS %s' % table)
+            self._touch()
+        # bytecode is 1 if the content was scanned with reading of up to date pyc files
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS contents ('
+            'id INTEGER PRIMARY KEY, hash TEXT NOT NULL, bytecode INTEGER NOT NULL, UNIQUE (hash, bytecode))'
+        )
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, root TEXT NOT NULL, '
+            'mtime INTEGER NOT NULL, size INTEGER NOT NULL, content_id INTEGER NOT NULL REFERENCES contents (id))'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS files_root ON files (root)')
+        connection.execute('CREATE INDEX IF NOT EXISTS files_content_id ON files (content_id)')
+        # a module is a path of a member of a zip archive relative to the archive (e.g. */inner/path.py*)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS declarations ('
+            'content_id INTEGER NOT NULL REFERENCES contents (id), '
+            'type TEXT NOT NULL, name_id INTEGER NOT NULL REFERENCES names (id), module TEXT)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS declarations_content_id ON declarations (content_id)')
+        connection.execute('CREATE INDEX IF NOT EXISTS declarations_name_id ON declarations (name_id)')
+        connection.execute('CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS trigrams ('
+            'gram TEXT NOT NULL, name_id INTEGER NOT NULL, PRIMARY KEY (gram, name_id)) WITHOUT ROWID'
+        )
+        connection.execute('CREATE TEMP TABLE IF NOT EXISTS matched_names (id INTEGER PRIMARY KEY)')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS distribution_roots (root TEXT PRIMARY KEY, signature TEXT NOT NULL)'
+        )
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS distribution_files ('
+            'path TEXT PRIMARY KEY, root TEXT NOT NULL, name TEXT NOT NULL, version TEXT NOT NULL)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS distribution_files_root ON distribution_files (root)')
+        connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),)
+        )
+        connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', ?)", (os.urandom(8).hex(),))
+        connection.commit()
+
+    def _touch(self) -> None:
+        """
+        Changes the generation of the index, it is done on each change of stored declarations
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (os.urandom(8).hex(),)
+        )
+
+    def get_generation(self) -> str:
+        """
+        Returns a random token which is changed on each change of stored declarations,
+        so copies of the index (e.g. the binary index) can detect that they are outdated
+
+        :return: a hex string
+        :rtype: str
+        """
+        return self.connection.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def close(self) -> None:
+        """
+        Closes the database connection
+        """
+        self.connection.close()
+
+    def clear(self) -> None:
+        """
+        Removes all files and declarations from the index, the next refresh will rebuild it
+        """
+        for table in TABLES:
+            self.connection.execute('DELETE FROM %s' % table)
+        self._name_ids = None
+        self._touch()
+        self.connection.commit()
+
+    def _remove_file(self, file_id: int) -> None:
+        self.connection.execute('DELETE FROM files WHERE id = ?', (file_id,))  # see *_remove_unused_contents*
+
+    def _remove_unused_contents(self) -> None:
+        """
+        Removes contents and their declarations which are not referenced by files anymore
+        """
+        self.connection.execute(
+            'DELETE FROM declarations WHERE content_id NOT IN (SELECT content_id FROM files)'
+        )
+        self.connection.execute('DELETE FROM contents WHERE id NOT IN (SELECT content_id FROM files)')
+
+    def _get_name_id(self, name: str) -> int:
+        """
+        Returns an id of a name, a new name is stored together with its trigrams
+
+        :param name: a name of a declaration
+        :type name: str
+        :return: an id of the name
+        :rtype: int
+        """
+        if self._name_ids is None:
+            self._name_ids = {name: name_id for name_id, name in self.connection.execute('SELECT id, name FROM names')}
+        name_id: Optional[int] = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self.connection.execute('INSERT INTO names (name) VALUES (?)', (name,)).lastrowid
+            self.connection.executemany(
+                'INSERT INTO trigrams (gram, name_id) VALUES (?, ?)',
+                ((trigram, name_id) for trigram in get_trigrams(name))
+            )
+            self._name_ids[name] = name_id
+        return name_id
+
+    def _add_content(self, digest: str, bytecode: bool, file_path: str, declarations: List[Declaration]) -> int:
+        """
+        Stores declarations of a content of python files in the index.
+        Declarations of a zip archive keep paths of its members relative to the archive (e.g. */inner/path.py*)
+
+        :param digest: A hash of the content, see *get_file_hash*
+        :type digest: str
+        :param bytecode: the content was scanned with reading of up to date pyc files
+        :type bytecode: bool
+        :param file_path: A path to a scanned python file with this content
+        :type file_path: str
+        :param declarations: Declarations found in the file
+        :type declarations: List[Declaration]
+        :return: an id of the content
+        :rtype: int
+        """
+        content_id: int = self.connection.execute(
+            'INSERT INTO contents (hash, bytecode) VALUES (?, ?)', (digest, int(bytecode))
+        ).lastrowid
+        self.connection.executemany(
+            'INSERT INTO declarations (content_id, type, name_id, module) VALUES (?, ?, ?, ?)',
+            (
+                (
+                    content_id,
+                    declaration.declaration_type.name,
+                    self._get_name_id(declaration.name),
+                    declaration.module_path[len(file_path):] if declaration.module_path != file_path else None,
+                )
+                for declaration in declarations
+            )
+        )
+        return content_id
+
+    def _add_file(self, file_path: str, root: str, mtime: int, size: int, content_id: int) -> None:
+        """
+        Stores a python file with an already stored content in the index
+
+        :param file_path: A path to a python file
+        :type file_path: str
+        :param root: A search path where the file was found
+        :type root: str
+        :param mtime: A modification time of the file in nanoseconds
+        :type mtime: int
+        :param size: A size of the file
+        :type size: int
+        :param content_id: An id of the content of the file
+        :type content_id: int
+        """
+        self.connection.execute(
+            'INSERT INTO files (path, root, mtime, size, content_id) VALUES (?, ?, ?, ?, ?)',
+            (file_path, root, mtime, size, content_id)
+        )
+
+    def refresh(
+            self,
+            search_paths: List[str],
+            jobs: int = 1,
+            on_decode: Optional[DecodeCallback] = None,
+            bytecode: bool = True,
+            io_threads: int = 1,
+    ) -> int:
+        """
+        Brings the index up to date with search paths.
+        Only files which were added or changed since the last refresh are hashed,
+        a file is scanned only if its content is not in the index yet,
+        declarations of removed files are dropped
+
+        :param search_paths: A list of search paths (e.g. folders from sys.path)
+        :type search_paths: List[str]
+        :param jobs: A count of worker processes used to scan changed files, zero means a count of CPU cores
+        :type jobs: int
+        :param on_decode: an optional picklable callback, which receives a path to a file,
+            an encoding and a strategy used to decode the file (e.g. print_decoding)
+        :type on_decode: Optional[DecodeCallback]
+        :param bytecode: read declarations from up to date pyc files instead of sources
+        :type bytecode: bool
+        :param io_threads: A count of threads which list folders, stat and read files if *jobs* is 1
+        :type io_threads: int
+        :return: a count of scanned files
+        :rtype: int
+        """
+        changed_files: Dict[str, Tuple[str, int, int]] = {}  # path: (root, mtime, size)
+        known_files: Dict[str, Tuple[int, str, int, int, bool]] = {}  # path: (id, root, mtime, size, bytecode)
+        for root in search_paths:
+            for file_id, path, mtime, size, scanned_bytecode in self.connection.execute(
+                    'SELECT files.id, path, mtime, size, bytecode FROM files '
+                    'JOIN contents ON contents.id = files.content_id WHERE root = ?', (root,)
+            ):
+                known_files[path] = (file_id, root, mtime, size, bool(scanned_bytecode))
+        for root, file_path, stat in stat_python_files(search_paths, io_threads=io_threads, extensions=True):
+            if stat is None:
+                continue
+            known: Optional[Tuple[int, str, int, int, bool]] = known_files.pop(file_path, None)
+            if known:
+                if known[1:] == (root, stat.st_mtime_ns, stat.st_size, bytecode):
+                    continue  # the file was not changed since the last refresh
+                self._remove_file(known[0])
+            else:
+                row: Optional[Tuple[int]] = self.connection.execute(
+                    'SELECT id FROM files WHERE path = ?', (file_path,)
+                ).fetchone()
+                if row:
+                    self._remove_file(row[0])  # the file was indexed from another search path
+            changed_files[file_path] = (root, stat.st_mtime_ns, stat.st_size)
+        for known in known_files.values():
+            self._remove_file(known[0])  # the file was removed
+        return self._store_files(
+            changed_files, bool(known_files), jobs=jobs, on_decode=on_decode, bytecode=bytecode, io_threads=io_threads,
+        )
+
+    def update_files(
+            self,
+            file_roots: Dict[str, str],
+            jobs: int = 1,
+            on_decode: Optional[DecodeCallback] = None,
+            bytecode: bool = True,
+            io_threads: int = 1,
+    ) -> int:
+        """
+        Brings the index up to date with some files without walking search paths (e.g. on events of a watcher).
+        A removed path is dropped from the index together with files under it, if it was a folder
+
+        :param file_roots: paths of changed, added or removed python files (or removed folders): their search paths
+        :type file_roots: Dict[str, str]
+        :param jobs: A count of worker processes used to scan changed files, zero means a count of CPU cores
+        :type jobs: int
+        :param on_decode: an optional picklable callback, which receives a path to a file,
+            an encoding and a strategy used to decode the file (e.g. print_decoding)
+        :type on_decode: Optional[DecodeCallback]
+        :param bytecode: read declarations from up to date pyc files instead of sources
+        :type bytecode: bool
+        :param io_threads: A count of threads which read files if *jobs* is 1
+        :type io_threads: int
+        :return: a count of scanned files
+        :rtype: int
+        """
+        changed_files: Dict[str, Tuple[str, int, int]] = {}  # path: (root, mtime, size)
+        removed: bool = False
+        for file_path, root in file_roots.items():
+            row: Optional[Tuple[int, str, int, int, int]] = self.connection.execute(
+                'SELECT files.id, root, mtime, size, bytecode FROM files '
+                'JOIN contents ON contents.id = files.content_id WHERE path = ?', (file_path,)
+            ).fetchone()
+            try:
+                stat: Optional[os.stat_result] = os.stat(file_path)
+            except OSError:
+                stat = None
+            if stat is None or not os.path.isfile(file_path):
+                # files under a folder are in the range of paths from *folder/* to *folder0* (the next character)
+                for file_id, in self.connection.execute(
+                        'SELECT id FROM files WHERE path = ? OR (path > ? AND path < ?)',
+                        (file_path, os.path.join(file_path, ''), file_path + chr(ord(os.sep) + 1)),
+                ).fetchall():
+                    self._remove_file(file_id)  # the file or the folder was removed
+                    removed = True
+                continue
+            if row:
+                if row[1:] == (root, stat.st_mtime_ns, stat.st_size, int(bytecode)):
+                    continue
+                self._remove_file(row[0])
+            changed_files[file_path] = (root, stat.st_mtime_ns, stat.st_size)
+        return self._store_files(
+            changed_files, removed, jobs=jobs, on_decode=on_decode, bytecode=bytecode, io_threads=io_threads,
+        )
+
+    def _store_files(
+            self,
+            changed_files: Dict[str, Tuple[str, int, int]],
+            removed: bool,
+            jobs: int = 1,
+            on_decode: Optional[DecodeCallback] = None,
+            bytecode: bool = True,
+            io_threads: int = 1,
+    ) -> int:
+        """
+        Stores changed files which were removed from the index before,
+        a file is hashed and it is scanned only if its content is not in the index yet
+
+        :param changed_files: paths of changed files: their search paths, mtimes and sizes
+        :type changed_files: Dict[str, Tuple[str, int, int]]
+        :param removed: some files were removed from the index
+        :type removed: bool
+        :return: a count of scanned files
+        :rtype: int
+        """
+        new_contents: Dict[str, List[str]] = {}  # a hash: paths of files with this new content
+        for file_path in changed_files:
+            digest: Optional[str] = get_file_hash(file_path)
+            if digest is None:
+                continue  # the file was removed after it was found
+            row: Optional[Tuple[int]] = self.connection.execute(
+                'SELECT id FROM contents WHERE hash = ? AND bytecode = ?', (digest, int(bytecode))
+            ).fetchone()
+            if row:
+                self._add_file(file_path, *changed_files[file_path], content_id=row[0])
+            else:
+                new_contents.setdefault(digest, []).append(file_path)
+        scanned: Dict[str, str] = {file_paths[0]: digest for digest, file_paths in new_contents.items()}
+        for file_path, declarations in scan_files(
+                scanned, jobs=jobs, on_decode=on_decode, bytecode=bytecode, io_threads=io_threads,
+        ):
+            digest = scanned[file_path]
+            content_id: int = self._add_content(digest, bytecode, file_path, declarations)
+            for same_path in new_contents[digest]:
+                self._add_file(same_path, *changed_files[same_path], content_id=content_id)
+        if removed or changed_files:
+            self._remove_unused_contents()
+            self._touch()
+        self.connection.commit()
+        return len(scanned)
+
+    def match_names(self, accept: Callable[[str], bool]) -> int:
+        """
+        Stores ids of names accepted by a predicate in the *matched_names* temporary table.
+        Candidates are narrowed using the trigram index before they are verified by the predicate,
+        candidates of a fuzzy query are names containing at least *min_shared* trigrams of the query,
+        names of a predicate with the *names* attribute (e.g. NameSet) are looked up by the unique index of names
+
+        :param accept: a predicate for names of declarations (e.g. NameFilter)
+        :type accept: Callable[[str], bool]
+        :return: a count of matched names
+        :rtype: int
+        """
+        exact_names: Optional[List[str]] = getattr(accept, 'names', None)
+        if exact_names is not None:
+            exact_names = sorted(exact_names)
+            return self._store_matched_names([
+                row for start in range(0, len(exact_names), MAX_VARIABLES)
+                for row in self.connection.execute(
+                    'SELECT id, name FROM names WHERE name IN (%s)' % ', '.join(
+                        ['?'] * len(exact_names[start:start + MAX_VARIABLES])
+                    ),
+                    exact_names[start:start + MAX_VARIABLES],
+                )
+            ], accept)
+        trigrams: List[str] = sorted(get_query_trigrams(accept))
+        min_shared: int = get_min_shared(accept, set(trigrams))
+        if trigrams and 0 < min_shared < len(trigrams):
+            rows: Iterator[Tuple[int, str]] = self.connection.execute(
+                'SELECT id, name FROM names WHERE id IN ('
+                'SELECT name_id FROM trigrams WHERE gram IN (%s) GROUP BY name_id HAVING COUNT(*) >= ?'
+                ')' % ', '.join(['?'] * len(trigrams)),
+                trigrams + [min_shared],
+            )
+        elif trigrams and min_shared > 0:
+            rows = self.connection.execute(
+                'SELECT id, name FROM names WHERE id IN (%s)' % ' INTERSECT '.join(
+                    ['SELECT name_id FROM trigrams WHERE gram = ?'] * len(trigrams)
+                ),
+                trigrams,
+            )
+        else:
+            rows = self.connection.execute('SELECT id, name FROM names')
+        return self._store_matched_names(rows, accept)
+
+    def _store_matched_names(self, rows: Iterable[Tuple[int, str]], accept: Callable[[str], bool]) -> int:
+        matched: List[Tuple[int]] = [(name_id,) for name_id, name in rows if accept(name)]
+        self.connection.execute('DELETE FROM matched_names')
+        self.connection.executemany('INSERT INTO matched_names (id) VALUES (?)', matched)
+        return len(matched)
+
+    def declarations(
+            self,
+            search_paths: List[str],
+            accept: Optional[Callable[[str], bool]] = None,
+    ) -> Iterator[Declaration]:
+        """
+        This generator yields declarations stored in the index in order of search paths
+
+        :param search_paths: A list of search paths (e.g. folders from sys.path)
+        :type search_paths: List[str]
+        :param accept: an optional predicate for names of declarations (e.g. NameFilter),
+            names are looked up using the trigram index
+        :type accept: Optional[Callable[[str], bool]]
+        :return: a generator of declarations
+        :rtype: Iterator[Declaration]
+        """
+        types: Dict[str, DeclarationType] = {
+            declaration_type.name: declaration_type for declaration_type in get_declaration_types()
+        }
+        # matched names drive the query, so declarations are looked up by the index of name ids
+        matched_join: str = 'matched_names CROSS JOIN ' if accept is not None else ''
+        query: str = (
+            'SELECT declarations.type, names.name, COALESCE(files.path || declarations.module, files.path) '
+            'FROM %sdeclarations '
+            'JOIN names ON names.id = declarations.name_id '
+            'JOIN files ON files.content_id = declarations.content_id '
+            'WHERE files.root = ? %s'
+            'ORDER BY files.path, declarations.rowid'
+        ) % (matched_join, 'AND declarations.name_id = matched_names.id ' if matched_join else '')
+        if accept is not None and not self.match_names(accept):
+            return
+        for root in search_paths:
+            for type_name, name, path in self.connection.execute(query, (root,)):
+                declaration_type: Optional[DeclarationType] = types.get(type_name)
+                if declaration_type:
+                    yield Declaration(
+                        declaration_type=declaration_type, name=sys.intern(name), module_path=sys.intern(path)
+                    )
+
+    def distributions(self, search_paths: List[str]) -> Dict[str, Distribution]:
+        """
+        Returns a map of normalized paths of installed files to distributions.
+        The map of a search path is rebuilt only if the set of its *.dist-info* and *.egg-info* folders was changed
+
+        :param search_paths: A list of search paths (e.g. folders from sys.path)
+        :type search_paths: List[str]
+        :return: a map of normalized paths to distributions
+        :rtype: Dict[str, Distribution]
+        """
+        distributions: Dict[str, Distribution] = {}
+        for root in search_paths:
+            signature: str = '\n'.join(get_distribution_folders(root))
+            row: Optional[Tuple[str]] = self.connection.execute(
+                'SELECT signature FROM distribution_roots WHERE root = ?', (root,)
+            ).fetchone()
+            if not row or row[0] != signature:
+                self.connection.execute('DELETE FROM distribution_files WHERE root = ?', (root,))
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO distribution_files (path, root, name, version) VALUES (?, ?, ?, ?)',
+                    (
+                        (file_path, root, name, version)
+                        for file_path, (name, version) in get_search_path_distributions(root)
+                    )
+                )
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO distribution_roots (root, signature) VALUES (?, ?)', (root, signature)
+                )
+                self.connection.commit()
+            for path, name, version in self.connection.execute(
+                    'SELECT path, name, version FROM distribution_files WHERE root = ?', (root,)
+            ):
+                distributions.setdefault(path, (name, version))
+        return distributions
@@ -0,0 +1,117 @@
+"""
+This module provides the command line interface of 'whatprovides' project
+
+Arguments are parsed before the core module (*whatprovides.whatprovides*) is imported,
+so *--help* and errors of arguments do not pay for the import of the core and its dependencies.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import argparse
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """
+    Returns the parser of the command line
+
+    :return: the parser of the command line
+    :rtype: argparse.ArgumentParser
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(prog='whatprovides')
+    parser.add_argument('-r', help='enables search using a regex pattern', action='store_true')
+    parser.add_argument('-i', help='ignore case', action='store_true')
+    parser.add_argument('--batch', help='search for exact names read from FILE (one name per line, - means stdin) '
+                                        'in a single pass, results are grouped by names', metavar='FILE')
+    parser.add_argument('--fuzzy', help='typo tolerant search of names close to the search string, '
+                                        'results are ranked by the edit distance', action='store_true')
+    parser.add_argument('-x', help='search for an exact name or for names starting with a prefix if the search '
+                                   'string ends with *, names are looked up by a binary search in the memory-mapped '
+                                   'binary index, python files are checked for changes at most once a minute, '
+                                   'so a change of a file nested in a search path can be found up to a minute '
+                                   'later (unless a search path is modified or the index is kept up to date '
+                                   'by --watch), use --no-refresh to never check them',
+                        action='store_true')
+    parser.add_argument('--prefix', help='complete names starting with the search string, the best declaration of '
+                                         'each name is shown, names are ranked by the position of a search path in '
+                                         'the PYTHON PATH, then by the type of a declaration (classes, functions, '
+                                         'variables), top 20 or --limit N completions are shown',
+                        action='store_true')
+    parser.add_argument('--module', help='list declarations of a module by its dotted name (e.g. pkg.mod) with '
+                                         'import statements, the search string is optional, '
+                                         'can be used several times', metavar='NAME', action='append', default=[])
+    parser.add_argument('--show-import', help='show a statement which imports a declaration, '
+                                              'e.g. from argparse import ArgumentParser', action='store_true')
+    parser.add_argument('--no-refresh', help='use the declarations index (or the binary index with -x) as is, '
+                                             'do not check python files for changes, e.g. the index is kept up to '
+                                             'date by --watch', action='store_true')
+    parser.add_argument('search', help='a regex pattern (if using -r) or string to search for', nargs='?')
+    parser.add_argument('-v', help='show only variables, this option can be combined with the -c or -d options',
+                        action='store_true')
+    parser.add_argument('-c', help='show only classes, this option can be combined with the -v or -d options',
+                        action='store_true')
+    parser.add_argument('-d', help='show only functions, this option can be combined with the -v or -c options',
+                        action='store_true')
+    parser.add_argument('-e', help='show only compiled extension modules (ext) and symbols exported by them (sym), '
+                                   'this option can be combined with the -v, -c or -d options, '
+                                   'extension modules are not shown without it', action='store_true')
+    parser.add_argument('--rebuild', help='rebuild the declarations index before search', action='store_true')
+    parser.add_argument('--no-cache', help='do not use the declarations index, scan python files directly',
+                        action='store_true')
+    parser.add_argument('-j', help='scan python files using N worker processes, 0 means a count of CPU cores',
+                        metavar='N', type=int, default=1)
+    parser.add_argument('--io-threads', help='list folders and read files using N threads, it speeds up the scan '
+                                             'on network filesystems, by default 16 on NFS, CIFS, sshfs and other '
+                                             'network filesystems, otherwise 1', metavar='N', type=int)
+    parser.add_argument('--show-encoding', help='print an encoding and a strategy used to decode each scanned file '
+                                                'to stderr', action='store_true')
+    parser.add_argument('--exclude', help='skip folders and files matching a name or a glob pattern, '
+                                          'can be used several times', metavar='GLOB', action='append', default=[])
+    parser.add_argument('--show-dist', help='show a distribution which provides a declaration',
+                        action='store_true')
+    parser.add_argument('--dist', help='show only declarations provided by a distribution, implies --show-dist',
+                        metavar='NAME')
+    parser.add_argument('--serve', help='run a daemon which holds declarations in memory and answers queries '
+                                        'over a Unix domain socket, changes of files are applied before each query, '
+                                        'searches with --no-refresh, --exclude, --no-bytecode or --show-encoding '
+                                        'do not query it', action='store_true')
+    parser.add_argument('--watch', help='watch search paths (using inotify on Linux) and keep the declarations '
+                                        'index up to date, only changed python files are scanned',
+                        action='store_true')
+    parser.add_argument('--no-daemon', help='do not query the daemon even if it is running', action='store_true')
+    parser.add_argument('--path', help='search in this folder or zip archive instead of the PYTHON PATH, '
+                                       'can be used several times', action='append', default=[])
+    parser.add_argument('--python', help='search in the PYTHON PATH of this interpreter instead of the current one, '
+                                         'can be used several times', metavar='EXE', action='append', default=[])
+    parser.add_argument('--venv', help='search in this virtual environment (read from its pyvenv.cfg) instead of '
+                                       'the current one, can be used several times', metavar='DIR',
+                        action='append', default=[])
+    parser.add_argument('--no-bytecode', help='always scan sources, do not read declarations from up to date '
+                                              'cached bytecode (.pyc)', action='store_true')
+    parser.add_argument('--limit', help='stop the search after N results', metavar='N', type=int)
+    parser.add_argument('--first', help='stop the search after the first result, the same as --limit 1',
+                        action='store_true')
+    parser.add_argument('--import-order', help='sort results in the order python imports them: by the position of '
+                                               'a search path in the PYTHON PATH, then by the depth of a module',
+                        action='store_true')
+    parser.add_argument('--stats', help='print time of each stage, counts of processed files, bytes and lines, '
+                                        'encodings and the slowest files to stderr', action='store_true')
+    parser.add_argument('--profile', help='profile the search using cProfile and dump pstats to FILE',
+                        metavar='FILE')
+    return parser
+
+
+def main() -> None:
+    """
+    Parses arguments of the command line and runs the search (see *whatprovides.run*)
+    """
+    parser: argparse.ArgumentParser = get_parser()
+    args: argparse.Namespace = parser.parse_args()
+    from .whatprovides import run  # the core is imported after arguments are parsed
+    run(args, parser)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+This module provides a resident daemon for 'whatprovides' project
+
+The daemon holds declarations in memory and answers queries over a local Unix domain socket.
+The protocol is line based: a client sends one JSON object per query
+(*{"search": ..., "regex": false, "ignore_case": false, "fuzzy": false}* or *{"names": [...]}* in the batch mode),
+the daemon answers with one JSON list *[type, name, module_path]* per found declaration and a *null* line at the end.
+Each client is served in its own thread, queries only read the current snapshot of declarations,
+so clients do not block each other. Folders of search paths are watched (see *watch.IndexWatcher*),
+before a query is answered changes of files are applied to the declarations index, and the snapshot is replaced
+if the generation of the index differs from the generation of the snapshot (the index can be changed
+by other processes too), so answers are the same as answers of a search without the daemon.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import os
+import sys
+import json
+import socket
+import signal
+import hashlib
+import sqlite3
+import threading
+import socketserver
+from typing import List, Dict, Set, Iterator, Optional, Callable, Any, BinaryIO
+from .whatprovides import DeclarationType, get_declaration_types, Declaration, NameFilter, NameSet, get_cache_path
+from .trigram import TrigramIndex
+from .fuzzy import FuzzyQuery
+from .cache import DeclarationIndex
+from .watch import IndexWatcher
+
+#: an interval in seconds between checks of changes of files when the daemon is not queried,
+#: each query checks changes before it is answered
+SYNC_INTERVAL: float = 2.0
+
+#: a timeout in seconds of a connection to the daemon
+CLIENT_TIMEOUT: float = 30.0
+
+
+def get_socket_path(search_paths: List[str]) -> str:
+    """
+    Returns a path to the socket of the daemon serving search paths,
+    different environments get different sockets
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :return: a path to the socket
+    :rtype: str
+    """
+    key: str = hashlib.sha1('\0'.join([sys.executable] + search_paths).encode('utf-8', 'replace')).hexdigest()
+    return os.path.join(os.path.dirname(get_cache_path()), 'daemon-%s.sock' % key[:12])
+
+
+class DeclarationStore:
+    """
+    An in-memory snapshot of declarations with a trigram index of their names
+
+    :param declarations: declarations in order of search paths
+    :type declarations: Iterator[Declaration]
+    :param generation: the generation of the declarations index the snapshot was loaded from
+    :type generation: str
+    """
+
+    def __init__(self, declarations: Iterator[Declaration], generation: str = ''):
+        self.generation: str = generation
+        self.declarations: List[Declaration] = list(declarations)
+        self.names: TrigramIndex = TrigramIndex()
+        #: an id of a name: positions of declarations with this name in *self.declarations*
+        self.positions: Dict[int, List[int]] = {}
+        for position, declaration in enumerate(self.declarations):
+            self.positions.setdefault(self.names.add(declaration.name), []).append(position)
+
+    def search(self, accept: Callable[[str], bool]) -> List[Declaration]:
+        """
+        Returns declarations with names accepted by a filter in order of search paths
+
+        :param accept: a filter of names of declarations (NameFilter, FuzzyQuery or NameSet)
+        :type accept: Callable[[str], bool]
+        :return: a list of declarations
+        :rtype: List[Declaration]
+        """
+        positions: List[int] = []
+        for name in self.names.search(accept):
+            positions.extend(self.positions[self.names.ids[name]])
+        return [self.declarations[position] for position in sorted(positions)]
+
+
+class DeclarationRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answers queries of a client until it closes the connection
+    """
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request: Dict[str, Any] = json.loads(line.decode('utf-8'))
+                if 'names' in request:
+                    accept: Callable[[str], bool] = NameSet(request['names'])
+                elif request.get('fuzzy'):
+                    accept = FuzzyQuery(request['search'])
+                else:
+                    accept = NameFilter(
+                        search=request['search'],
+                        regex=bool(request.get('regex')),
+                        ignore_case=bool(request.get('ignore_case')),
+                    )
+                self.server.sync()
+                declarations: List[Declaration] = self.server.store.search(accept)
+            except Exception as e:  # a broken request must not stop the daemon
+                self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8') + b'\n')
+                continue
+            try:
+                for declaration in declarations:
+                    self.wfile.write(json.dumps(
+                        [declaration.declaration_type.name, declaration.name, declaration.module_path]
+                    ).encode('utf-8') + b'\n')
+                self.wfile.write(b'null\n')
+                self.wfile.flush()
+            except OSError:
+                return  # the client stopped reading results, e.g. after the first one
+
+
+class DeclarationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A threading Unix domain socket server of declarations
+
+    :param socket_path: A path to the socket
+    :type socket_path: str
+    :param store: an initial snapshot of declarations
+    :type store: DeclarationStore
+    :param index_watcher: an optional watcher which keeps the declarations index of the snapshot up to date,
+        its index must allow other threads, without a watcher the snapshot is never changed
+    :type index_watcher: Optional[IndexWatcher]
+    """
+    daemon_threads: bool = True
+
+    def __init__(self, socket_path: str, store: DeclarationStore, index_watcher: Optional[IndexWatcher] = None):
+        self.store: DeclarationStore = store
+        self.index_watcher: Optional[IndexWatcher] = index_watcher
+        #: serializes changes of the index, queries keep reading the current snapshot meanwhile
+        self.lock: threading.Lock = threading.Lock()
+        #: the last sync failed, changes of files could be lost, so the next sync checks all files
+        self.failed: bool = False
+        super().__init__(socket_path, DeclarationRequestHandler)
+
+    def sync(self) -> None:
+        """
+        Applies changes of files to the declarations index and replaces the snapshot if the index was changed.
+        Errors are reported to stderr, the previous snapshot is served until a successful sync,
+        which checks all files
+        """
+        index_watcher: Optional[IndexWatcher] = self.index_watcher
+        if index_watcher is None:
+            return
+        with self.lock:
+            try:
+                paths: Optional[Set[str]] = None if self.failed else index_watcher.watcher.changes(0.0)
+                if paths is None or paths:
+                    index_watcher.apply(paths)
+                generation: str = index_watcher.index.get_generation()
+                if generation != self.store.generation:
+                    self.store = DeclarationStore(
+                        index_watcher.index.declarations(index_watcher.search_paths), generation,
+                    )
+                self.failed = False
+            except Exception as e:  # the daemon must keep serving
+                self.failed = True
+                print('whatprovides daemon can not refresh declarations: %s' % e, file=sys.stderr)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self.index_watcher is not None:
+            self.index_watcher.watcher.close()
+            self.index_watcher.index.close()
+
+
+def create_server(search_paths: List[str], jobs: int = 1, io_threads: int = 1) -> DeclarationServer:
+    """
+    Refreshes the declarations index, starts watching folders of search paths
+    and creates a server of a snapshot of all declarations of the index
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param jobs: A count of worker processes used to scan changed files, zero means a count of CPU cores
+    :type jobs: int
+    :param io_threads: A count of threads which list folders, stat and read files if *jobs* is 1
+    :type io_threads: int
+    :return: the server, it is not started
+    :rtype: DeclarationServer
+    :raises RuntimeError: if the daemon is already running
+    """
+    socket_path: str = get_socket_path(search_paths)
+    if os.path.exists(socket_path):
+        client: Optional[socket.socket] = connect(socket_path)
+        if client:
+            client.close()
+            raise RuntimeError('the daemon is already running on "%s"' % socket_path)
+        os.remove(socket_path)  # a socket left by a killed daemon
+    index: DeclarationIndex = DeclarationIndex(get_cache_path(), check_same_thread=False)
+    try:
+        index_watcher: IndexWatcher = IndexWatcher(search_paths, index, jobs=jobs, io_threads=io_threads)
+        index_watcher.start()
+        store: DeclarationStore = DeclarationStore(index.declarations(search_paths), index.get_generation())
+    except (OSError, sqlite3.Error):
+        index.close()
+        raise
+    return DeclarationServer(socket_path, store, index_watcher)
+
+
+def serve(
+        search_paths: List[str],
+        jobs: int = 1,
+        sync_interval: float = SYNC_INTERVAL,
+        io_threads: int = 1,
+) -> None:
+    """
+    Runs the daemon serving search paths until it is interrupted.
+    Changes of files are applied before each query and every *sync_interval* seconds in a background thread
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param jobs: A count of worker processes used to scan changed files, zero means a count of CPU cores
+    :type jobs: int
+    :param sync_interval: an interval in seconds between checks of changes when the daemon is not queried
+    :type sync_interval: float
+    :param io_threads: A count of threads which list folders, stat and read files if *jobs* is 1
+    :type io_threads: int
+    :raises RuntimeError: if the daemon is already running
+    """
+    server: DeclarationServer = create_server(search_paths, jobs=jobs, io_threads=io_threads)
+    stopped: threading.Event = threading.Event()
+
+    def sync() -> None:
+        while not stopped.wait(sync_interval):
+            server.sync()  # errors are reported by the server, so the thread is not stopped
+
+    threading.Thread(target=sync, daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # removes the socket on termination
+    print('whatprovides daemon is listening on "%s"' % server.server_address, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        stopped.set()
+        with server.lock:
+            server.server_close()
+        os.remove(server.server_address)
+
+
+def connect(socket_path: str) -> Optional[socket.socket]:
+    """
+    Connects to the daemon, returns None if the daemon is not running
+
+    :param socket_path: A path to the socket
+    :type socket_path: str
+    :return: a connected socket or None
+    :rtype: Optional[socket.socket]
+    """
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+    client: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(CLIENT_TIMEOUT)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def query(search_paths: List[str], accept: Callable[[str], bool]) -> Optional[Iterator[Declaration]]:
+    """
+    Queries the daemon serving search paths, returns None if the daemon is not running or can not answer.
+    Found declarations are yielded as they are received, so a consumer can stop early (e.g. --first)
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param accept: a filter of names of declarations (NameFilter, FuzzyQuery or NameSet)
+    :type accept: Callable[[str], bool]
+    :return: a generator of found declarations or None
+    :rtype: Optional[Iterator[Declaration]]
+    """
+    client: Optional[socket.socket] = connect(get_socket_path(search_paths))
+    if client is None:
+        return None
+    if isinstance(accept, NameSet):
+        request: Dict[str, Any] = {'names': sorted(accept.names)}
+    elif isinstance(accept, FuzzyQuery):
+        request = {'search': accept.search, 'fuzzy': True}
+    else:
+        request = {
+            'search': accept.pattern.pattern if accept.pattern else accept.search,
+            'regex': accept.regex,
+            'ignore_case': accept.ignore_case,
+        }
+    stream: BinaryIO = client.makefile('rwb')
+    try:
+        stream.write(json.dumps(request).encode('utf-8') + b'\n')
+        stream.flush()
+        first: Any = json.loads(stream.readline().decode('utf-8'))  # the daemon answers after it is synced
+    except (OSError, ValueError) as e:
+        print('whatprovides daemon is not available: %s' % e, file=sys.stderr)
+        first = {}
+    if isinstance(first, dict):
+        if 'error' in first:
+            print('whatprovides daemon error: %s' % first['error'], file=sys.stderr)
+        stream.close()
+        client.close()
+        return None
+    return _read_declarations(client, stream, first)
+
+
+def _read_declarations(client: socket.socket, stream: BinaryIO, first: Any) -> Iterator[Declaration]:
+    types: Dict[str, DeclarationType] = {
+        declaration_type.name: declaration_type for declaration_type in get_declaration_types()
+    }
+    result: Any = first
+    try:
+        while result is not None:
+            type_name, name, module_path = result
+            if type_name in types:
+                yield Declaration(
+                    declaration_type=types[type_name], name=sys.intern(name), module_path=sys.intern(module_path),
+                )
+            result = json.loads(stream.readline().decode('utf-8'))
+    except (OSError, ValueError, TypeError) as e:
+        print('whatprovides daemon is not available: %s' % e, file=sys.stderr)  # results are incomplete
+    finally:
+        stream.close()
+        client.close()
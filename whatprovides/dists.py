@@ -0,0 +1,194 @@
+"""
+This module maps python files to installed distributions for 'whatprovides' project
+
+The map of paths to distributions is built once from *.dist-info/RECORD* files of wheels
+and *.egg-info/installed-files.txt* files of eggs, so a lookup of a distribution costs O(1).
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import os
+import re
+import csv
+from typing import List, Dict, Tuple, Iterator, Optional
+from .whatprovides import Declaration
+
+#: a distribution name and a version
+Distribution = Tuple[str, str]
+
+#: suffixes of folders containing metadata of installed distributions
+DISTRIBUTION_SUFFIXES: Tuple[str, str] = ('.dist-info', '.egg-info')
+
+
+def normalize_distribution_name(name: str) -> str:
+    """
+    Normalizes a name of a distribution according to PEP 503
+
+    :param name: a name of a distribution
+    :type name: str
+    :return: a normalized name of a distribution
+    :rtype: str
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def normalize_path(path: str) -> str:
+    """
+    Normalizes a path to use it as a key of the map of paths to distributions
+
+    :param path: a path to a file
+    :type path: str
+    :return: a normalized path
+    :rtype: str
+    """
+    return os.path.normcase(os.path.normpath(path))
+
+
+def get_distribution_folders(search_path: str) -> List[str]:
+    """
+    Returns sorted names of folders containing metadata of installed distributions in a search path
+
+    :param search_path: a search path (e.g. site-packages)
+    :type search_path: str
+    :return: a list of names of *.dist-info* and *.egg-info* folders
+    :rtype: List[str]
+    """
+    try:
+        with os.scandir(search_path) as entries:
+            return sorted(entry.name for entry in entries if entry.name.endswith(DISTRIBUTION_SUFFIXES))
+    except OSError:
+        return []
+
+
+def get_distribution(folder_path: str) -> Distribution:
+    """
+    Returns a name and a version of a distribution by its metadata folder.
+    Headers of *METADATA* or *PKG-INFO* are used, the name of the folder is used if they are not available
+
+    :param folder_path: a path to a *.dist-info* or an *.egg-info* folder
+    :type folder_path: str
+    :return: a name and a version of a distribution
+    :rtype: Distribution
+    """
+    name, _, version = os.path.basename(folder_path).rsplit('.', 1)[0].partition('-')
+    version = version.split('-')[0]
+    for metadata_name in ('METADATA', 'PKG-INFO'):
+        try:
+            with open(os.path.join(folder_path, metadata_name), encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    if not line.strip():
+                        break  # the end of headers
+                    key, _, value = line.partition(':')
+                    if key == 'Name':
+                        name = value.strip()
+                    elif key == 'Version':
+                        version = value.strip()
+            break
+        except OSError:
+            continue
+    return name, version
+
+
+def get_distribution_files(folder_path: str) -> List[str]:
+    """
+    Returns paths of files installed by a distribution,
+    *RECORD* paths are relative to the parent of a *.dist-info* folder,
+    *installed-files.txt* paths are relative to an *.egg-info* folder
+
+    :param folder_path: a path to a *.dist-info* or an *.egg-info* folder
+    :type folder_path: str
+    :return: a list of normalized paths of files
+    :rtype: List[str]
+    """
+    files: List[str] = []
+    try:
+        if folder_path.endswith('.dist-info'):
+            base_path: str = os.path.dirname(folder_path)
+            with open(os.path.join(folder_path, 'RECORD'), encoding='utf-8', newline='') as f:
+                for row in csv.reader(f):
+                    if row and row[0]:
+                        files.append(normalize_path(os.path.join(base_path, row[0])))
+        else:
+            with open(os.path.join(folder_path, 'installed-files.txt'), encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        files.append(normalize_path(os.path.join(folder_path, line.strip())))
+    except OSError:
+        pass  # a distribution without a list of installed files (e.g. an editable install)
+    return files
+
+
+def get_search_path_distributions(search_path: str) -> Iterator[Tuple[str, Distribution]]:
+    """
+    This generator yields paths of files and distributions installed them into a search path
+
+    :param search_path: a search path (e.g. site-packages)
+    :type search_path: str
+    :return: a generator of normalized paths of files and distributions
+    :rtype: Iterator[Tuple[str, Distribution]]
+    """
+    for folder_name in get_distribution_folders(search_path):
+        folder_path: str = os.path.join(search_path, folder_name)
+        distribution: Distribution = get_distribution(folder_path)
+        for file_path in get_distribution_files(folder_path):
+            yield file_path, distribution
+
+
+def build_distribution_map(search_paths: List[str]) -> Dict[str, Distribution]:
+    """
+    Builds a map of normalized paths of installed files to distributions
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :return: a map of normalized paths to distributions
+    :rtype: Dict[str, Distribution]
+    """
+    distributions: Dict[str, Distribution] = {}
+    for search_path in search_paths:
+        for file_path, distribution in get_search_path_distributions(search_path):
+            distributions.setdefault(file_path, distribution)
+    return distributions
+
+
+def get_declaration_distribution(
+        declaration: Declaration,
+        distributions: Dict[str, Distribution],
+) -> Optional[Distribution]:
+    """
+    Returns a distribution which provides a declaration or None
+
+    :param declaration: a declaration
+    :type declaration: Declaration
+    :param distributions: a map of normalized paths to distributions
+    :type distributions: Dict[str, Distribution]
+    :return: a distribution or None if the module of the declaration was not installed by a distribution
+    :rtype: Optional[Distribution]
+    """
+    return distributions.get(normalize_path(declaration.module_path))
+
+
+def filter_distribution(
+        name: str,
+        declarations: Iterator[Declaration],
+        distributions: Dict[str, Distribution],
+) -> Iterator[Declaration]:
+    """
+    This generator filters declarations by a name of a distribution which provides them
+
+    :param name: a name of a distribution
+    :type name: str
+    :param declarations: An iterable of declarations
+    :type declarations: Iterator[Declaration]
+    :param distributions: a map of normalized paths to distributions
+    :type distributions: Dict[str, Distribution]
+    :return: generator of filtered declarations
+    :rtype: Iterator[Declaration]
+    """
+    name = normalize_distribution_name(name)
+    for declaration in declarations:
+        distribution: Optional[Distribution] = get_declaration_distribution(declaration, distributions)
+        if distribution and normalize_distribution_name(distribution[0]) == name:
+            yield declaration
@@ -0,0 +1,166 @@
+"""
+This module finds declarations of compiled extension modules for 'whatprovides' project
+
+An extension module (e.g. *foo.cpython-38-x86_64-linux-gnu.so*) can not be scanned as a text,
+and it must not be imported to be searched. Instead, its ELF dynamic symbol table (*.dynsym*)
+and its string table (*.dynstr*) are read from the memory mapped file.
+Only headers, symbols and their names are touched, the file is not copied to memory.
+Exported symbols are matched by *extension_declaration_types*:
+*PyInit_foo* is the *ext* declaration of the *foo* module, other exported symbols are *sym* declarations.
+Shared objects which do not export a *PyInit_* function (e.g. bundled C libraries) are not extension modules.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import sys
+import mmap
+import struct
+from typing import List, Dict, Tuple, Iterator, Optional, Callable
+from .whatprovides import extension_declaration_types, Declaration
+
+ELF_MAGIC: bytes = b'\x7fELF'
+ELFDATA2LSB: int = 1
+SHT_DYNSYM: int = 11
+SHN_UNDEF: int = 0
+STB_GLOBAL: int = 1
+STB_WEAK: int = 2
+STT_OBJECT: int = 1
+STT_FUNC: int = 2
+
+#: an ELF class (32 or 64 bit): (a format of e_shoff, e_shentsize, e_shnum and e_shstrndx in the ELF header,
+#: a format of a section header, a format of a symbol, indexes of st_name, st_info and st_shndx in a symbol)
+ELF_FORMATS: Dict[int, Tuple[str, str, str, Tuple[int, int, int]]] = {
+    1: ('32xI10xHHH', 'IIIIIIIIII', 'IIIBBH', (0, 3, 5)),
+    2: ('40xQ10xHHH', 'IIQQQQIIQQ', 'IBBHQQ', (0, 1, 3)),
+}
+
+
+def get_sections(data: mmap.mmap) -> Tuple[str, List[Tuple[int, ...]]]:
+    """
+    Returns the byte order and section headers of a memory mapped ELF file
+
+    :param data: a memory mapped file
+    :type data: mmap.mmap
+    :return: a byte order for *struct* and a list of section headers, it is empty if the file is not an ELF file
+    :rtype: Tuple[str, List[Tuple[int, ...]]]
+    """
+    if data[:4] != ELF_MAGIC or data[4] not in ELF_FORMATS:
+        return '', []
+    header_format, section_format, _, _ = ELF_FORMATS[data[4]]
+    order: str = '<' if data[5] == ELFDATA2LSB else '>'
+    sh_offset, sh_entsize, sh_num, _ = struct.unpack_from(order + header_format, data, 0)
+    return order, [
+        struct.unpack_from(order + section_format, data, sh_offset + index * sh_entsize) for index in range(sh_num)
+    ]
+
+
+def get_exported_symbols(data: mmap.mmap) -> Iterator[str]:
+    """
+    This generator yields names of functions and objects exported by a memory mapped ELF shared object
+
+    :param data: a memory mapped file
+    :type data: mmap.mmap
+    :return: a generator of names of exported symbols, it is empty if the file is not an ELF file
+    :rtype: Iterator[str]
+    """
+    order, sections = get_sections(data)
+    if not sections:
+        return
+    _, _, symbol_format, (name_index, info_index, shndx_index) = ELF_FORMATS[data[4]]
+    symbol_size: int = struct.calcsize(order + symbol_format)
+    for _, sh_type, _, _, offset, size, link, _, _, _ in sections:
+        if sh_type != SHT_DYNSYM:
+            continue
+        strings_offset: int = sections[link][4]  # the offset of .dynstr
+        with memoryview(data) as view:  # symbols are unpacked from the mapped memory without copying
+            for symbol in struct.iter_unpack(order + symbol_format, view[offset:offset + size - size % symbol_size]):
+                info: int = symbol[info_index]
+                if symbol[shndx_index] == SHN_UNDEF or info >> 4 not in (STB_GLOBAL, STB_WEAK) \
+                        or info & 0xf not in (STT_FUNC, STT_OBJECT):
+                    continue  # an imported or a local symbol, or not a function and not an object
+                start: int = strings_offset + symbol[name_index]
+                yield data[start:data.find(b'\0', start)].decode('ascii', 'replace')
+
+
+def symbols_contain(file_path: str, needle: bytes, ignore_case: bool = False) -> bool:
+    """
+    Checks that names of dynamic symbols (*.dynstr*) of an ELF shared object contain *needle*,
+    only the string table is read, the rest of the file (e.g. the code) is not touched
+
+    :param file_path: A path to an extension module
+    :type file_path: str
+    :param needle: bytes to search for, must be in lower case if *ignore_case* is True
+    :type needle: bytes
+    :param ignore_case: case insensitive search of ASCII letters
+    :type ignore_case: bool
+    :return: True if a name of a symbol can contain *needle*, False if it is not an ELF file or it is broken
+    :rtype: bool
+    :raises OSError: if the file can not be read
+    """
+    with open(file_path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                _, sections = get_sections(data)
+                for _, sh_type, _, _, _, _, link, _, _, _ in sections:
+                    if sh_type == SHT_DYNSYM:
+                        offset, size = sections[link][4:6]  # .dynstr
+                        if ignore_case:
+                            return needle in data[offset:offset + size].lower()
+                        return data.find(needle, offset, offset + size) >= 0
+        except (ValueError, IndexError, struct.error):
+            pass  # an empty, a truncated or not an ELF file
+    return False
+
+
+def get_extension_symbols(file_path: str) -> List[str]:
+    """
+    Returns names of symbols exported by an extension module
+
+    :param file_path: A path to an extension module
+    :type file_path: str
+    :return: a list of names of exported symbols,
+        it is empty if the file is not an ELF extension module or it is broken
+    :rtype: List[str]
+    """
+    try:
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data.find(b'PyInit_') < 0:
+                return []  # not an extension module (e.g. a bundled C library)
+            return list(get_exported_symbols(data))
+    except (OSError, ValueError, IndexError, struct.error):
+        return []  # an empty, a truncated or not an ELF file
+
+
+def get_extension_declarations(
+        file_path: str,
+        accept: Optional[Callable[[str], bool]] = None,
+) -> List[Declaration]:
+    """
+    Returns declarations of an extension module: the module itself by its *PyInit_* function
+    and other exported symbols, matched by *extension_declaration_types*
+
+    :param file_path: A path to an extension module
+    :type file_path: str
+    :param accept: an optional predicate for names of declarations
+    :type accept: Optional[Callable[[str], bool]]
+    :return: a list of declarations
+    :rtype: List[Declaration]
+    """
+    symbols: List[str] = get_extension_symbols(file_path)
+    if not any(symbol.startswith('PyInit_') for symbol in symbols):
+        return []
+    declarations: List[Declaration] = []
+    for symbol in sorted(symbols):
+        for declaration_type in extension_declaration_types:
+            name: str = declaration_type.search(symbol)
+            if name:
+                if accept is None or accept(name):
+                    declarations.append(Declaration(
+                        declaration_type=declaration_type, name=sys.intern(name), module_path=file_path,
+                    ))
+                break
+    declarations.sort(key=lambda declaration: extension_declaration_types.index(declaration.declaration_type))
+    return declarations
@@ -0,0 +1,149 @@
+"""
+This module finds search paths of other python environments for 'whatprovides' project
+
+Search paths of an interpreter are taken from its *sys.path*, the interpreter is run once in a subprocess.
+Search paths of a virtual environment are computed from its *pyvenv.cfg* without running anything:
+*site-packages* of the environment, the standard library of the base interpreter (the *home* key)
+and *site-packages* of the base interpreter if *include-system-site-packages* is true.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import os
+import sys
+import glob
+import json
+import subprocess
+from collections import OrderedDict
+from typing import List, Dict, Tuple
+
+#: a timeout in seconds of a run of an interpreter
+INTERPRETER_TIMEOUT: float = 30.0
+
+#: code which prints sys.path of an interpreter, it must work in old pythons too
+SYS_PATH_CODE: str = 'import sys, json; sys.stdout.write(json.dumps(sys.path))'
+
+#: options which isolate an interpreter from PYTHON* environment variables and the user site-packages,
+#: the first one which is known by the interpreter is used (*-I* is not known before python 3.4)
+ISOLATION_OPTIONS: Tuple[Tuple[str, ...], ...] = (('-I',), ('-E', '-s'))
+
+
+def get_interpreter_paths(executable: str) -> List[str]:
+    """
+    Returns *sys.path* of a python interpreter, it is run isolated (see *ISOLATION_OPTIONS*),
+    so environment variables of the current process (e.g. PYTHONPATH) do not change its *sys.path*
+
+    :param executable: A path to a python interpreter (or a name of it in PATH)
+    :type executable: str
+    :return: a list of paths
+    :rtype: List[str]
+    :raises RuntimeError: if the interpreter can not be run
+    """
+    paths: List[str] = []
+    for index, options in enumerate(ISOLATION_OPTIONS):
+        try:
+            output: bytes = subprocess.run(
+                [executable] + list(options) + ['-c', SYS_PATH_CODE],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                timeout=INTERPRETER_TIMEOUT, check=True, cwd=os.path.abspath(os.sep),  # the cwd is not searched
+            ).stdout
+            paths = json.loads(output.decode('utf-8'))
+            break
+        except subprocess.CalledProcessError as e:
+            if index + 1 == len(ISOLATION_OPTIONS):  # otherwise the options can be unknown by an old interpreter
+                raise RuntimeError('"%s" is not a python interpreter: %s' % (executable, e))
+        except (OSError, subprocess.SubprocessError, ValueError) as e:
+            raise RuntimeError('"%s" is not a python interpreter: %s' % (executable, e))
+    return [path for path in paths if path]
+
+
+def read_pyvenv_cfg(venv_path: str) -> Dict[str, str]:
+    """
+    Reads *pyvenv.cfg* of a virtual environment
+
+    :param venv_path: A path to a virtual environment
+    :type venv_path: str
+    :return: a map of keys to values
+    :rtype: Dict[str, str]
+    :raises RuntimeError: if the folder is not a virtual environment
+    """
+    config: Dict[str, str] = {}
+    try:
+        with open(os.path.join(venv_path, 'pyvenv.cfg'), encoding='utf-8') as f:
+            for line in f:
+                key, separator, value = line.partition('=')
+                if separator:
+                    config[key.strip().lower()] = value.strip()
+    except OSError as e:
+        raise RuntimeError('"%s" is not a virtual environment: %s' % (venv_path, e))
+    return config
+
+
+def get_venv_paths(venv_path: str) -> List[str]:
+    """
+    Returns search paths of a virtual environment computed from its *pyvenv.cfg*
+
+    :param venv_path: A path to a virtual environment
+    :type venv_path: str
+    :return: a list of paths, *site-packages* of the environment go first
+    :rtype: List[str]
+    :raises RuntimeError: if the folder is not a virtual environment,
+        or the version of python is not in *pyvenv.cfg* and it can not be taken from *lib/python3.X/site-packages*
+    """
+    config: Dict[str, str] = read_pyvenv_cfg(venv_path)
+    version: str = '.'.join((config.get('version_info') or config.get('version') or '').split('.')[:2])
+    paths: List[str] = []
+    if sys.platform.startswith('win'):
+        paths.append(os.path.join(venv_path, 'Lib', 'site-packages'))
+    elif version:
+        # lib/python3.8/site-packages, lib/python3.13t/site-packages of a free-threaded build
+        for folder in ('python%s' % version, 'python%st' % version):
+            paths.extend(glob.glob(os.path.join(venv_path, 'lib', folder, 'site-packages')))
+    else:
+        # the version is unknown in pyvenv.cfg of old virtualenv, it is taken from the name of the folder
+        paths.extend(sorted(glob.glob(os.path.join(venv_path, 'lib', 'python3.*', 'site-packages'))))
+        if len(paths) != 1:
+            raise RuntimeError(
+                '"%s": the version of python is not in pyvenv.cfg and %d folders lib/python3.*/site-packages '
+                'are found' % (venv_path, len(paths))
+            )
+    home: str = config.get('home', '')
+    if home:
+        prefix: str = home if sys.platform.startswith('win') else os.path.dirname(home)  # home is the bin folder
+        if sys.platform.startswith('win'):
+            base_paths: List[str] = [os.path.join(prefix, 'Lib'), os.path.join(prefix, 'DLLs')]
+            site_packages: str = os.path.join(prefix, 'Lib', 'site-packages')
+        else:
+            # the folder of the standard library has the same name as the folder of site-packages of the environment
+            lib_name: str = os.path.basename(os.path.dirname(paths[0])) if paths else 'python%s' % version
+            stdlib: str = os.path.join(prefix, 'lib', lib_name)
+            base_paths = [stdlib, os.path.join(stdlib, 'lib-dynload')]
+            site_packages = os.path.join(stdlib, 'site-packages')
+        paths.extend(base_paths)
+        if config.get('include-system-site-packages', '').lower() == 'true':
+            paths.append(site_packages)
+    return paths
+
+
+def get_environment_paths(executables: List[str], venv_paths: List[str]) -> List[str]:
+    """
+    Returns search paths of python interpreters and virtual environments,
+    a path shared by several environments (e.g. the standard library) is returned once
+
+    :param executables: Paths to python interpreters
+    :type executables: List[str]
+    :param venv_paths: Paths to virtual environments
+    :type venv_paths: List[str]
+    :return: a list of paths in order of environments
+    :rtype: List[str]
+    :raises RuntimeError: if an interpreter can not be run or a folder is not a virtual environment
+    """
+    paths: List[str] = []
+    for executable in executables:
+        paths.extend(get_interpreter_paths(executable))
+    for venv_path in venv_paths:
+        paths.extend(get_venv_paths(venv_path))
+    return list(OrderedDict.fromkeys(paths))
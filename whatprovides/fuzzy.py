@@ -0,0 +1,134 @@
+"""
+This module provides typo tolerant search of names of declarations for 'whatprovides' project
+
+A fuzzy query accepts names which are close to the search string by the case insensitive Levenshtein distance:
+the distance must not exceed *FUZZY_MAX_RATIO* of the length of the longer string.
+The edit distance is not computed against every name: candidates are taken from the trigram index
+(in memory or in the declarations index) as names which contain at least *FUZZY_MIN_SHARED*
+of trigrams of the search string, then candidates are verified and results are ranked by the distance.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import math
+from typing import List, Dict, Set, Iterator
+from .whatprovides import Declaration
+from .trigram import TrigramIndex, get_trigrams
+
+#: a maximal edit distance relative to the length of the longer of a search string and a name
+FUZZY_MAX_RATIO: float = 0.4
+
+#: a minimal share of trigrams of a search string which a candidate name must contain
+FUZZY_MIN_SHARED: float = 0.5
+
+
+def get_distance(a: str, b: str, limit: int) -> int:
+    """
+    Returns the Levenshtein distance between two strings,
+    the computation stops as soon as the distance exceeds *limit*
+
+    :param a: a string
+    :type a: str
+    :param b: another string
+    :type b: str
+    :param limit: a maximal distance of interest
+    :type limit: int
+    :return: the distance or *limit* + 1 if the distance is greater than *limit*
+    :rtype: int
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if len(a) - len(b) > limit:
+        return limit + 1
+    previous: List[int] = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current: List[int] = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,  # a deletion
+                current[j - 1] + 1,  # an insertion
+                previous[j - 1] + (char_a != char_b),  # a substitution
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+class FuzzyQuery:
+    """
+    A predicate which accepts names close to a search string by the case insensitive edit distance.
+    Instances can be pickled, they provide *trigrams* and *min_shared* to narrow candidates
+    using a trigram index, see *trigram.get_query_trigrams* and *trigram.get_min_shared*
+
+    :param search: a string to search for
+    :type search: str
+    :param max_ratio: a maximal edit distance relative to the length of the longer string
+    :type max_ratio: float
+    :param min_shared: a minimal share of trigrams of the search string which a candidate name must contain
+    :type min_shared: float
+    """
+
+    def __init__(self, search: str, max_ratio: float = FUZZY_MAX_RATIO, min_shared: float = FUZZY_MIN_SHARED):
+        self.search: str = search.lower()
+        self.max_ratio: float = max_ratio
+        self.trigrams: Set[str] = get_trigrams(self.search)
+        self.min_shared: int = math.ceil(len(self.trigrams) * min_shared)
+        #: a lower case name: its distance, names are repeated in many files
+        self._distances: Dict[str, int] = {}
+
+    def distance(self, name: str) -> int:
+        """
+        Returns the edit distance between the search string and a name,
+        it is greater than the limit for the name if the name is not accepted
+
+        :param name: a name of a declaration
+        :type name: str
+        :return: the distance
+        :rtype: int
+        """
+        name = name.lower()
+        distance: int = self._distances.get(name, -1)
+        if distance < 0:
+            distance = get_distance(self.search, name, self.get_limit(name))
+            self._distances[name] = distance
+        return distance
+
+    def get_limit(self, name: str) -> int:
+        """
+        Returns a maximal edit distance to a name
+
+        :param name: a name of a declaration
+        :type name: str
+        :return: the maximal distance
+        :rtype: int
+        """
+        return int(max(len(self.search), len(name)) * self.max_ratio)
+
+    def __call__(self, name: str) -> bool:
+        return self.distance(name) <= self.get_limit(name)
+
+
+def filter_fuzzy(query: FuzzyQuery, declarations: Iterator[Declaration]) -> Iterator[Declaration]:
+    """
+    This generator yields declarations with names accepted by a fuzzy query ranked by the edit distance,
+    declarations with the same distance remain in order of *declarations*.
+    Distinct names of declarations are indexed by trigrams, so the distance is computed only for candidates
+
+    :param query: a fuzzy query
+    :type query: FuzzyQuery
+    :param declarations: An iterable of declarations
+    :type declarations: Iterator[Declaration]
+    :return: a generator of ranked declarations
+    :rtype: Iterator[Declaration]
+    """
+    declarations = list(declarations)
+    names: TrigramIndex = TrigramIndex(declaration.name for declaration in declarations)
+    accepted: Set[str] = set(names.search(query))
+    yield from sorted(
+        (declaration for declaration in declarations if declaration.name in accepted),
+        key=lambda declaration: query.distance(declaration.name),
+    )
@@ -0,0 +1,207 @@
+"""
+This module maps declarations to dotted names of modules for 'whatprovides' project
+
+A dotted name of a module is computed from the search path which owns the module (the most specific one,
+as python imports it): *site-packages/pkg/sub/mod.py* is *pkg.sub.mod*, *site-packages/pkg/__init__.py* is *pkg*.
+Dotted prefixes of folders are computed once and looked up by the folder of a module,
+a folder which is a search path has an empty prefix, so nothing is searched for each declaration.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import os
+from collections import OrderedDict
+from typing import List, Dict, Optional, Iterator, Callable
+from .whatprovides import Declaration, DecodeCallback, EXTENSION_SUFFIXES, is_archive, get_file_declarations
+
+#: suffixes of modules, the longest suffix goes first, e.g. '.cpython-38-x86_64-linux-gnu.so' before '.so'
+MODULE_SUFFIXES: List[str] = sorted(set(EXTENSION_SUFFIXES) | {'.py'}, key=len, reverse=True)
+
+
+def get_module_stem(file_name: str) -> Optional[str]:
+    """
+    Returns a name of a module without a suffix, e.g. *mod* for *mod.py* and *mod.cpython-38-x86_64-linux-gnu.so*
+
+    :param file_name: a name of a file of a module
+    :type file_name: str
+    :return: a name of a module or None if the file is not a module
+    :rtype: Optional[str]
+    """
+    lower_name: str = file_name.lower()
+    for suffix in MODULE_SUFFIXES:
+        if lower_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+    return None
+
+
+class ModuleNames:
+    """
+    Dotted names of modules by paths to them
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    """
+
+    def __init__(self, search_paths: List[str]):
+        #: a folder: a dotted name of a package or None if the folder can not be imported,
+        #: search paths (and zip archives) are roots of packages
+        self.packages: Dict[str, Optional[str]] = {search_path: '' for search_path in search_paths}
+        #: a path to a module: its dotted name, declarations of a module share the path
+        self.modules: Dict[str, Optional[str]] = {}
+
+    def get_package(self, folder: str) -> Optional[str]:
+        """
+        Returns a dotted name of a package by its folder
+
+        :param folder: a path to a folder (or to a folder in a zip archive)
+        :type folder: str
+        :return: a dotted name, an empty string for a search path, None if the folder is not in search paths
+        :rtype: Optional[str]
+        """
+        try:
+            return self.packages[folder]
+        except KeyError:
+            pass
+        parent, name = os.path.split(folder)
+        package: Optional[str] = None
+        if parent != folder and name.isidentifier():
+            package = self.get_package(parent)
+            if package is not None:
+                package = '%s.%s' % (package, name) if package else name
+        self.packages[folder] = package
+        return package
+
+    def get(self, module_path: str) -> Optional[str]:
+        """
+        Returns a dotted name of a module
+
+        :param module_path: a path to a module
+        :type module_path: str
+        :return: a dotted name or None if the module can not be imported from search paths
+        :rtype: Optional[str]
+        """
+        try:
+            return self.modules[module_path]
+        except KeyError:
+            pass
+        folder, file_name = os.path.split(module_path)
+        stem: Optional[str] = get_module_stem(file_name)
+        name: Optional[str] = None
+        if stem == '__init__':
+            name = self.get_package(folder) or None
+        elif stem is not None and stem.isidentifier():
+            package: Optional[str] = self.get_package(folder)
+            if package is not None:
+                name = '%s.%s' % (package, stem) if package else stem
+        self.modules[module_path] = name
+        return name
+
+
+def get_module_files(module: str, search_paths: List[str]) -> Iterator[str]:
+    """
+    This generator yields files which can provide a module in order of search paths:
+    the first one is imported by python, the following ones are shadowed.
+    A zip archive is yielded as is, its members are not checked
+
+    :param module: a dotted name of a module
+    :type module: str
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :return: a generator of paths to files
+    :rtype: Iterator[str]
+    """
+    parts: List[str] = module.split('.')
+    for search_path in search_paths:
+        if is_archive(search_path):
+            yield search_path
+            continue
+        base: str = os.path.join(search_path, *parts)
+        candidates: List[str] = [os.path.join(base, '__init__.py')]
+        candidates.extend(base + suffix for suffix in EXTENSION_SUFFIXES)
+        candidates.append(base + '.py')
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                yield candidate
+
+
+def build_module_table(
+        declarations: Iterator[Declaration],
+        module_names: ModuleNames,
+) -> 'OrderedDict[str, List[Declaration]]':
+    """
+    Groups declarations by dotted names of modules,
+    declarations of modules which can not be imported from search paths are skipped
+
+    :param declarations: An iterable of declarations
+    :type declarations: Iterator[Declaration]
+    :param module_names: dotted names of modules
+    :type module_names: ModuleNames
+    :return: a map of dotted names to declarations in order of *declarations*
+    :rtype: OrderedDict[str, List[Declaration]]
+    """
+    table: 'OrderedDict[str, List[Declaration]]' = OrderedDict()
+    for declaration in declarations:
+        module: Optional[str] = module_names.get(declaration.module_path)
+        if module is not None:
+            table.setdefault(module, []).append(declaration)
+    return table
+
+
+def get_import_statement(declaration: Declaration, module: Optional[str]) -> Optional[str]:
+    """
+    Returns a statement which imports a declaration, e.g. *from argparse import ArgumentParser*,
+    a compiled extension module (ext) is imported as a module
+
+    :param declaration: a declaration
+    :type declaration: Declaration
+    :param module: a dotted name of the module of the declaration
+    :type module: Optional[str]
+    :return: an import statement or None if the declaration can not be imported (e.g. a C symbol)
+    :rtype: Optional[str]
+    """
+    if module is None or declaration.declaration_type.name == 'sym':
+        return None
+    if declaration.declaration_type.name == 'ext':
+        return 'import %s' % module
+    return 'from %s import %s' % (module, declaration.name)
+
+
+def get_module_declarations(
+        modules: List[str],
+        search_paths: List[str],
+        accept: Optional[Callable[[str], bool]] = None,
+        on_decode: Optional[DecodeCallback] = None,
+        bytecode: bool = True,
+) -> Iterator[Declaration]:
+    """
+    This generator yields declarations of modules by their dotted names,
+    only files which can provide the modules are scanned (see *get_module_files*), the index is not used
+
+    :param modules: dotted names of modules
+    :type modules: List[str]
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param accept: an optional predicate for names of declarations (e.g. NameFilter)
+    :type accept: Optional[Callable[[str], bool]]
+    :param on_decode: an optional callback, which receives a path to a file, an encoding and a strategy
+    :type on_decode: Optional[DecodeCallback]
+    :param bytecode: read declarations from an up to date pyc file instead of the source
+    :type bytecode: bool
+    :return: a generator of declarations in order of *modules*
+    :rtype: Iterator[Declaration]
+    """
+    file_paths: 'OrderedDict[str, None]' = OrderedDict.fromkeys(  # a file can provide several modules
+        file_path for module in modules for file_path in get_module_files(module, search_paths)
+    )
+    table: 'OrderedDict[str, List[Declaration]]' = build_module_table(
+        (
+            declaration for file_path in file_paths
+            for declaration in get_file_declarations(file_path, accept=accept, on_decode=on_decode, bytecode=bytecode)
+        ),
+        ModuleNames(search_paths),
+    )
+    for module in OrderedDict.fromkeys(modules):
+        yield from table.get(module, [])
@@ -0,0 +1,257 @@
+"""
+This module provides multi-core scanning of python files for 'whatprovides' project
+
+Paths of python files are split into chunks, each chunk is decoded and searched for declarations
+in a worker process. Results are merged back in the order of the input paths.
+A worker does not rely on the state of the main process: declaration types and pruned folders are sent
+with each chunk (a spawned worker imports the package again, so types registered and patterns added
+by --exclude in the main process would be lost), types of declarations are returned by names
+and decodings of files are returned to be reported by *on_decode* in the main process.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import List, Dict, Tuple, Optional, Callable, Iterator, Iterable, Deque, Any
+from .whatprovides import DeclarationType, get_declaration_types, Declaration, get_file_declarations, filter_files, \
+    DecodeCallback, declaration_types, pruned_folders
+
+#: a count of python files sent to a worker process at once
+CHUNK_SIZE: int = 64
+
+#: a scan result of a file: a path to the file, a list of (a name of a declaration type, a name, a module path)
+#: and a list of (a path, an encoding, a strategy) of decoded files.
+#: The module path of a declaration in a zip archive is a path to the member (e.g. *a.egg/pkg/mod.py*),
+#: otherwise it is the same string object as the path to the file, so pickle sends it once
+FileScanResult = Tuple[str, List[Tuple[str, str, str]], List[Tuple[str, str, str]]]
+
+
+def get_jobs(jobs: int) -> int:
+    """
+    Returns a count of worker processes, zero or a negative value means a count of CPU cores
+
+    :param jobs: A requested count of worker processes
+    :type jobs: int
+    :return: a count of worker processes
+    :rtype: int
+    """
+    if jobs > 0:
+        return jobs
+    return os.cpu_count() or 1
+
+
+def scan_chunk(
+        file_paths: List[str],
+        accept: Optional[Callable[[str], bool]] = None,
+        bytecode: bool = True,
+        types: Optional[List[DeclarationType]] = None,
+        pruned: Optional[List[str]] = None,
+) -> List[FileScanResult]:
+    """
+    Scans a chunk of python files in a worker process.
+    Declaration types are returned by names, because unpickled instances of DeclarationType
+    are not the same objects as in the main process
+
+    :param file_paths: A list of paths to python files
+    :type file_paths: List[str]
+    :param accept: an optional picklable predicate for names of declarations (e.g. NameFilter)
+    :type accept: Optional[Callable[[str], bool]]
+    :param bytecode: read declarations from up to date pyc files instead of sources
+    :type bytecode: bool
+    :param types: declaration types of the main process, they replace *declaration_types* of the worker
+    :type types: Optional[List[DeclarationType]]
+    :param pruned: pruned folders of the main process, they replace *pruned_folders* of the worker
+    :type pruned: Optional[List[str]]
+    :return: a list of scan results of files
+    :rtype: List[FileScanResult]
+    """
+    if types is not None:
+        declaration_types[:] = types
+    if pruned is not None:
+        pruned_folders[:] = pruned
+    results: List[FileScanResult] = []
+    for file_path in filter_files(file_paths, accept):
+        decodings: List[Tuple[str, str, str]] = []
+        results.append((
+            file_path,
+            [
+                (declaration.declaration_type.name, declaration.name, declaration.module_path)
+                for declaration in get_file_declarations(
+                    file_path, accept=accept, bytecode=bytecode,
+                    on_decode=lambda path, encoding, strategy: decodings.append((path, encoding, strategy)),
+                )
+            ],
+            decodings,
+        ))
+    return results
+
+
+def get_chunks(file_paths: Iterable[str], chunk_size: int) -> Iterator[List[str]]:
+    """
+    This generator splits an iterable of paths to lists of *chunk_size* paths
+
+    :param file_paths: An iterable of paths to python files
+    :type file_paths: Iterable[str]
+    :param chunk_size: A count of paths in a chunk
+    :type chunk_size: int
+    :return: a generator of chunks of paths
+    :rtype: Iterator[List[str]]
+    """
+    chunk: List[str] = []
+    for file_path in file_paths:
+        chunk.append(file_path)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def scan_files_parallel(
+        file_paths: Iterable[str],
+        jobs: int = 0,
+        chunk_size: int = CHUNK_SIZE,
+        accept: Optional[Callable[[str], bool]] = None,
+        on_decode: Optional[DecodeCallback] = None,
+        bytecode: bool = True,
+        mp_context: Any = None,
+) -> Iterator[Tuple[str, List[Declaration]]]:
+    """
+    This generator scans python files in a pool of worker processes
+    and yields declarations of each file in the order of *file_paths*.
+    At most a few chunks per worker are in flight, so paths are consumed lazily
+
+    :param file_paths: An iterable of paths to python files
+    :type file_paths: Iterable[str]
+    :param jobs: A count of worker processes, zero means a count of CPU cores
+    :type jobs: int
+    :param chunk_size: A count of python files sent to a worker process at once
+    :type chunk_size: int
+    :param accept: an optional picklable predicate for names of declarations (e.g. NameFilter)
+    :type accept: Optional[Callable[[str], bool]]
+    :param on_decode: an optional callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding), it is called in the main process
+    :type on_decode: Optional[DecodeCallback]
+    :param bytecode: read declarations from up to date pyc files instead of sources
+    :type bytecode: bool
+    :param mp_context: an optional multiprocessing context of worker processes (python 3.7+),
+        e.g. *multiprocessing.get_context('spawn')*
+    :type mp_context: Any
+    :return: a generator of paths to python files and lists of their declarations
+    :rtype: Iterator[Tuple[str, List[Declaration]]]
+    """
+    jobs = get_jobs(jobs)
+    types: Dict[str, DeclarationType] = {
+        declaration_type.name: declaration_type for declaration_type in get_declaration_types()
+    }
+    options: Dict[str, Any] = {'mp_context': mp_context} if mp_context is not None else {}
+    with ProcessPoolExecutor(max_workers=jobs, **options) as executor:
+        pending: Deque[Future] = deque()
+        try:
+            for chunk in get_chunks(file_paths, chunk_size):
+                pending.append(executor.submit(
+                    scan_chunk, chunk, accept, bytecode, list(declaration_types), list(pruned_folders),
+                ))
+                if len(pending) < jobs * 4:
+                    continue
+                yield from _get_chunk_declarations(pending.popleft(), types, on_decode)
+            while pending:
+                yield from _get_chunk_declarations(pending.popleft(), types, on_decode)
+        finally:
+            for future in pending:
+                future.cancel()  # the consumer stopped early (e.g. --first), chunks not started yet are dropped
+
+
+def _get_chunk_declarations(
+        future: Future,
+        types: Dict[str, DeclarationType],
+        on_decode: Optional[DecodeCallback],
+) -> Iterator[Tuple[str, List[Declaration]]]:
+    for file_path, found, decodings in future.result():
+        if on_decode is not None:
+            for decoding in decodings:
+                on_decode(*decoding)
+        yield file_path, [
+            Declaration(
+                declaration_type=types[type_name],
+                name=sys.intern(name),
+                module_path=file_path if module_path == file_path else sys.intern(module_path),
+            )
+            for type_name, name, module_path in found
+        ]
+
+
+def scan_files(
+        file_paths: Iterable[str],
+        jobs: int = 1,
+        on_decode: Optional[DecodeCallback] = None,
+        bytecode: bool = True,
+        io_threads: int = 1,
+) -> Iterator[Tuple[str, List[Declaration]]]:
+    """
+    This generator yields declarations of each python file,
+    files are scanned in the current process if *jobs* is 1 (using *io_threads* threads),
+    otherwise in a pool of worker processes
+
+    :param file_paths: An iterable of paths to python files
+    :type file_paths: Iterable[str]
+    :param jobs: A count of worker processes, zero means a count of CPU cores
+    :type jobs: int
+    :param on_decode: an optional callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param bytecode: read declarations from up to date pyc files instead of sources
+    :type bytecode: bool
+    :param io_threads: A count of threads which read files in the current process
+    :type io_threads: int
+    :return: a generator of paths to python files and lists of their declarations
+    :rtype: Iterator[Tuple[str, List[Declaration]]]
+    """
+    if get_jobs(jobs) == 1 and io_threads > 1:
+        from .prefetch import scan_files_with_threads
+        yield from scan_files_with_threads(file_paths, io_threads, on_decode=on_decode, bytecode=bytecode)
+    elif get_jobs(jobs) == 1:
+        for file_path in file_paths:
+            yield file_path, get_file_declarations(file_path, on_decode=on_decode, bytecode=bytecode)
+    else:
+        yield from scan_files_parallel(file_paths, jobs=jobs, on_decode=on_decode, bytecode=bytecode)
+
+
+def get_declarations_parallel(
+        file_paths: Iterable[str],
+        jobs: int = 0,
+        chunk_size: int = CHUNK_SIZE,
+        accept: Optional[Callable[[str], bool]] = None,
+        on_decode: Optional[DecodeCallback] = None,
+        bytecode: bool = True,
+) -> Iterator[Declaration]:
+    """
+    This generator yields declarations of python files scanned in a pool of worker processes
+    in deterministic order, the same as a scan in the current process yields
+
+    :param file_paths: An iterable of paths to python files
+    :type file_paths: Iterable[str]
+    :param jobs: A count of worker processes, zero means a count of CPU cores
+    :type jobs: int
+    :param chunk_size: A count of python files sent to a worker process at once
+    :type chunk_size: int
+    :param accept: an optional picklable predicate for names of declarations (e.g. NameFilter)
+    :type accept: Optional[Callable[[str], bool]]
+    :param on_decode: an optional callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param bytecode: read declarations from up to date pyc files instead of sources
+    :type bytecode: bool
+    :return: a generator of declarations
+    :rtype: Iterator[Declaration]
+    """
+    for _, declarations in scan_files_parallel(
+            file_paths, jobs=jobs, chunk_size=chunk_size, accept=accept, on_decode=on_decode, bytecode=bytecode,
+    ):
+        yield from declarations
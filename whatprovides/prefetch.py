@@ -0,0 +1,405 @@
+"""
+This module provides overlapped I/O for 'whatprovides' project
+
+On network filesystems (NFS, CIFS, sshfs ...) each listing of a folder and each read of a file waits
+for a round trip to the server, so a sequential scan is bound by the latency, not by the CPU.
+Here folders are listed and files are read and scanned in a pool of threads, which wait for I/O in parallel.
+The amount of work in flight is bounded (*PREFETCH_PER_THREAD* requests per thread),
+so memory stays bounded however large the tree is, and results are yielded in the same order
+as a sequential scan yields them.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import os
+import re
+from collections import deque
+from typing import List, Dict, Set, Tuple, Iterator, Iterable, Optional, Callable, Deque, TypeVar, TYPE_CHECKING
+from .whatprovides import Declaration, DecodeCallback, walk_python_files, filter_files, get_file_declarations, \
+    pruned_folders, _get_pruned_matcher, _scandir
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor, Future  # concurrent.futures is imported when threads are started
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+#: types of filesystems with a high latency of I/O
+NETWORK_FILESYSTEMS: Set[str] = {
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ncpfs', 'afs', '9p', 'virtiofs', 'ceph', 'glusterfs', 'lustre', 'gpfs',
+    'beegfs', 'davfs', 'fuse.sshfs', 'fuse.glusterfs', 'fuse.cephfs', 'fuse.s3fs', 'fuse.rclone', 'fuse.gcsfuse',
+}
+
+#: a count of I/O threads used by default if a search path is on a network filesystem
+NETWORK_IO_THREADS: int = 16
+
+#: a count of listings of folders and files being read in flight per thread
+PREFETCH_PER_THREAD: int = 4
+
+MOUNTS_PATH: str = '/proc/mounts'
+
+
+def get_mounts(mounts_path: str = MOUNTS_PATH) -> List[Tuple[str, str]]:
+    """
+    Returns mount points and types of their filesystems, the longest mount points go first
+
+    :param mounts_path: A path to the mounts table (Linux)
+    :type mounts_path: str
+    :return: a list of mount points and types of filesystems, it is empty if the table can not be read
+    :rtype: List[Tuple[str, str]]
+    """
+    mounts: List[Tuple[str, str]] = []
+    try:
+        with open(mounts_path) as f:
+            for line in f:
+                fields: List[str] = line.split()
+                if len(fields) >= 3:
+                    # spaces and other special characters of mount points are escaped as octal codes (e.g. \040)
+                    mount_point: str = re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), fields[1])
+                    mounts.append((mount_point, fields[2]))
+    except OSError:
+        return []
+    mounts.sort(key=lambda mount: len(mount[0]), reverse=True)
+    return mounts
+
+
+def get_filesystem(path: str, mounts: List[Tuple[str, str]]) -> str:
+    """
+    Returns a type of the filesystem of a path
+
+    :param path: A path
+    :type path: str
+    :param mounts: mount points and types of filesystems, the longest mount points go first
+    :type mounts: List[Tuple[str, str]]
+    :return: a type of the filesystem or an empty string if it is unknown
+    :rtype: str
+    """
+    path = os.path.realpath(path)
+    for mount_point, filesystem in mounts:
+        if path == mount_point or path.startswith(mount_point.rstrip(os.sep) + os.sep):
+            return filesystem
+    return ''
+
+
+def get_io_threads(io_threads: Optional[int], search_paths: List[str]) -> int:
+    """
+    Returns a count of I/O threads, by default *NETWORK_IO_THREADS* if a search path is on a network filesystem,
+    otherwise 1 (I/O is not overlapped)
+
+    :param io_threads: A requested count of I/O threads or None
+    :type io_threads: Optional[int]
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :return: a count of I/O threads
+    :rtype: int
+    """
+    if io_threads is not None:
+        return max(io_threads, 1)
+    mounts: List[Tuple[str, str]] = get_mounts()
+    if any(get_filesystem(search_path, mounts) in NETWORK_FILESYSTEMS for search_path in search_paths):
+        return NETWORK_IO_THREADS
+    return 1
+
+
+def map_ordered(
+        function: Callable[[T], R],
+        items: Iterable[T],
+        executor: 'Executor',
+        window: int,
+) -> Iterator[R]:
+    """
+    This generator calls a function for each item in an executor and yields results in order of items.
+    At most *window* calls are in flight, so items are consumed lazily
+
+    :param function: a function to call
+    :type function: Callable[[T], R]
+    :param items: An iterable of arguments of the function
+    :type items: Iterable[T]
+    :param executor: an executor (e.g. a thread pool)
+    :type executor: Executor
+    :param window: a maximal count of calls in flight
+    :type window: int
+    :return: a generator of results
+    :rtype: Iterator[R]
+    """
+    pending: Deque['Future'] = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()  # the consumer stopped early (e.g. --first)
+
+
+def _list_folder(path: str) -> List[os.DirEntry]:
+    entries: List[os.DirEntry] = _scandir(path)
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                entry.stat()  # the result is cached by the entry, the walk reads it to detect symlink loops
+        except OSError:
+            pass
+    return entries
+
+
+class FolderPrefetcher:
+    """
+    A replacement of *os.scandir* for *walk_python_files* which lists folders in advance:
+    as soon as a folder is listed, listings of its subfolders are requested in an executor.
+    At most *max_pending* listings are in flight, a folder which was not requested is listed when the walk needs it
+
+    :param executor: an executor (e.g. a thread pool)
+    :type executor: Executor
+    :param is_pruned: a predicate for names of folders which are not walked
+    :type is_pruned: Callable[[str], bool]
+    :param max_pending: a maximal count of listings in flight
+    :type max_pending: int
+    """
+
+    def __init__(self, executor: 'Executor', is_pruned: Callable[[str], bool], max_pending: int):
+        self.executor: 'Executor' = executor
+        self.is_pruned: Callable[[str], bool] = is_pruned
+        self.max_pending: int = max_pending
+        #: a path to a folder: a listing of the folder
+        self.pending: Dict[str, 'Future'] = {}
+
+    def __call__(self, path: str) -> List[os.DirEntry]:
+        future: Optional['Future'] = self.pending.pop(path, None)
+        entries: List[os.DirEntry] = future.result() if future else _list_folder(path)
+        for entry in entries:
+            if len(self.pending) >= self.max_pending:
+                break
+            try:
+                if entry.is_dir() and not self.is_pruned(entry.name) and entry.path not in self.pending:
+                    self.pending[entry.path] = self.executor.submit(_list_folder, entry.path)
+            except OSError:
+                continue
+        return entries
+
+    def discard(self, path: str) -> None:
+        """
+        Releases the listing of a folder which the walk skips (e.g. a symlink loop),
+        so its slot can be used by a folder which is walked
+
+        :param path: A path to a folder
+        :type path: str
+        """
+        future: Optional['Future'] = self.pending.pop(path, None)
+        if future:
+            future.cancel()
+
+    def close(self) -> None:
+        """
+        Cancels listings which were not started yet, e.g. when the consumer stopped the walk early
+        """
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+
+def walk_python_files_prefetched(
+        search_paths: Iterator[str],
+        executor: 'Executor',
+        window: int,
+        pruned: Optional[List[str]] = None,
+        extensions: bool = False,
+) -> Iterator[Tuple[str, str]]:
+    """
+    This generator yields search paths and paths of python files found in them, see *walk_python_files*,
+    folders are listed in advance in an executor
+
+    :param search_paths: An iterable of search paths
+    :type search_paths: Iterator[str]
+    :param executor: an executor (e.g. a thread pool)
+    :type executor: Executor
+    :param window: a maximal count of listings in flight
+    :type window: int
+    :param pruned: names or glob patterns of folders and files to skip, *pruned_folders* by default
+    :type pruned: Optional[List[str]]
+    :param extensions: yield compiled extension modules too
+    :type extensions: bool
+    :return: a generator of search paths and paths of python files
+    :rtype: Iterator[Tuple[str, str]]
+    """
+    if pruned is None:
+        pruned = pruned_folders
+    prefetcher: FolderPrefetcher = FolderPrefetcher(executor, _get_pruned_matcher(pruned), window)
+    try:
+        yield from walk_python_files(
+            search_paths, pruned=pruned, extensions=extensions, scandir=prefetcher, skip=prefetcher.discard,
+        )
+    finally:
+        prefetcher.close()
+
+
+def _scan_file(
+        file_path: str,
+        accept: Optional[Callable[[str], bool]],
+        on_decode: Optional[DecodeCallback],
+        bytecode: bool,
+) -> Tuple[str, List[Declaration]]:
+    for file_path in filter_files([file_path], accept):
+        return file_path, get_file_declarations(file_path, accept=accept, on_decode=on_decode, bytecode=bytecode)
+    return file_path, []
+
+
+def scan_files_threaded(
+        file_paths: Iterable[str],
+        executor: 'Executor',
+        window: int,
+        accept: Optional[Callable[[str], bool]] = None,
+        on_decode: Optional[DecodeCallback] = None,
+        bytecode: bool = True,
+) -> Iterator[Tuple[str, List[Declaration]]]:
+    """
+    This generator reads and scans python files in an executor
+    and yields declarations of each file in order of *file_paths*
+
+    :param file_paths: An iterable of paths to python files
+    :type file_paths: Iterable[str]
+    :param executor: an executor (e.g. a thread pool)
+    :type executor: Executor
+    :param window: a maximal count of files in flight
+    :type window: int
+    :param accept: an optional predicate for names of declarations (e.g. NameFilter)
+    :type accept: Optional[Callable[[str], bool]]
+    :param on_decode: an optional callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param bytecode: read declarations from up to date pyc files instead of sources
+    :type bytecode: bool
+    :return: a generator of paths to python files and lists of their declarations
+    :rtype: Iterator[Tuple[str, List[Declaration]]]
+    """
+    yield from map_ordered(
+        lambda file_path: _scan_file(file_path, accept, on_decode, bytecode), file_paths, executor, window,
+    )
+
+
+def get_declarations_threaded(
+        search_paths: List[str],
+        io_threads: int,
+        accept: Optional[Callable[[str], bool]] = None,
+        on_decode: Optional[DecodeCallback] = None,
+        bytecode: bool = True,
+        extensions: bool = True,
+) -> Iterator[Declaration]:
+    """
+    This generator walks search paths and scans python files and extension modules using a pool of I/O threads,
+    declarations are yielded in the same order as a sequential scan yields them
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param io_threads: A count of I/O threads
+    :type io_threads: int
+    :param accept: an optional predicate for names of declarations (e.g. NameFilter)
+    :type accept: Optional[Callable[[str], bool]]
+    :param on_decode: an optional callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param bytecode: read declarations from up to date pyc files instead of sources
+    :type bytecode: bool
+    :param extensions: scan compiled extension modules too
+    :type extensions: bool
+    :return: a generator of declarations
+    :rtype: Iterator[Declaration]
+    """
+    window: int = io_threads * PREFETCH_PER_THREAD
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=io_threads) as executor:
+        walk: Iterator[Tuple[str, str]] = walk_python_files_prefetched(
+            search_paths, executor, window, extensions=extensions,
+        )
+        scan: Iterator[Tuple[str, List[Declaration]]] = scan_files_threaded(
+            (file_path for _, file_path in walk), executor, window, accept=accept, on_decode=on_decode,
+            bytecode=bytecode,
+        )
+        try:
+            for _, declarations in scan:
+                yield from declarations
+        finally:
+            # requests in flight are cancelled before the executor waits for its threads
+            scan.close()
+            walk.close()
+
+
+def _stat_file(item: Tuple[str, str]) -> Tuple[str, str, Optional[os.stat_result]]:
+    try:
+        return item[0], item[1], os.stat(item[1])
+    except OSError:
+        return item[0], item[1], None  # the file was removed or it is a broken symlink
+
+
+def stat_python_files(
+        search_paths: List[str],
+        io_threads: int = 1,
+        extensions: bool = False,
+) -> Iterator[Tuple[str, str, Optional[os.stat_result]]]:
+    """
+    This generator yields search paths, paths of python files found in them and stats of the files,
+    folders are listed and files are stat'ed in a pool of threads if *io_threads* is not 1
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param io_threads: A count of I/O threads
+    :type io_threads: int
+    :param extensions: yield compiled extension modules too
+    :type extensions: bool
+    :return: a generator of search paths, paths of python files and their stats (None if a file can not be stat'ed)
+    :rtype: Iterator[Tuple[str, str, Optional[os.stat_result]]]
+    """
+    if io_threads <= 1:
+        yield from map(_stat_file, walk_python_files(search_paths, extensions=extensions))
+        return
+    window: int = io_threads * PREFETCH_PER_THREAD
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=io_threads) as executor:
+        walk: Iterator[Tuple[str, str]] = walk_python_files_prefetched(
+            search_paths, executor, window, extensions=extensions,
+        )
+        stats: Iterator[Tuple[str, str, Optional[os.stat_result]]] = map_ordered(_stat_file, walk, executor, window)
+        try:
+            yield from stats
+        finally:
+            stats.close()
+            walk.close()
+
+
+def scan_files_with_threads(
+        file_paths: Iterable[str],
+        io_threads: int,
+        on_decode: Optional[DecodeCallback] = None,
+        bytecode: bool = True,
+) -> Iterator[Tuple[str, List[Declaration]]]:
+    """
+    This generator reads and scans python files in a pool of *io_threads* threads,
+    see *scan_files_threaded*
+
+    :param file_paths: An iterable of paths to python files
+    :type file_paths: Iterable[str]
+    :param io_threads: A count of I/O threads
+    :type io_threads: int
+    :param on_decode: an optional callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param bytecode: read declarations from up to date pyc files instead of sources
+    :type bytecode: bool
+    :return: a generator of paths to python files and lists of their declarations
+    :rtype: Iterator[Tuple[str, List[Declaration]]]
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=io_threads) as executor:
+        scan: Iterator[Tuple[str, List[Declaration]]] = scan_files_threaded(
+            file_paths, executor, io_threads * PREFETCH_PER_THREAD, on_decode=on_decode, bytecode=bytecode,
+        )
+        try:
+            yield from scan
+        finally:
+            scan.close()
@@ -0,0 +1,204 @@
+"""
+This module provides lightweight instrumentation of the pipeline for 'whatprovides' project
+
+Generator stages are wrapped by *Stats.instrument*, time of other code is added by *Stats.add_time*.
+Time of nested stages is excluded from time of an outer stage, so times of stages sum up to the wall time.
+Lines are not instrumented one by one, reading, decoding and matching are measured per file.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import os
+import sys
+import heapq
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Iterator, Iterable, Optional, Callable, Any, TypeVar, TextIO
+from .whatprovides import DecodeCallback
+
+T = TypeVar('T')
+
+#: a count of the slowest files in the report
+SLOWEST_FILES: int = 10
+
+
+class Stats:
+    """
+    Statistics of the pipeline: time and a count of items of each stage,
+    counts of files, bytes and lines, counts of encoding strategies and the slowest files
+
+    :param slowest_files: a count of the slowest files to keep
+    :type slowest_files: int
+    :param on_decode: an optional callback called after a decoded file is counted (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    """
+
+    def __init__(self, slowest_files: int = SLOWEST_FILES, on_decode: Optional[DecodeCallback] = None):
+        self.started: float = time.perf_counter()
+        #: a stage: exclusive time in seconds
+        self.times: Dict[str, float] = OrderedDict()
+        #: a stage: a count of produced items
+        self.items: Dict[str, int] = OrderedDict()
+        self.files: int = 0
+        self.bytes: int = 0
+        self.lines: int = 0
+        #: a strategy of decoding (bom, cookie, utf-8, chardet, fallback): a count of files
+        self.strategies: Counter = Counter()
+        #: a min heap of (time in seconds, a path to a file)
+        self.slowest: List[Tuple[float, str]] = []
+        self.slowest_files: int = slowest_files
+        self._on_decode: Optional[DecodeCallback] = on_decode
+        #: times of nested stages of stages being measured now
+        self._nested: List[float] = []
+
+    def add_time(self, stage: str, elapsed: float, items: int = 0) -> None:
+        """
+        Adds time and a count of items to a stage,
+        the time is excluded from an instrumented stage being measured now
+
+        :param stage: a name of a stage
+        :type stage: str
+        :param elapsed: time in seconds
+        :type elapsed: float
+        :param items: a count of produced items
+        :type items: int
+        """
+        self.times[stage] = self.times.get(stage, 0.0) + elapsed
+        self.items[stage] = self.items.get(stage, 0) + items
+        if self._nested:
+            self._nested[-1] += elapsed
+
+    def instrument(self, stage: str, iterable: Iterable[T]) -> Iterator[T]:
+        """
+        This generator yields items of an iterable and measures time spent to produce them,
+        time of nested instrumented stages is excluded
+
+        :param stage: a name of a stage
+        :type stage: str
+        :param iterable: an iterable produced by the stage
+        :type iterable: Iterable[T]
+        :return: a generator of the same items
+        :rtype: Iterator[T]
+        """
+        iterator: Iterator[T] = iter(iterable)
+        nested: List[float] = self._nested
+        while True:
+            nested.append(0.0)
+            started: float = time.perf_counter()
+            try:
+                item: T = next(iterator)
+            except StopIteration:
+                self._measured(stage, started, 0)
+                return
+            self._measured(stage, started, 1)
+            yield item
+
+    def measure(self, stage: str, function: Callable[..., T], *args: Any) -> T:
+        """
+        Calls a function and measures its time as a stage, time of nested instrumented stages is excluded
+
+        :param stage: a name of a stage
+        :type stage: str
+        :param function: a function to call
+        :type function: Callable[..., T]
+        :param args: arguments of the function
+        :return: a result of the function
+        :rtype: T
+        """
+        self._nested.append(0.0)
+        started: float = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self._measured(stage, started, 0)
+
+    def _measured(self, stage: str, started: float, items: int) -> None:
+        nested: float = self._nested.pop()
+        self.add_time(stage, time.perf_counter() - started - nested, items)
+        if self._nested:
+            self._nested[-1] += nested  # the whole time is excluded from the outer stage
+
+    def on_decode(self, file_path: str, encoding: str, strategy: str) -> None:
+        """
+        Counts a decoded file by its decoding strategy,
+        it can be used as the *on_decode* callback of *get_files_lines*
+        """
+        self.strategies[strategy] += 1
+        if self._on_decode:
+            self._on_decode(file_path, encoding, strategy)
+
+    def add_file(self, file_path: str, lines: int, elapsed: float) -> None:
+        """
+        Counts a processed file, its size and lines, and keeps it if it is one of the slowest files
+
+        :param file_path: a path to a file
+        :type file_path: str
+        :param lines: a count of lines of the file
+        :type lines: int
+        :param elapsed: time in seconds spent to read, decode and match the file
+        :type elapsed: float
+        """
+        self.files += 1
+        self.lines += lines
+        try:
+            self.bytes += os.path.getsize(file_path)
+        except OSError:
+            pass
+        item: Tuple[float, str] = (elapsed, file_path)
+        if len(self.slowest) < self.slowest_files:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def report(self, stream: TextIO = sys.stderr) -> None:
+        """
+        Prints the report of statistics
+
+        :param stream: a stream to print to, stderr by default
+        :type stream: TextIO
+        """
+        wall: float = time.perf_counter() - self.started
+        print('%-12s %10s %10s %12s' % ('stage', 'time, s', 'items', 'items/s'), file=stream)
+        for stage, elapsed in self.times.items():
+            items: int = self.items[stage]
+            print('%-12s %10.4f %10i %12s' % (
+                stage, elapsed, items, '%.0f' % (items / elapsed) if elapsed and items else '-',
+            ), file=stream)
+        print('%-12s %10.4f' % ('wall', wall), file=stream)
+        if self.lines:
+            print('files: %i, bytes: %i (%.1f MB/s), lines: %i (%.0f lines/s)' % (
+                self.files, self.bytes, self.bytes / wall / 1e6, self.lines, self.lines / wall,
+            ), file=stream)
+        elif self.files:
+            print('files: %i' % self.files, file=stream)  # files scanned by worker processes or by the index
+        if self.strategies:
+            print('encodings: %s' % ', '.join(
+                '%s: %i' % strategy for strategy in sorted(self.strategies.items())
+            ), file=stream)
+        if self.slowest:
+            print('slowest files:', file=stream)
+            for elapsed, file_path in sorted(self.slowest, reverse=True):
+                print('  %.4f s: %s' % (elapsed, file_path), file=stream)
+
+
+@contextmanager
+def profile(file_path: str) -> Iterator[None]:
+    """
+    This context manager profiles the code of its block using cProfile
+    and dumps pstats to a file, which can be loaded by *pstats.Stats(file_path)*
+
+    :param file_path: a path to a file to dump pstats to
+    :type file_path: str
+    """
+    import cProfile
+    profiler: cProfile.Profile = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(file_path)
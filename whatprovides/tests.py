@@ -10,15 +10,48 @@ Date:
 import os
 import sys
 import re
+import socket
 import unittest
-from typing import Pattern, List
+import threading
+from unittest import mock
+import codecs
+import tempfile
+import zipfile
+import io
+import py_compile
+import shutil
+import subprocess
+import time
+from typing import Pattern, List, Dict, Tuple, Iterator
 from .whatprovides import DeclarationType, declaration_types, Declaration, filter_declaration, \
     ifilter_declaration, re_filter_declaration, FileLine, get_declarations, get_files_lines, get_python_files, \
-    get_paths, filter_delaration_type
+    get_paths, filter_delaration_type, DeclarationMatcher, NameFilter, get_regex_literal, filter_files, decode_source, \
+    get_coding_cookie, walk_python_files, get_search_paths, scan_declarations, get_import_depth, sort_import_order, \
+    write_lines, is_extension, EXTENSION_SUFFIXES, NameSet, read_names, group_declarations, \
+    get_binary_declarations, get_completions, main, pruned_folders, file_contains
+from .cache import DeclarationIndex, CACHE_PATH_ENV
+from .parallel import get_declarations_parallel, scan_files_parallel
+from .trigram import TrigramIndex, get_trigrams, get_query_trigrams
+from .daemon import DeclarationStore, DeclarationServer, get_socket_path, query, create_server
+from .stats import Stats
+from .bytecode import get_bytecode_declarations, load_code, get_pyc_path
+from .elf import get_extension_declarations
+from .fuzzy import FuzzyQuery, get_distance, filter_fuzzy
+from .prefetch import get_mounts, get_filesystem, get_io_threads, stat_python_files, FolderPrefetcher
+from .environments import get_interpreter_paths, get_venv_paths
+from .binindex import BinaryIndex, write_binary_index, get_binary_index_path, is_fresh
+from .watch import IndexWatcher, InotifyWatcher, PollingWatcher
+from .dists import Distribution, build_distribution_map, get_declaration_distribution, filter_distribution
+from .modules import ModuleNames, get_module_stem, get_import_statement, get_module_declarations
 
 
 SCRIPT_PATH: str = os.path.dirname(os.path.abspath(__file__))
 TEST_STRING_IO: bool = False
+#: a budget of the import of the core module as a ratio to the startup time of the interpreter (python -c pass),
+#: it can be changed by WHATPROVIDES_IMPORT_TIME_BUDGET on slow or busy machines
+IMPORT_TIME_BUDGET: float = float(os.environ.get('WHATPROVIDES_IMPORT_TIME_BUDGET', '3.0'))
+#: modules which are slow to import, they must be imported only when they are used
+LAZY_MODULES: Tuple[str, ...] = ('chardet', 'sqlite3', 'zipfile', 'argparse', 'concurrent.futures', 'multiprocessing')
 
 
 class TestWhatprovides(unittest.TestCase):
@@ -169,3 +202,878 @@ class TestWhatprovides(unittest.TestCase):
             class_results = filter_delaration_type(results, [declaration_types[2]])
             self.assertTrue(any(class_results))
 
+
+    def test_declaration_index(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            search_path: str = os.path.join(temp_dir, 'lib')
+            os.mkdir(search_path)
+            module_path: str = os.path.join(search_path, 'module.py')
+            with open(module_path, 'w') as f:
+                f.write('class IndexedClass:\n    pass\n')
+            index: DeclarationIndex = DeclarationIndex(os.path.join(temp_dir, 'cache', 'index.sqlite3'))
+            self.assertEqual(index.refresh([search_path]), 1)
+            self.assertEqual(index.refresh([search_path]), 0)
+            declarations: List[Declaration] = list(index.declarations([search_path]))
+            self.assertEqual(len(declarations), 1)
+            self.assertEqual(declarations[0].name, 'IndexedClass')
+            self.assertEqual(declarations[0].declaration_type, declaration_types[2])
+            self.assertEqual(declarations[0].module_path, module_path)
+            with open(module_path, 'w') as f:
+                f.write('def indexed_function():\n    pass\n')
+            self.assertEqual(index.refresh([search_path]), 1)
+            self.assertEqual([d.name for d in index.declarations([search_path])], ['indexed_function'])
+            os.remove(module_path)
+            self.assertEqual(index.refresh([search_path]), 0)
+            self.assertEqual(list(index.declarations([search_path])), [])
+            index.close()
+
+    def test_get_declarations_parallel(self):
+        file_paths: List[str] = list(get_python_files([self.test_path]))
+        serial: List[str] = [str(d) for d in get_declarations(get_files_lines(file_paths))]
+        parallel: List[Declaration] = list(get_declarations_parallel(file_paths, jobs=2, chunk_size=2))
+        self.assertEqual([str(d) for d in parallel], serial)
+        self.assertIn(parallel[0].declaration_type, declaration_types)
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'a multiprocessing context of a pool requires python 3.7')
+    def test_scan_files_parallel_spawn(self):
+        import multiprocessing
+        async_def: DeclarationType = DeclarationType(
+            name='async_def',
+            pattern=re.compile(r'^async\s+def\s+(?P<name>[A-Za-z_][A-Za-z0-9_]*)[\s(]'),
+        )
+        with tempfile.TemporaryDirectory() as temp_dir:
+            module_path: str = os.path.join(temp_dir, 'module.py')
+            with open(module_path, 'w') as f:
+                f.write('async def fetch():\n    pass\n\n\nclass Fetched:\n    pass\n')
+            archive_path: str = os.path.join(temp_dir, 'archive.zip')
+            with zipfile.ZipFile(archive_path, 'w') as archive:
+                archive.writestr('package/module.py', 'class Archived:\n    pass\n')
+                archive.writestr('excluded/module.py', 'class Excluded:\n    pass\n')
+            decodings: List[Tuple[str, str, str]] = []
+            declaration_types.append(async_def)
+            pruned_folders.append('excluded')  # as --exclude does
+            try:
+                results: List[Tuple[str, List[Declaration]]] = list(scan_files_parallel(
+                    [module_path, archive_path], jobs=2, chunk_size=1, bytecode=False,
+                    on_decode=lambda *decoding: decodings.append(decoding),
+                    mp_context=multiprocessing.get_context('spawn'),
+                ))
+            finally:
+                declaration_types.remove(async_def)
+                pruned_folders.remove('excluded')
+            self.assertEqual(
+                [(file_path, [(d.declaration_type, d.name) for d in found]) for file_path, found in results],
+                [
+                    (module_path, [(async_def, 'fetch'), (declaration_types[2], 'Fetched')]),
+                    (archive_path, [(declaration_types[2], 'Archived')]),
+                ],
+            )
+            self.assertEqual([decoding[0] for decoding in decodings][0], module_path)
+
+    def test_declaration_matcher(self):
+        async_def: DeclarationType = DeclarationType(
+            name='async_def',
+            pattern=re.compile(r'^async\s+def\s+(?P<name>[A-Za-z_][A-Za-z0-9_]*)[\s(]'),
+        )
+        matcher: DeclarationMatcher = DeclarationMatcher(declaration_types + [async_def])
+        self.assertIsNotNone(matcher.pattern)
+        self.assertEqual(matcher.match('variable = "value"'), (declaration_types[0], 'variable'))
+        self.assertEqual(matcher.match('class SomeClass(ParentClass):'), (declaration_types[2], 'SomeClass'))
+        self.assertEqual(matcher.match('async def some_coroutine():'), (async_def, 'some_coroutine'))
+        self.assertIsNone(matcher.match('x==1'))
+        not_anchored: DeclarationType = DeclarationType(
+            name='not_anchored',
+            pattern=re.compile(r'lambda_name\s*=\s*(?P<name>lambda)'),
+        )
+        matcher = DeclarationMatcher([not_anchored])
+        self.assertIsNone(matcher.pattern)
+        self.assertEqual(matcher.match('  lambda_name = lambda: 1'), (not_anchored, 'lambda'))
+        quoted: DeclarationType = DeclarationType(
+            name='quoted',
+            pattern=re.compile(r'^(["\'])(?P<name>[A-Za-z_][A-Za-z0-9_]*)\1\s*:'),  # a key of a dict literal
+        )
+        matcher = DeclarationMatcher(declaration_types + [quoted])
+        self.assertIsNone(matcher.pattern)
+        self.assertEqual(matcher.match('"key": 1'), (quoted, 'key'))
+        self.assertIsNone(matcher.match('"key\': 1'))
+        self.assertEqual(matcher.match('variable = "value"'), (declaration_types[0], 'variable'))
+        self.assertIsNotNone(DeclarationMatcher(declaration_types + [DeclarationType(
+            name='escaped', pattern=re.compile(r'^\\1(?P<name>\w+)'),  # an escaped backslash, not a reference
+        )]).pattern)
+
+    def test_get_declarations_accept(self):
+        lines: List[FileLine] = [
+            FileLine(file_path='', line_number=1, line='variable = "value"'),
+            FileLine(file_path='', line_number=1, line='def some_function(*args, **kwargs):'),
+            FileLine(file_path='', line_number=1, line='class SomeClass(ParentClass):'),
+        ]
+        declarations: List[Declaration] = list(
+            get_declarations(lines=lines, accept=NameFilter(search='some', ignore_case=True))
+        )
+        self.assertEqual([d.name for d in declarations], ['some_function', 'SomeClass'])
+        declarations = list(get_declarations(lines=lines, accept=NameFilter(search=r'^[a-z]+$', regex=True)))
+        self.assertEqual([d.name for d in declarations], ['variable'])
+
+    def test_get_regex_literal(self):
+        self.assertEqual(get_regex_literal('ArgumentParser'), 'ArgumentParser')
+        self.assertEqual(get_regex_literal(r'^Arg.*Parser$'), 'Parser')
+        self.assertEqual(get_regex_literal(r'x\d+yz'), 'yz')
+        self.assertEqual(get_regex_literal(r'Ab?cd'), 'cd')
+        self.assertEqual(get_regex_literal(r'\.bar'), '.bar')
+        self.assertEqual(get_regex_literal(r'foo|bar'), '')
+        self.assertEqual(get_regex_literal(r'(?i)foo'), '')
+        self.assertEqual(get_regex_literal(r'foo bar', re.VERBOSE), '')
+        self.assertEqual(get_regex_literal(r'ab{2}c'), 'a')
+        self.assertEqual(get_regex_literal(r'ab{0,1}cde'), 'cde')
+        self.assertEqual(get_regex_literal(r'\x41BC'), '')
+        self.assertEqual(get_regex_literal(r'ab\u0041cd'), 'ab')
+        self.assertEqual(get_regex_literal(r'(a)b\1'), '')
+        self.assertEqual(get_regex_literal(r'ab\012cd'), 'ab')
+        for pattern, name in ((r'ab{2}c', 'abbc'), (r'ab{0,1}c', 'ac'), (r'\x41BC', 'ABC'), (r'\N{DIGIT ONE}x', '1x')):
+            name_filter: NameFilter = NameFilter(pattern, regex=True)
+            self.assertTrue(name_filter(name))
+            self.assertIn(name_filter.needle or b'', name.encode())
+
+    def test_filter_files(self):
+        file_paths: List[str] = [
+            os.path.join(self.test_path, 'test_data1.py'),
+            os.path.join(self.test_path, 'test_data2.py'),
+            os.path.join(self.test_path, 'ja.py'),
+        ]
+        self.assertEqual(list(filter_files(file_paths, NameFilter('SomeClass'))), file_paths[1:2])
+        self.assertEqual(list(filter_files(file_paths, NameFilter('someclass', ignore_case=True))), file_paths[1:2])
+        self.assertEqual(list(filter_files(file_paths, NameFilter(r'some_func\d', regex=True))), file_paths[:1])
+        self.assertEqual(list(filter_files(file_paths, NameFilter(r'.*', regex=True))), file_paths)
+        self.assertEqual(list(filter_files(file_paths, None)), file_paths)
+
+    def test_decode_source(self):
+        self.assertEqual(decode_source(b'x = 1\n'), ('x = 1\n', 'utf-8', 'utf-8'))
+        self.assertEqual(decode_source(codecs.BOM_UTF8 + b'x = 1\n'), ('x = 1\n', 'utf-8-sig', 'bom'))
+        latin1: bytes = '#!/usr/bin/env python\n# -*- coding: latin-1 -*-\nname = "caf\xe9"\n'.encode('latin-1')
+        text, encoding, strategy = decode_source(latin1)
+        self.assertEqual((encoding, strategy), ('latin-1', 'cookie'))
+        self.assertIn('caf\xe9', text)
+        lying_cookie: bytes = b'# coding: ascii\nname = "caf\xc3\xa9"\n'
+        self.assertEqual(decode_source(lying_cookie), ('# coding: ascii\nname = "caf\xe9"\n', 'utf-8', 'utf-8'))
+        self.assertEqual(get_coding_cookie(b'x = 1\n# coding: latin-1\n'), '')
+
+    def test_get_files_lines_on_decode(self):
+        decoded: List[tuple] = []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path: str = os.path.join(temp_dir, 'cp1251.py')
+            with open(file_path, 'wb') as f:
+                f.write('name = "Привет"\r\nx = 1\n'.encode('cp1251'))
+            file_lines: List[FileLine] = list(
+                get_files_lines([file_path], on_decode=lambda *args: decoded.append(args))
+            )
+        self.assertEqual([line.line for line in file_lines][1:], ['x = 1\n'])
+        self.assertTrue(file_lines[0].line.endswith('\n'))
+        self.assertEqual(len(decoded), 1)
+        self.assertIn(decoded[0][2], ('chardet', 'fallback'))
+
+    def test_walk_python_files(self):
+        sub_folder_path: str = os.path.join(self.test_path, 'sub_folder')
+        walked: List[tuple] = list(walk_python_files([self.test_path, sub_folder_path, self.test_path]))
+        file_paths: List[str] = [file_path for _, file_path in walked]
+        self.assertEqual(len(file_paths), len(set(file_paths)))
+        self.assertIn((sub_folder_path, os.path.join(sub_folder_path, 'sub_folder_item.py')), walked)
+        self.assertIn((self.test_path, os.path.join(self.test_path, 'ja.py')), walked)
+        file_paths = list(get_python_files([self.test_path], pruned=['sub_folder*', 'ja.py']))
+        self.assertEqual(sorted(os.path.basename(path) for path in file_paths), ['test_data1.py', 'test_data2.py'])
+
+    @unittest.skipUnless(hasattr(os, 'symlink') and sys.platform != 'win32', 'symlinks are required')
+    def test_walk_python_files_symlink_loop(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            package_path: str = os.path.join(temp_dir, 'package')
+            os.makedirs(os.path.join(package_path, '__pycache__'))
+            open(os.path.join(package_path, 'module.py'), 'w').close()
+            open(os.path.join(package_path, '__pycache__', 'module.py'), 'w').close()
+            os.symlink(temp_dir, os.path.join(package_path, 'loop'))
+            file_paths: List[str] = list(get_python_files([temp_dir]))
+        self.assertEqual(file_paths, [os.path.join(package_path, 'module.py')])
+
+    def test_distribution_map(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.makedirs(os.path.join(temp_dir, 'some_package'))
+            module_path: str = os.path.join(temp_dir, 'some_package', 'module.py')
+            with open(module_path, 'w') as f:
+                f.write('class ProvidedClass:\n    pass\n')
+            dist_info_path: str = os.path.join(temp_dir, 'Some_Package-1.0.dist-info')
+            os.makedirs(dist_info_path)
+            with open(os.path.join(dist_info_path, 'METADATA'), 'w') as f:
+                f.write('Metadata-Version: 2.1\nName: Some-Package\nVersion: 1.0\n\nDescription\n')
+            with open(os.path.join(dist_info_path, 'RECORD'), 'w') as f:
+                f.write('some_package/module.py,sha256=abc,30\nSome_Package-1.0.dist-info/RECORD,,\n')
+            distributions: Dict[str, Distribution] = build_distribution_map([temp_dir])
+            declaration: Declaration = Declaration(
+                declaration_type=declaration_types[2], name='ProvidedClass', module_path=module_path,
+            )
+            self.assertEqual(get_declaration_distribution(declaration, distributions), ('Some-Package', '1.0'))
+            self.assertEqual(list(filter_distribution('some_package', [declaration], distributions)), [declaration])
+            self.assertEqual(list(filter_distribution('other', [declaration], distributions)), [])
+            index: DeclarationIndex = DeclarationIndex(os.path.join(temp_dir, 'index.sqlite3'))
+            self.assertEqual(index.distributions([temp_dir]), distributions)
+            self.assertEqual(index.distributions([temp_dir]), distributions)
+            index.close()
+
+    def test_archive(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive_path: str = os.path.join(temp_dir, 'archive.egg')
+            with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr('package/__init__.py', '')
+                archive.writestr('package/module.py', 'class ArchivedClass:\n    pass\n')
+                archive.writestr('package/__pycache__/module.py', 'class PrunedClass:\n    pass\n')
+                archive.writestr('package/data.txt', 'class NotPythonClass:\n')
+            search_paths: List[str] = list(get_search_paths([archive_path, self.test_path, temp_dir + '.missing']))
+            self.assertEqual(search_paths, [archive_path, self.test_path])
+            module_path: str = os.path.join(archive_path, 'package', 'module.py')
+            declarations: List[Declaration] = list(
+                get_declarations(get_files_lines(get_python_files([archive_path])))
+            )
+            self.assertEqual([(d.name, d.module_path) for d in declarations], [('ArchivedClass', module_path)])
+            index: DeclarationIndex = DeclarationIndex(os.path.join(temp_dir, 'index.sqlite3'))
+            self.assertEqual(index.refresh([archive_path]), 1)
+            self.assertEqual([str(d) for d in index.declarations([archive_path])], [str(d) for d in declarations])
+            index.close()
+
+    def test_archive_parallel(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive_path: str = os.path.join(temp_dir, 'archive.egg')
+            with zipfile.ZipFile(archive_path, 'w') as archive:
+                archive.writestr('package/__init__.py', 'VERSION = 1\n')
+                archive.writestr('package/module.py', 'class ArchivedClass:\n    pass\n')
+            expected: List[Tuple[str, str]] = [
+                ('VERSION', os.path.join(archive_path, 'package', '__init__.py')),
+                ('ArchivedClass', os.path.join(archive_path, 'package', 'module.py')),
+            ]
+            self.assertEqual(
+                [(d.name, d.module_path) for d in scan_declarations([archive_path], jobs=2)], expected,
+            )
+            index: DeclarationIndex = DeclarationIndex(os.path.join(temp_dir, 'index.sqlite3'))
+            index.refresh([archive_path], jobs=2)
+            self.assertEqual([(d.name, d.module_path) for d in index.declarations([archive_path])], expected)
+            index.close()
+
+    def test_trigram_index(self):
+        self.assertEqual(get_trigrams('AbCd'), {'abc', 'bcd'})
+        self.assertEqual(get_trigrams('ab'), set())
+        trigram_index: TrigramIndex = TrigramIndex(['ArgumentParser', 'MagicArgumentParser', 'StringIO', 'io'])
+        self.assertEqual(trigram_index.add('StringIO'), 2)
+        self.assertEqual(trigram_index.search(NameFilter('ArgumentParser')), ['ArgumentParser', 'MagicArgumentParser'])
+        self.assertEqual(trigram_index.search(NameFilter('argumentparser')), [])
+        self.assertEqual(trigram_index.search(NameFilter('MAGIC', ignore_case=True)), ['MagicArgumentParser'])
+        self.assertEqual(trigram_index.search(NameFilter(r'^Str.*IO$', regex=True)), ['StringIO'])
+        self.assertEqual(trigram_index.search(NameFilter('io', ignore_case=True)), ['StringIO', 'io'])
+        self.assertEqual(list(trigram_index.candidates(get_query_trigrams(NameFilter('Magic')))), [1])
+
+    def test_declaration_index_accept(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index: DeclarationIndex = DeclarationIndex(os.path.join(temp_dir, 'index.sqlite3'))
+            index.refresh([self.test_path])
+            names: List[str] = [d.name for d in index.declarations([self.test_path], accept=NameFilter('SomeClass'))]
+            self.assertEqual(names, ['SomeClass'])
+            names = [d.name for d in index.declarations([self.test_path], accept=NameFilter('some', ignore_case=True))]
+            self.assertEqual(sorted(names), ['SomeClass', 'some_func1'])
+            names = [d.name for d in index.declarations([self.test_path], accept=NameFilter(r'\d$', regex=True))]
+            self.assertIn('variable1', names)
+            self.assertEqual(list(index.declarations([self.test_path], accept=NameFilter('NotFound'))), [])
+            index.close()
+
+    def test_declaration_index_regex(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, 'module.py'), 'w') as f:
+                f.write('abbc = 1\nABC = 2\nabcdef = 3\n')
+            index: DeclarationIndex = DeclarationIndex(os.path.join(temp_dir, 'index.sqlite3'))
+            index.refresh([temp_dir])
+            trigram_index: TrigramIndex = TrigramIndex(['abbc', 'ABC', 'abcdef'])
+            for pattern, names in (
+                    (r'ab{2}c', ['abbc']),
+                    (r'^ab{0,1}cdef', ['abcdef']),
+                    (r'\x41BC', ['ABC']),
+                    (r'\x61bbc', ['abbc']),
+            ):
+                accept: NameFilter = NameFilter(pattern, regex=True)
+                self.assertEqual([d.name for d in index.declarations([temp_dir], accept=accept)], names)
+                self.assertEqual(trigram_index.search(accept), names)
+            index.close()
+
+    def test_declaration_store(self):
+        store: DeclarationStore = DeclarationStore(
+            get_declarations(get_files_lines(get_python_files([self.test_path])))
+        )
+        self.assertEqual([d.name for d in store.search(NameFilter('SomeClass'))], ['SomeClass'])
+        self.assertEqual(store.search(NameFilter('NotFound')), [])
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix domain sockets are required')
+    def test_daemon_query(self):
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.dict(os.environ, {CACHE_PATH_ENV: os.path.join(temp_dir, 'index.sqlite3')}):
+            search_paths: List[str] = [self.test_path]
+            self.assertIsNone(query(search_paths, NameFilter('SomeClass')))
+            store: DeclarationStore = DeclarationStore(
+                get_declarations(get_files_lines(get_python_files(search_paths)))
+            )
+            server: DeclarationServer = DeclarationServer(get_socket_path(search_paths), store)
+            thread: threading.Thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                declarations: List[Declaration] = list(query(search_paths, NameFilter('someclass', ignore_case=True)))
+                self.assertEqual([d.name for d in declarations], ['SomeClass'])
+                self.assertEqual(declarations[0].declaration_type, declaration_types[2])
+                self.assertEqual(next(query(search_paths, NameFilter(r'^some_func\d$', regex=True))).name, 'some_func1')
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix domain sockets are required')
+    def test_daemon_changes(self):
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.dict(os.environ, {CACHE_PATH_ENV: os.path.join(temp_dir, 'cache', 'index.sqlite3')}):
+            search_path: str = os.path.join(temp_dir, 'site')
+            os.mkdir(search_path)
+            module_path: str = os.path.join(search_path, 'module.py')
+            with open(module_path, 'w') as f:
+                f.write('OldName = 1\n')
+            server: DeclarationServer = create_server([search_path])
+            self.assertEqual(server.store.generation, server.index_watcher.index.get_generation())
+            thread: threading.Thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                self.assertEqual([d.name for d in query([search_path], NameFilter('Name'))], ['OldName'])
+                with open(module_path, 'w') as f:
+                    f.write('NewName = 1\n')
+                self.assertEqual([d.name for d in query([search_path], NameFilter('Name'))], ['NewName'])
+                os.remove(module_path)
+                self.assertEqual(list(query([search_path], NameFilter('Name'))), [])
+                with mock.patch.object(server.index_watcher, 'apply', side_effect=OSError('broken')), \
+                        mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                    with open(module_path, 'w') as f:
+                        f.write('BrokenName = 1\n')
+                    server.sync()  # an error does not stop the daemon, the snapshot is kept
+                self.assertIn('can not refresh declarations: broken', stderr.getvalue())
+                self.assertEqual([d.name for d in query([search_path], NameFilter('Name'))], ['BrokenName'])
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    def test_daemon_scope(self):
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.dict(os.environ, {CACHE_PATH_ENV: os.path.join(temp_dir, 'index.sqlite3')}), \
+                mock.patch('whatprovides.daemon.query', return_value=[]) as daemon_query, \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            for option in ('--no-bytecode', '--no-refresh', '--exclude=x', '--show-encoding', '--no-daemon', '-x'):
+                with mock.patch('sys.argv', ['whatprovides', '--path', self.test_path, option, 'SomeClass']), \
+                        mock.patch('sys.stderr', new_callable=io.StringIO), \
+                        mock.patch('whatprovides.whatprovides.pruned_folders', list(pruned_folders)):
+                    main()
+                daemon_query.assert_not_called()
+            self.assertIn('SomeClass', stdout.getvalue())
+            with mock.patch('sys.argv', ['whatprovides', '--path', self.test_path, '--first', 'SomeClass']):
+                main()
+            daemon_query.assert_called_once()
+            with mock.patch('sys.argv', ['whatprovides', '--path', self.test_path, '--serve']), \
+                    mock.patch('whatprovides.daemon.serve', side_effect=RuntimeError('already running')), \
+                    mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                self.assertRaises(SystemExit, main)
+            self.assertIn('error: already running', stderr.getvalue())
+
+    def test_batch_missing_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch('sys.argv', ['whatprovides', '--batch', os.path.join(temp_dir, 'missing.txt')]), \
+                mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.assertRaises(SystemExit, main)
+        self.assertIn('argument --batch: can not read', stderr.getvalue())
+        with tempfile.TemporaryDirectory() as temp_dir:
+            names_path: str = os.path.join(temp_dir, 'names.txt')
+            with open(names_path, 'wb') as f:
+                f.write(b'SomeClass\n\xff\xfe\n')  # not UTF-8
+            with mock.patch('sys.argv', ['whatprovides', '--batch', names_path]), \
+                    mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                self.assertRaises(SystemExit, main)
+            self.assertIn("can't decode", stderr.getvalue())
+
+    def test_stats_instrument(self):
+        stats: Stats = Stats(slowest_files=1)
+        outer: List[int] = list(stats.instrument('outer', (stats.add_time('inner', 1.0) or i for i in range(3))))
+        self.assertEqual(outer, [0, 1, 2])
+        self.assertEqual(stats.items, {'inner': 0, 'outer': 3})
+        self.assertEqual(stats.times['inner'], 3.0)
+        self.assertLess(stats.times['outer'], 1.0)  # time of the nested stage is excluded
+        stats.add_file('fast.py', lines=1, elapsed=0.1)
+        stats.add_file('slow.py', lines=2, elapsed=0.2)
+        self.assertEqual((stats.files, stats.lines, stats.slowest), (2, 3, [(0.2, 'slow.py')]))
+        stream: io.StringIO = io.StringIO()
+        stats.report(stream)
+        self.assertIn('0.2000 s: slow.py', stream.getvalue())
+
+    def test_scan_declarations_stats(self):
+        stats: Stats = Stats()
+        declarations: List[Declaration] = list(scan_declarations([self.test_path], stats=stats, bytecode=False))
+        self.assertEqual(
+            [str(d) for d in declarations],
+            [str(d) for d in get_declarations(get_files_lines(get_python_files([self.test_path])))],
+        )
+        self.assertEqual(stats.files, len(list(get_python_files([self.test_path]))))
+        self.assertEqual(stats.items['match'], len(declarations))
+        self.assertEqual(list(stats.times), ['walk', 'prefilter', 'decode', 'match'])
+
+    def test_compact_declarations(self):
+        declarations: List[Declaration] = list(get_declarations([
+            FileLine(file_path='a.py', line_number=0, line=''.join(['some', '_var = 1\n'])),
+            FileLine(file_path='b.py', line_number=0, line=''.join(['some', '_var = 2\n'])),
+        ]))
+        self.assertFalse(hasattr(declarations[0], '__dict__'))
+        self.assertFalse(hasattr(FileLine(file_path='a.py', line_number=0, line=''), '__dict__'))
+        self.assertIs(declarations[0].name, declarations[1].name)  # names are interned
+        self.assertIs(declarations[0].declaration_type, declarations[1].declaration_type)
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.dict(os.environ, {CACHE_PATH_ENV: os.path.join(temp_dir, 'index.sqlite3')}):
+            root: str = os.path.join(temp_dir, 'root')
+            os.makedirs(root)
+            for file_name, value in (('a.py', 1), ('b.py', 2)):
+                with open(os.path.join(root, file_name), 'w') as f:
+                    f.write('some_var = %d\n' % value)
+            index: DeclarationIndex = DeclarationIndex(os.environ[CACHE_PATH_ENV])
+            index.refresh([root], bytecode=False)
+            indexed: List[Declaration] = list(index.declarations([root], accept=NameFilter('some_var')))
+            index.close()
+            read: List[Declaration] = list(indexed)
+            if hasattr(socket, 'AF_UNIX'):
+                server: DeclarationServer = DeclarationServer(get_socket_path([root]), DeclarationStore(iter(indexed)))
+                thread: threading.Thread = threading.Thread(target=server.serve_forever, daemon=True)
+                thread.start()
+                try:
+                    read.extend(query([root], NameFilter('some_var')))
+                finally:
+                    server.shutdown()
+                    server.server_close()
+            self.assertEqual(len(read), 4 if hasattr(socket, 'AF_UNIX') else 2)
+            for declaration in read:  # names are shared by files and by both read paths (the index and the daemon)
+                self.assertIs(declaration.name, declarations[0].name)
+                self.assertIs(declaration.declaration_type, declarations[0].declaration_type)
+
+    def test_sort_import_order(self):
+        self.assertEqual(get_import_depth(os.path.join('root', 'mod.py'), 'root'), 1)
+        self.assertEqual(get_import_depth(os.path.join('root', 'pkg', '__init__.py'), 'root'), 1)
+        self.assertEqual(get_import_depth(os.path.join('root', 'pkg', 'mod.py'), 'root'), 2)
+        search_paths: List[str] = ['first', os.path.join('first', 'nested'), 'second']
+        module_paths: List[str] = [
+            os.path.join('first', 'pkg', 'deep.py'),
+            os.path.join('first', 'top.py'),
+            os.path.join('first', 'nested', 'pkg', 'mod.py'),
+            os.path.join('first', 'nested', 'mod.py'),
+            os.path.join('second', 'mod.py'),
+        ]
+        declarations: List[Declaration] = [
+            Declaration(declaration_type=declaration_types[0], name='name', module_path=module_path)
+            for module_path in module_paths
+        ]
+        self.assertEqual(
+            [d.module_path for d in sort_import_order(iter(declarations), search_paths)],
+            [module_paths[1], module_paths[0], module_paths[3], module_paths[2], module_paths[4]],
+        )
+
+    def test_write_lines(self):
+        stream: io.StringIO = io.StringIO()
+        self.assertEqual(write_lines(iter(['a', 'b']), stream), 2)
+        self.assertEqual(stream.getvalue(), 'a\nb\n')
+        closed_pipe: mock.Mock = mock.Mock()
+        closed_pipe.write.side_effect = [1, 1, BrokenPipeError()]
+        consumed: List[str] = []
+        lines: Iterator[str] = (consumed.append(line) or line for line in ['a', 'b', 'c'])
+        self.assertEqual(write_lines(lines, closed_pipe), 1)  # writing stops without an exception
+        self.assertEqual(consumed, ['a', 'b'])
+
+    def test_bytecode_declarations(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path: str = os.path.join(temp_dir, 'module.py')
+            with open(file_path, 'w') as f:
+                f.write(
+                    'import os.path as osp\nfrom os import sep, getcwd\n'
+                    'SOME_VAR = 1\nfor loop_var in range(2):\n    pass\n'
+                    'try:\n    import missing\nexcept ImportError as error:\n    def fallback():\n        pass\n'
+                    'if os:\n    class Conditional(object):\n        inner = 1\n'
+                    'def multi_line(\n        arg):\n    local = 2\n'
+                    'callback = lambda: None\n'
+                )
+            self.assertIsNone(get_bytecode_declarations(file_path))  # not compiled yet
+            py_compile.compile(file_path, cfile=get_pyc_path(file_path), doraise=True)
+            declarations: List[Declaration] = get_bytecode_declarations(file_path)
+            self.assertEqual(
+                [(d.declaration_type.name, d.name) for d in declarations],
+                [('var', 'SOME_VAR'), ('def', 'fallback'), ('class', 'Conditional'), ('def', 'multi_line'),
+                 ('var', 'callback')],
+            )
+            self.assertEqual([d.name for d in get_bytecode_declarations(file_path, accept=NameFilter('multi'))],
+                             ['multi_line'])
+            with open(file_path, 'a') as f:
+                f.write('CHANGED = 2\n')
+            self.assertIsNone(load_code(file_path))  # the pyc file is stale
+
+    def test_bytecode_variables(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path: str = os.path.join(temp_dir, 'module.py')
+            with open(file_path, 'w') as f:
+                f.write(
+                    'x = 1\nx += 1\nx = x or 2\ncounter = 0\ncounter += 1\nz = 1\nz = None\ndel z\n'
+                    'try:\n    pass\nexcept ImportError as error:\n    pass\n'
+                    'try:\n    pass\nexcept ImportError as x:\n    pass\n'
+                )
+            py_compile.compile(file_path, cfile=get_pyc_path(file_path), doraise=True)
+            self.assertEqual([(d.declaration_type.name, d.name) for d in get_bytecode_declarations(file_path)],
+                             [('var', 'x'), ('var', 'counter'), ('var', 'z')])
+            with open(file_path, 'w') as f:
+                f.write('x = 1\nx += 1\n')
+            py_compile.compile(file_path, cfile=get_pyc_path(file_path), doraise=True)
+            self.assertEqual([(d.declaration_type.name, d.name) for d in get_bytecode_declarations(file_path)],
+                             [('var', 'x')])
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'hash based pyc files require python 3.7')
+    def test_bytecode_checked_hash(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path: str = os.path.join(temp_dir, 'module.py')
+            with open(file_path, 'w') as f:
+                f.write('SOME_VAR = 1\n')
+            py_compile.compile(
+                file_path, cfile=get_pyc_path(file_path), doraise=True,
+                invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH,
+            )
+            self.assertEqual([d.name for d in get_bytecode_declarations(file_path)], ['SOME_VAR'])
+            with open(file_path, 'w') as f:
+                f.write('OTHER_VAR = 1\n')
+            self.assertIsNone(load_code(file_path))
+
+    def test_extension_declarations(self):
+        extension_paths: List[str] = [
+            os.path.join(path, name) for path in sys.path if os.path.isdir(path)
+            for name in os.listdir(path) if name.startswith('_json.') and is_extension(name)
+        ]
+        if not extension_paths:
+            self.skipTest('the _json extension module is not found')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            extension_path: str = os.path.join(temp_dir, os.path.basename(extension_paths[0]))
+            shutil.copyfile(extension_paths[0], extension_path)
+            with open(os.path.join(temp_dir, 'broken' + EXTENSION_SUFFIXES[-1]), 'wb') as f:
+                f.write(b'\x7fELF PyInit_broken')
+            self.assertEqual(list(get_python_files([temp_dir])), [])
+            self.assertEqual(len(list(get_python_files([temp_dir], extensions=True))), 2)
+            declarations: List[Declaration] = list(scan_declarations([temp_dir], accept=NameFilter('json')))
+            self.assertEqual([str(d) for d in declarations], ['ext: _json: %s' % extension_path])
+            self.assertEqual(get_extension_declarations(extension_path, accept=NameFilter('missing')), [])
+            self.assertTrue(file_contains(extension_path, b'pyinit__json', ignore_case=True))
+            self.assertFalse(file_contains(extension_path, b'missing', ignore_case=True))
+            self.assertFalse(file_contains(os.path.join(temp_dir, 'broken' + EXTENSION_SUFFIXES[-1]), b'broken'))
+            found: List[str] = ['ext: _json: %s' % extension_path]
+            for options, lines in (([], []), (['-v', '-d', '-c'], []), (['-e'], found), (['-c', '-e'], found)):
+                with mock.patch('sys.argv', ['whatprovides', '--path', temp_dir, '--no-cache'] + options + ['_json']), \
+                        mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+                    main()
+                self.assertEqual(stdout.getvalue().splitlines(), lines)
+
+    def test_fuzzy(self):
+        self.assertEqual(get_distance('argparser', 'argumentparser', 10), 5)
+        self.assertEqual(get_distance('argparser', 'argumentparser', 3), 4)
+        self.assertEqual(get_distance('kitten', 'sitting', 5), 3)
+        query: FuzzyQuery = FuzzyQuery('ArgumentPraser')
+        trigram_index: TrigramIndex = TrigramIndex(['ArgumentParser', 'ArgParser', 'StringIO', 'argument_parser'])
+        self.assertEqual(trigram_index.search(query), ['ArgumentParser', 'argument_parser'])
+        declarations: List[Declaration] = [
+            Declaration(declaration_type=declaration_types[2], name=name, module_path='')
+            for name in ('StringIO', 'argument_parser', 'ArgumentParser')
+        ]
+        self.assertEqual([d.name for d in filter_fuzzy(query, declarations)], ['ArgumentParser', 'argument_parser'])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index: DeclarationIndex = DeclarationIndex(os.path.join(temp_dir, 'index.sqlite3'))
+            index.refresh([self.test_path])
+            names: List[str] = [d.name for d in index.declarations([self.test_path], accept=FuzzyQuery('SomeClas'))]
+            self.assertEqual(names, ['SomeClass'])
+            index.close()
+
+    def test_batch(self):
+        stream: io.StringIO = io.StringIO('SomeClass\n# a comment\n\nsome_func1  # inline\nNotFound\nSomeClass\n')
+        names: List[str] = read_names(stream)
+        self.assertEqual(names, ['SomeClass', 'some_func1', 'NotFound'])
+        name_set: NameSet = NameSet(names)
+        declarations: List[Declaration] = list(scan_declarations([self.test_path], accept=name_set))
+        groups: List[Tuple[str, List[Declaration]]] = list(group_declarations(names, iter(declarations)))
+        self.assertEqual([(name, [d.name for d in found]) for name, found in groups],
+                         [('SomeClass', ['SomeClass']), ('some_func1', ['some_func1']), ('NotFound', [])])
+        store: DeclarationStore = DeclarationStore(iter(declarations))
+        self.assertEqual([d.name for d in store.search(name_set)], [d.name for d in declarations])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index: DeclarationIndex = DeclarationIndex(os.path.join(temp_dir, 'index.sqlite3'))
+            index.refresh([self.test_path])
+            self.assertEqual(sorted(d.name for d in index.declarations([self.test_path], accept=name_set)),
+                             ['SomeClass', 'some_func1'])
+            index.close()
+
+    def test_prefetch(self):
+        sequential: List[str] = [str(d) for d in scan_declarations([self.test_path], bytecode=False)]
+        threaded: List[str] = [str(d) for d in scan_declarations([self.test_path], bytecode=False, io_threads=4)]
+        self.assertEqual(threaded, sequential)
+        self.assertEqual(
+            [item[:2] for item in stat_python_files([self.test_path], io_threads=4)],
+            list(walk_python_files([self.test_path])),
+        )
+        with tempfile.TemporaryDirectory() as temp_dir:
+            mounts_path: str = os.path.join(temp_dir, 'mounts')
+            with open(mounts_path, 'w') as f:
+                f.write('/dev/sda1 / ext4 rw 0 0\nserver:/home /home/my\\040user nfs4 rw 0 0\n')
+            mounts: List[Tuple[str, str]] = get_mounts(mounts_path)
+            self.assertEqual(get_filesystem('/home/my user/venv/lib', mounts), 'nfs4')
+            self.assertEqual(get_filesystem('/home/my', mounts), 'ext4')
+        self.assertEqual(get_io_threads(3, []), 3)
+
+    def test_prefetch_symlink_loop(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root: str = os.path.join(temp_dir, 'root')
+            for index in range(3):
+                package_path: str = os.path.join(root, 'package%d' % index)
+                os.makedirs(package_path)
+                with open(os.path.join(package_path, 'module.py'), 'w') as f:
+                    f.write('class Looped%d:\n    pass\n' % index)
+                os.symlink(root, os.path.join(package_path, 'loop'))
+            sequential: List[Tuple[str, str]] = list(walk_python_files([root]))
+            self.assertEqual(len(sequential), 3)
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                prefetcher: FolderPrefetcher = FolderPrefetcher(executor, lambda name: False, max_pending=2)
+                self.assertEqual(list(walk_python_files([root], scandir=prefetcher, skip=prefetcher.discard)),
+                                 sequential)
+                self.assertEqual(prefetcher.pending, {})  # listings of skipped loops are released
+            self.assertEqual([str(d) for d in scan_declarations([root], bytecode=False, io_threads=2)],
+                             [str(d) for d in scan_declarations([root], bytecode=False)])
+
+    def test_environments(self):
+        self.assertIn(os.path.dirname(os.__file__), get_interpreter_paths(sys.executable))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            site_packages: str = os.path.join(temp_dir, 'lib', 'python3.8', 'site-packages')
+            os.makedirs(site_packages)
+            with open(os.path.join(temp_dir, 'pyvenv.cfg'), 'w') as f:
+                f.write('home = /usr/bin\ninclude-system-site-packages = false\nversion = 3.8.5\n')
+            self.assertEqual(get_venv_paths(temp_dir)[:2], [site_packages, '/usr/lib/python3.8'])
+            with open(os.path.join(temp_dir, 'pyvenv.cfg'), 'w') as f:
+                f.write('home = /usr/bin\n')  # old virtualenv does not write the version
+            self.assertEqual(get_venv_paths(temp_dir)[:2], [site_packages, '/usr/lib/python3.8'])
+            os.makedirs(os.path.join(temp_dir, 'lib', 'python3.9', 'site-packages'))
+            with self.assertRaises(RuntimeError):
+                get_venv_paths(temp_dir)  # the version is ambiguous
+            with self.assertRaises(RuntimeError):
+                get_venv_paths(site_packages)
+            with mock.patch.dict(os.environ, {'PYTHONPATH': temp_dir}):
+                self.assertNotIn(temp_dir, get_interpreter_paths(sys.executable))
+
+    def test_declaration_index_contents(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            roots: List[str] = [os.path.join(temp_dir, 'env1'), os.path.join(temp_dir, 'env2')]
+            for root in roots:
+                os.makedirs(root)
+                with open(os.path.join(root, 'module.py'), 'w') as f:
+                    f.write('class SharedClass:\n    pass\n')
+            index: DeclarationIndex = DeclarationIndex(os.path.join(temp_dir, 'index.sqlite3'))
+            self.assertEqual(index.refresh(roots, bytecode=False), 1)  # the same content is scanned once
+            self.assertEqual([d.module_path for d in index.declarations(roots, accept=NameFilter('Shared'))],
+                             [os.path.join(root, 'module.py') for root in roots])
+            os.remove(os.path.join(roots[0], 'module.py'))
+            self.assertEqual(index.refresh(roots, bytecode=False), 0)
+            self.assertEqual(len(list(index.declarations(roots))), 1)
+            index.close()
+
+    def test_declaration_index_bytecode(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root: str = os.path.join(temp_dir, 'root')
+            os.makedirs(root)
+            file_path: str = os.path.join(root, 'module.py')
+            with open(file_path, 'w') as f:
+                f.write('if True:\n    NESTED = 1\n')  # a nested declaration is found only in bytecode
+            py_compile.compile(file_path, cfile=get_pyc_path(file_path), doraise=True)
+            index: DeclarationIndex = DeclarationIndex(os.path.join(temp_dir, 'index.sqlite3'))
+            self.assertEqual(index.refresh([root]), 1)
+            self.assertEqual([d.name for d in index.declarations([root])], ['NESTED'])
+            self.assertEqual(index.refresh([root], bytecode=False), 1)  # bytecode rows are not reused
+            self.assertEqual(list(index.declarations([root])), [])
+            self.assertEqual(index.refresh([root], bytecode=False), 0)
+            self.assertEqual(index.update_files({file_path: root}), 1)
+            self.assertEqual([d.name for d in index.declarations([root])], ['NESTED'])
+            index.close()
+
+    def test_binary_index(self):
+        declarations: List[Declaration] = list(scan_declarations([self.test_path]))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index_path: str = os.path.join(temp_dir, 'index.bin')
+            self.assertEqual(write_binary_index(index_path, iter(declarations), '0123456789abcdef'), len(declarations))
+            binary_index: BinaryIndex = BinaryIndex(index_path)
+            self.assertEqual(binary_index.generation, '0123456789abcdef')
+            self.assertEqual([str(d) for d in binary_index.lookup('SomeClass')],
+                             [str(d) for d in declarations if d.name == 'SomeClass'])
+            self.assertEqual(sorted(str(d) for d in binary_index.lookup('some_', prefix=True)),
+                             sorted(str(d) for d in declarations if d.name.startswith('some_')))
+            self.assertEqual(list(binary_index.lookup('some_')), [])
+            self.assertEqual(list(binary_index.lookup('\uffff', prefix=True)), [])
+            binary_index.close()
+            with open(index_path, 'wb') as f:
+                f.write(b'not an index')
+            with self.assertRaises(ValueError):
+                BinaryIndex(index_path)
+            with mock.patch.dict(os.environ, {CACHE_PATH_ENV: os.path.join(temp_dir, 'index.sqlite3')}):
+                for refresh in (True, False):
+                    self.assertEqual([d.name for d in get_binary_declarations([self.test_path], 'Some', prefix=True,
+                                                                              refresh=refresh)], ['SomeClass'])
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime requires python 3.7')
+    def test_import_time(self):
+        environment: Dict[str, str] = dict(os.environ)
+        environment.pop('PYTHONDONTWRITEBYTECODE', None)  # the compilation of sources is not measured
+
+        def run_python(code: str) -> Tuple[float, Dict[str, int]]:
+            started: float = time.perf_counter()
+            output: str = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', code],
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=os.path.dirname(SCRIPT_PATH), env=environment,
+                check=True,
+            ).stderr.decode('utf-8', 'replace')
+            elapsed: float = time.perf_counter() - started
+            modules: Dict[str, int] = {}  # a module: a cumulative time of its import in microseconds
+            for line in output.splitlines():
+                parts: List[str] = line.split('|')
+                if len(parts) == 3 and parts[1].strip().isdigit():
+                    modules[parts[2].strip()] = int(parts[1])
+            return elapsed, modules
+
+        baselines: List[float] = []
+        timings: List[float] = []
+        for _ in range(5):  # the first run writes bytecode, the best of other runs is taken
+            baseline, _modules = run_python('pass')
+            baselines.append(baseline)
+            timing, modules = run_python('import whatprovides.whatprovides')
+            timings.append(timing)
+            for module in LAZY_MODULES:
+                self.assertNotIn(module, modules)
+            if sys.version_info >= (3, 7):  # the package imports the core lazily (PEP 562)
+                _timing, modules = run_python('import whatprovides.cli')
+                self.assertNotIn('whatprovides.whatprovides', modules)
+        self.assertLess(min(timings[1:]) - min(baselines[1:]), IMPORT_TIME_BUDGET * min(baselines[1:]))
+
+    def test_watch(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root: str = os.path.join(temp_dir, 'root')
+            os.makedirs(os.path.join(root, 'pkg'))
+            with open(os.path.join(root, 'pkg', 'module.py'), 'w') as f:
+                f.write('class Alpha:\n    pass\n')
+            index: DeclarationIndex = DeclarationIndex(os.path.join(temp_dir, 'index.sqlite3'))
+            watchers: List[object] = [PollingWatcher(interval=0)]
+            try:
+                watchers.append(InotifyWatcher())
+            except OSError:
+                pass  # inotify is not available
+            for watcher in watchers:
+                index.clear()
+                index_watcher: IndexWatcher = IndexWatcher([root], index, watcher=watcher, bytecode=False)
+                self.assertEqual(index_watcher.start(), 1)
+
+                def get_names() -> List[str]:
+                    index_watcher.apply(watcher.changes(0.1) | watcher.changes(0.1))
+                    binary_index: BinaryIndex = BinaryIndex(get_binary_index_path(index.cache_path, [root]))
+                    names: List[str] = [d.name for d in binary_index.lookup('', prefix=True)]
+                    binary_index.close()
+                    self.assertEqual(sorted(d.name for d in index.declarations([root])), names)
+                    return names
+
+                os.makedirs(os.path.join(root, 'new', 'sub'))
+                with open(os.path.join(root, 'new', 'sub', 'module.py'), 'w') as f:
+                    f.write('def beta():\n    pass\n')
+                self.assertEqual(get_names(), ['Alpha', 'beta'])
+                shutil.rmtree(os.path.join(root, 'new'))
+                os.remove(os.path.join(root, 'pkg', 'module.py'))
+                self.assertEqual(get_names(), [])
+                with open(os.path.join(root, 'pkg', 'module.py'), 'w') as f:
+                    f.write('class Alpha:\n    pass\n')
+                watcher.close()
+            index.close()
+
+    def test_module_names(self):
+        site: str = os.path.join(os.sep, 'site')
+        nested: str = os.path.join(site, 'pkg', 'vendor')  # a search path inside of a package
+        module_names: ModuleNames = ModuleNames([site, nested, '/archive.zip'])
+        self.assertEqual(module_names.get(os.path.join(site, 'argparse.py')), 'argparse')
+        self.assertEqual(module_names.get(os.path.join(site, 'pkg', '__init__.py')), 'pkg')
+        self.assertEqual(module_names.get(os.path.join(site, 'pkg', 'sub', 'mod.py')), 'pkg.sub.mod')
+        self.assertEqual(module_names.get(os.path.join(nested, 'six.py')), 'six')
+        self.assertEqual(module_names.get('/archive.zip/inner/x.py'), 'inner.x')
+        self.assertIsNone(module_names.get(os.path.join(site, 'pkg-1.0.dist-info', 'x.py')))
+        self.assertIsNone(module_names.get(os.path.join(os.sep, 'other', 'x.py')))
+        self.assertIsNone(module_names.get(os.path.join(site, '__init__.py')))
+        self.assertEqual(get_module_stem('_json%s' % EXTENSION_SUFFIXES[0]), '_json')
+        var, function, cls = declaration_types[:3]
+        self.assertEqual(get_import_statement(Declaration(cls, 'ArgumentParser', ''), 'argparse'),
+                         'from argparse import ArgumentParser')
+        self.assertIsNone(get_import_statement(Declaration(function, 'main', ''), None))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            package: str = os.path.join(temp_dir, 'pkg')
+            os.makedirs(os.path.join(package, 'sub'))
+            for file_path, source in (
+                    (os.path.join(package, '__init__.py'), 'VERSION = 1\n'),
+                    (os.path.join(package, 'sub', '__init__.py'), ''),
+                    (os.path.join(package, 'sub', 'mod.py'), 'def provided():\n    pass\n'),
+            ):
+                with open(file_path, 'w') as f:
+                    f.write(source)
+            self.assertEqual(
+                [(d.name, d.module_path) for d in get_module_declarations(['pkg.sub.mod', 'pkg'], [temp_dir])],
+                [
+                    ('provided', os.path.join(package, 'sub', 'mod.py')),
+                    ('VERSION', os.path.join(package, '__init__.py')),
+                ],
+            )
+            self.assertEqual(list(get_module_declarations(['pkg.missing'], [temp_dir])), [])
+
+    def test_binary_index_fresh(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            search_path: str = os.path.join(temp_dir, 'site')
+            os.mkdir(search_path)
+            os.utime(search_path, (1.0, 1.0))
+            index_path: str = os.path.join(temp_dir, 'index.bin')
+            self.assertFalse(is_fresh(index_path, [search_path]))
+            write_binary_index(index_path, iter([]), '0123456789abcdef', [search_path])
+            self.assertTrue(is_fresh(index_path, [search_path, os.path.join(temp_dir, 'missing')]))
+            self.assertFalse(is_fresh(index_path, [search_path], fresh_time=-1.0))
+            os.mkdir(os.path.join(search_path, 'installed'))  # a package was installed
+            self.assertFalse(is_fresh(index_path, [search_path]))
+            with mock.patch.dict(os.environ, {CACHE_PATH_ENV: os.path.join(temp_dir, 'index.sqlite3')}):
+                self.assertEqual(list(get_binary_declarations([search_path], 'Nested')), [])
+                with open(os.path.join(search_path, 'installed', 'module.py'), 'w') as f:
+                    f.write('class Nested:\n    pass\n')  # a nested file does not change the search path
+                self.assertEqual(list(get_binary_declarations([search_path], 'Nested')), [])  # the index is fresh
+                index: DeclarationIndex = DeclarationIndex(os.environ[CACHE_PATH_ENV])
+                index.refresh([search_path], bytecode=False)  # e.g. by --watch, the generation is changed
+                index.close()
+                self.assertEqual([d.name for d in get_binary_declarations([search_path], 'Nested')], ['Nested'])
+
+    def test_completions(self):
+        roots: List[str] = ['/site', '/stdlib']
+        var, function, cls = declaration_types
+        declarations: List[Declaration] = [
+            Declaration(var, 'ArgumentParser', '/site/a.py'),
+            Declaration(function, 'arg_value', '/site/b.py'),
+            Declaration(cls, 'ArgumentParser', '/site/c.py'),
+            Declaration(cls, 'ArgumentError', '/stdlib/argparse.py'),
+            Declaration(cls, 'Argument', '/stdlib/argparse.py'),
+            Declaration(cls, 'Other', '/stdlib/argparse.py'),
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index_path: str = os.path.join(temp_dir, 'index.bin')
+            write_binary_index(index_path, iter(declarations), '0123456789abcdef', roots)
+            binary_index: BinaryIndex = BinaryIndex(index_path)
+            self.assertEqual([str(d) for d in binary_index.complete('Arg')], [
+                'class: ArgumentParser: /site/c.py',
+                'class: Argument: /stdlib/argparse.py',
+                'class: ArgumentError: /stdlib/argparse.py',
+            ])
+            self.assertEqual([d.name for d in binary_index.complete('', limit=2)], ['ArgumentParser', 'arg_value'])
+            self.assertEqual([d.name for d in binary_index.complete('', types={'def'})], ['arg_value'])
+            binary_index.close()
+            with mock.patch.dict(os.environ, {CACHE_PATH_ENV: os.path.join(temp_dir, 'index.sqlite3')}):
+                self.assertEqual(
+                    [str(d) for d in get_completions([self.test_path], 'some', 10)],
+                    [str(d) for d in get_completions([self.test_path], 'some', 10, use_cache=False)],
+                )
@@ -0,0 +1,153 @@
+"""
+This module provides a trigram index of names of declarations for 'whatprovides' project
+
+Each name is split to lower case trigrams (substrings of 3 characters),
+a posting list of a trigram contains ids of names which contain the trigram.
+A substring, a case insensitive or a regex query is narrowed to names containing all trigrams
+of the search string (or of the literal required by the regex pattern), then candidates are verified.
+A fuzzy query is narrowed to names containing a part of trigrams of the search string, see *fuzzy.FuzzyQuery*.
+Exact names of a batch query (see *NameSet*) are looked up by names without trigrams.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+from collections import Counter
+from typing import List, Dict, Set, Iterable, Optional, Callable
+from .whatprovides import NameFilter, get_regex_literal
+
+#: a length of an n-gram
+TRIGRAM_LENGTH: int = 3
+
+
+def get_trigrams(text: str) -> Set[str]:
+    """
+    Returns lower case trigrams of a text
+
+    :param text: a text (e.g. a name of a declaration)
+    :type text: str
+    :return: a set of trigrams, it is empty if the text is shorter than 3 characters
+    :rtype: Set[str]
+    """
+    text = text.lower()
+    return {text[i:i + TRIGRAM_LENGTH] for i in range(len(text) - TRIGRAM_LENGTH + 1)}
+
+
+def get_query_trigrams(accept: Callable[[str], bool]) -> Set[str]:
+    """
+    Returns trigrams which any name accepted by a predicate contains (or a part of them, see *get_min_shared*).
+    Trigrams are known for NameFilter: trigrams of the search string
+    or of the literal required by the regex pattern, and for a predicate with the *trigrams* attribute
+
+    :param accept: a predicate for names of declarations
+    :type accept: Callable[[str], bool]
+    :return: a set of trigrams, it is empty if candidates can not be narrowed
+    :rtype: Set[str]
+    """
+    if not isinstance(accept, NameFilter):
+        return set(getattr(accept, 'trigrams', ()))
+    if accept.pattern:
+        return get_trigrams(get_regex_literal(accept.pattern.pattern, accept.pattern.flags))
+    return get_trigrams(accept.search)
+
+
+def get_min_shared(accept: Callable[[str], bool], trigrams: Set[str]) -> int:
+    """
+    Returns a minimal count of query trigrams which any name accepted by a predicate contains,
+    it is less than a count of the trigrams for a predicate with the *min_shared* attribute (e.g. a fuzzy query)
+
+    :param accept: a predicate for names of declarations
+    :type accept: Callable[[str], bool]
+    :param trigrams: trigrams of the query, see *get_query_trigrams*
+    :type trigrams: Set[str]
+    :return: a minimal count of shared trigrams
+    :rtype: int
+    """
+    return min(getattr(accept, 'min_shared', len(trigrams)), len(trigrams))
+
+
+class TrigramIndex:
+    """
+    An in-memory trigram index of names
+
+    :param names: names to index
+    :type names: Iterable[str]
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        #: indexed names, an id of a name is its position in this list
+        self.names: List[str] = []
+        self.ids: Dict[str, int] = {}
+        #: a trigram: ids of names containing the trigram
+        self.postings: Dict[str, List[int]] = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str) -> int:
+        """
+        Adds a name to the index, returns its id
+
+        :param name: a name to add
+        :type name: str
+        :return: an id of the name
+        :rtype: int
+        """
+        name_id: Optional[int] = self.ids.get(name)
+        if name_id is not None:
+            return name_id
+        name_id = len(self.names)
+        self.names.append(name)
+        self.ids[name] = name_id
+        for trigram in get_trigrams(name):
+            self.postings.setdefault(trigram, []).append(name_id)
+        return name_id
+
+    def candidates(self, trigrams: Set[str], min_shared: Optional[int] = None) -> Iterable[int]:
+        """
+        Returns ids of names containing all trigrams (or at least *min_shared* of them),
+        posting lists are intersected starting from the shortest one
+
+        :param trigrams: trigrams which names must contain
+        :type trigrams: Set[str]
+        :param min_shared: a minimal count of trigrams which names must contain, all trigrams by default
+        :type min_shared: Optional[int]
+        :return: ids of names, all ids if *trigrams* is empty or *min_shared* is not positive
+        :rtype: Iterable[int]
+        """
+        if not trigrams or min_shared is not None and min_shared <= 0:
+            return range(len(self.names))
+        if min_shared is not None and min_shared < len(trigrams):
+            shared: Counter = Counter()
+            for trigram in trigrams:
+                shared.update(self.postings.get(trigram, ()))
+            return sorted(name_id for name_id, count in shared.items() if count >= min_shared)
+        postings: List[List[int]] = sorted((self.postings.get(trigram, []) for trigram in trigrams), key=len)
+        result: Set[int] = set(postings[0])
+        for posting in postings[1:]:
+            if not result:
+                break
+            result.intersection_update(posting)
+        return sorted(result)
+
+    def search(self, accept: Callable[[str], bool]) -> List[str]:
+        """
+        Returns names accepted by a predicate (e.g. NameFilter),
+        candidates are narrowed by trigrams of the query before they are verified,
+        names of a predicate with the *names* attribute (e.g. NameSet) are looked up directly
+
+        :param accept: a predicate for names of declarations
+        :type accept: Callable[[str], bool]
+        :return: a list of accepted names
+        :rtype: List[str]
+        """
+        names: List[str] = self.names
+        exact_names: Optional[Iterable[str]] = getattr(accept, 'names', None)
+        if exact_names is not None:
+            return [names[name_id] for name_id in sorted(self.ids[name] for name in exact_names if name in self.ids)]
+        trigrams: Set[str] = get_query_trigrams(accept)
+        return [
+            names[name_id] for name_id in self.candidates(trigrams, get_min_shared(accept, trigrams))
+            if accept(names[name_id])
+        ]
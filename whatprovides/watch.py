@@ -0,0 +1,431 @@
+"""
+This module keeps the declarations index of 'whatprovides' project up to date by watching search paths
+
+Folders visited by *walk_python_files* are watched using *inotify* on Linux (via ctypes),
+otherwise or if inotify watches can not be added (e.g. the limit of watches is reached)
+the folders are polled. On each change only affected python files are scanned again,
+new folders are walked and watched, declarations of removed files and folders are dropped.
+After each change the binary index is rewritten, so queries using the index as is
+(e.g. *whatprovides -x --no-refresh*) are answered without any scan.
+
+Author:
+ shmakovpn <shmakovpn@yandex.ru>
+
+Date:
+ 2020-06-21
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+from typing import List, Dict, Set, Tuple, Optional, Callable, Any
+from .whatprovides import DecodeCallback, walk_python_files, get_search_path, is_extension, pruned_folders, \
+    _get_pruned_matcher, _scandir, get_cache_path
+from .cache import DeclarationIndex
+from .binindex import get_binary_index_path, write_binary_index
+
+#: an interval in seconds between polls of folders if inotify is not available
+POLL_INTERVAL: float = 2.0
+
+#: a time in seconds without events after which changes are applied, e.g. *pip install* changes many files
+SETTLE_DELAY: float = 0.2
+
+#: a maximal time in seconds during which changes are collected before they are applied
+MAX_SETTLE_TIME: float = 5.0
+
+# flags of inotify, see *man 7 inotify*
+IN_CLOSE_WRITE: int = 0x00000008
+IN_MOVED_FROM: int = 0x00000040
+IN_MOVED_TO: int = 0x00000080
+IN_CREATE: int = 0x00000100
+IN_DELETE: int = 0x00000200
+IN_DELETE_SELF: int = 0x00000400
+IN_MOVE_SELF: int = 0x00000800
+IN_Q_OVERFLOW: int = 0x00004000
+IN_IGNORED: int = 0x00008000
+IN_ONLYDIR: int = 0x01000000
+IN_CLOEXEC: int = 0o2000000
+
+#: events of watched folders which change python files or folders
+WATCH_MASK: int = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF \
+    | IN_MOVE_SELF | IN_ONLYDIR
+
+#: a header of an inotify event: a watch descriptor, a mask, a cookie and a length of a name
+EVENT: struct.Struct = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """
+    A watcher of folders using inotify of Linux, the libc functions are called via ctypes
+
+    :raises OSError: if inotify is not available
+    """
+
+    #: a name of the watcher
+    name: str = 'inotify'
+
+    def __init__(self):
+        import ctypes
+        libc: Any = ctypes.CDLL(None, use_errno=True)
+        try:
+            self._add_watch: Callable[[int, bytes, int], int] = libc.inotify_add_watch
+            self.fd: int = libc.inotify_init1(IN_CLOEXEC)
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._get_errno: Callable[[], int] = ctypes.get_errno
+        if self.fd < 0:
+            error: int = self._get_errno()
+            raise OSError(error, os.strerror(error))
+        #: watched folders by watch descriptors
+        self.folders: Dict[int, str] = {}
+
+    def close(self) -> None:
+        """
+        Closes the inotify instance, all watches are removed
+        """
+        os.close(self.fd)
+
+    def add(self, folder: str) -> None:
+        """
+        Starts watching a folder
+
+        :param folder: a path to a folder
+        :type folder: str
+        :raises OSError: if the folder can not be watched (e.g. the limit of watches is reached)
+        """
+        wd: int = self._add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            error: int = self._get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return  # the folder was removed
+            raise OSError(error, os.strerror(error), folder)
+        self.folders[wd] = folder
+
+    def changes(self, timeout: float) -> Optional[Set[str]]:
+        """
+        Waits for changes and returns changed paths
+
+        :param timeout: a maximal time to wait in seconds
+        :type timeout: float
+        :return: paths of changed files and folders, an empty set if nothing was changed,
+            None if events were lost and everything should be checked
+        :rtype: Optional[Set[str]]
+        """
+        paths: Set[str] = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return paths
+        data: bytes = os.read(self.fd, 1 << 16)
+        offset: int = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name: bytes = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            folder: Optional[str] = self.folders.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.folders[wd]  # the folder was removed or unmounted
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                paths.add(folder)
+            elif name:
+                paths.add(os.path.join(folder, os.fsdecode(name)))
+        return paths
+
+
+class PollingWatcher:
+    """
+    A watcher of folders which compares listings of folders with previous ones
+
+    :param interval: an interval in seconds between polls
+    :type interval: float
+    :param accept: a predicate for names of files, only accepted files are stat'ed
+    :type accept: Optional[Callable[[str], bool]]
+    """
+
+    #: a name of the watcher
+    name: str = 'polling'
+
+    def __init__(self, interval: float = POLL_INTERVAL, accept: Optional[Callable[[str], bool]] = None):
+        self.interval: float = interval
+        self.accept: Optional[Callable[[str], bool]] = accept
+        #: watched folders: names of their entries: an mtime and a size (-1 for folders)
+        self.folders: Dict[str, Dict[str, Tuple[int, int]]] = {}
+
+    def close(self) -> None:
+        """
+        Stops watching all folders
+        """
+        self.folders.clear()
+
+    def _list(self, folder: str) -> Optional[Dict[str, Tuple[int, int]]]:
+        entries: Dict[str, Tuple[int, int]] = {}
+        try:
+            with os.scandir(folder) as scanned:
+                for entry in scanned:
+                    try:
+                        if entry.is_dir():
+                            entries[entry.name] = (-1, -1)
+                        elif self.accept is None or self.accept(entry.name):
+                            stat: os.stat_result = entry.stat()
+                            entries[entry.name] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        continue  # the entry was removed
+        except OSError:
+            return None
+        return entries
+
+    def add(self, folder: str) -> None:
+        """
+        Starts watching a folder
+
+        :param folder: a path to a folder
+        :type folder: str
+        """
+        entries: Optional[Dict[str, Tuple[int, int]]] = self._list(folder)
+        if entries is not None:
+            self.folders[folder] = entries
+
+    def changes(self, timeout: float) -> Optional[Set[str]]:
+        """
+        Sleeps up to the poll interval and returns changed paths
+
+        :param timeout: a maximal time to wait in seconds
+        :type timeout: float
+        :return: paths of changed files and folders, an empty set if nothing was changed
+        :rtype: Optional[Set[str]]
+        """
+        time.sleep(min(timeout, self.interval))
+        paths: Set[str] = set()
+        for folder, entries in list(self.folders.items()):
+            current: Optional[Dict[str, Tuple[int, int]]] = self._list(folder)
+            if current is None:
+                del self.folders[folder]
+                paths.add(folder)
+                continue
+            for name in entries.keys() | current.keys():
+                if entries.get(name) != current.get(name):
+                    paths.add(os.path.join(folder, name))
+            self.folders[folder] = current
+        return paths
+
+
+def get_watcher(accept: Optional[Callable[[str], bool]] = None) -> Any:
+    """
+    Returns an inotify watcher if it is available, otherwise a polling watcher
+
+    :param accept: a predicate for names of files which are polled
+    :type accept: Optional[Callable[[str], bool]]
+    :return: a watcher
+    :rtype: Any
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except OSError:
+            pass
+    return PollingWatcher(accept=accept)
+
+
+class IndexWatcher:
+    """
+    Keeps the declarations index and the binary index of search paths up to date with changes of files
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param index: the declarations index
+    :type index: DeclarationIndex
+    :param watcher: a watcher of folders (e.g. InotifyWatcher), *get_watcher()* by default
+    :type watcher: Any
+    :param jobs: A count of worker processes used to scan changed files, zero means a count of CPU cores
+    :type jobs: int
+    :param on_decode: an optional picklable callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param bytecode: read declarations from up to date pyc files instead of sources
+    :type bytecode: bool
+    :param io_threads: A count of threads which list folders, stat and read files if *jobs* is 1
+    :type io_threads: int
+    """
+
+    def __init__(
+            self,
+            search_paths: List[str],
+            index: DeclarationIndex,
+            watcher: Any = None,
+            jobs: int = 1,
+            on_decode: Optional[DecodeCallback] = None,
+            bytecode: bool = True,
+            io_threads: int = 1,
+    ):
+        self.search_paths: List[str] = search_paths
+        self.index: DeclarationIndex = index
+        self.is_pruned: Callable[[str], bool] = _get_pruned_matcher(pruned_folders)
+        self.watcher: Any = watcher if watcher is not None else get_watcher(self.is_python_file)
+        self.jobs: int = jobs
+        self.on_decode: Optional[DecodeCallback] = on_decode
+        self.bytecode: bool = bytecode
+        self.io_threads: int = io_threads
+        #: search paths of watched folders
+        self.roots: Dict[str, str] = {}
+
+    def is_python_file(self, name: str) -> bool:
+        """
+        Checks that a name of a file is a name of a python file or a compiled extension module
+        """
+        return (name.lower().endswith('.py') or is_extension(name)) and not self.is_pruned(name)
+
+    def _walk(self, search_paths: List[str]) -> List[str]:
+        """
+        Walks search paths (or new folders) and watches visited folders
+
+        :return: paths of found python files
+        :rtype: List[str]
+        """
+        folders: List[str] = []
+
+        def scandir(path: str) -> List[os.DirEntry]:
+            folders.append(path)
+            return _scandir(path)
+
+        file_paths: List[str] = [
+            file_path for _, file_path in walk_python_files(search_paths, extensions=True, scandir=scandir)
+        ]
+        for folder in folders:
+            self.roots[folder] = get_search_path(os.path.join(folder, ''), self.search_paths)
+            try:
+                self.watcher.add(folder)
+            except OSError as e:
+                print('inotify can not be used, folders are polled: %s' % e, file=sys.stderr)
+                self.watcher.close()
+                self.watcher = PollingWatcher(accept=self.is_python_file)
+                for watched in self.roots:
+                    self.watcher.add(watched)
+        return file_paths
+
+    def start(self) -> int:
+        """
+        Refreshes the indexes and starts watching folders of search paths
+
+        :return: a count of scanned files
+        :rtype: int
+        """
+        scanned: int = self.index.refresh(
+            self.search_paths, jobs=self.jobs, on_decode=self.on_decode, bytecode=self.bytecode,
+            io_threads=self.io_threads,
+        )
+        self._walk(self.search_paths)
+        self._write_binary_index()
+        return scanned
+
+    def _write_binary_index(self) -> None:
+        write_binary_index(
+            get_binary_index_path(self.index.cache_path, self.search_paths),
+            self.index.declarations(self.search_paths),
+            self.index.get_generation(),
+            self.search_paths,
+        )
+
+    def apply(self, paths: Optional[Set[str]]) -> int:
+        """
+        Updates the indexes with changed paths
+
+        :param paths: paths of changed files and folders, None means that all files should be checked
+        :type paths: Optional[Set[str]]
+        :return: a count of updated (scanned or removed) python files
+        :rtype: int
+        """
+        generation: str = self.index.get_generation()
+        if paths is None:
+            count: int = self.start()
+        else:
+            file_roots: Dict[str, str] = {}
+            for path in sorted(paths):
+                if self.is_pruned(os.path.basename(path)):
+                    continue
+                root: str = self.roots.get(os.path.dirname(path)) or self.roots.get(path, '')
+                if os.path.isdir(path):
+                    for file_path in self._walk([path]):
+                        file_roots[file_path] = root  # a new folder, e.g. a new package
+                elif not os.path.exists(path):
+                    file_roots[path] = root  # a removed file or folder
+                    prefix: str = os.path.join(path, '')
+                    for folder in [folder for folder in self.roots if folder == path or folder.startswith(prefix)]:
+                        del self.roots[folder]
+                elif self.is_python_file(os.path.basename(path)):
+                    file_roots[path] = root
+            file_roots = {path: root for path, root in file_roots.items() if root}
+            count = len(file_roots)
+            self.index.update_files(
+                file_roots, jobs=self.jobs, on_decode=self.on_decode, bytecode=self.bytecode,
+                io_threads=self.io_threads,
+            )
+        if self.index.get_generation() == generation:
+            return 0
+        self._write_binary_index()
+        return count
+
+    def run(self, stopped: Optional[threading.Event] = None) -> None:
+        """
+        Applies changes until *stopped* is set or the process is interrupted,
+        changes are collected until no events come for *SETTLE_DELAY* seconds
+
+        :param stopped: an optional event which stops watching
+        :type stopped: Optional[threading.Event]
+        """
+        stopped = stopped or threading.Event()
+        while not stopped.is_set():
+            paths: Optional[Set[str]] = self.watcher.changes(POLL_INTERVAL)
+            if not paths and paths is not None:
+                continue
+            started: float = time.perf_counter()
+            while paths is not None and time.perf_counter() - started < MAX_SETTLE_TIME:
+                more: Optional[Set[str]] = self.watcher.changes(SETTLE_DELAY)
+                if not more and more is not None:
+                    break
+                paths = None if more is None else paths | more
+            count: int = self.apply(paths)
+            if count:
+                print('python files were updated: %i' % count, file=sys.stderr)
+
+
+def watch(
+        search_paths: List[str],
+        jobs: int = 1,
+        on_decode: Optional[DecodeCallback] = None,
+        bytecode: bool = True,
+        io_threads: int = 1,
+) -> None:
+    """
+    Watches search paths and keeps the declarations index up to date until the process is interrupted
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param jobs: A count of worker processes used to scan changed files, zero means a count of CPU cores
+    :type jobs: int
+    :param on_decode: an optional picklable callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param bytecode: read declarations from up to date pyc files instead of sources
+    :type bytecode: bool
+    :param io_threads: A count of threads which list folders, stat and read files if *jobs* is 1
+    :type io_threads: int
+    """
+    index: DeclarationIndex = DeclarationIndex(get_cache_path())
+    watcher: IndexWatcher = IndexWatcher(
+        search_paths, index, jobs=jobs, on_decode=on_decode, bytecode=bytecode, io_threads=io_threads,
+    )
+    try:
+        watcher.start()
+        print('watching %i folders using %s' % (len(watcher.roots), watcher.watcher.name), file=sys.stderr)
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.watcher.close()
+        index.close()
@@ -13,12 +13,23 @@ Date:
 """
 import os
 import sys
+import io
 import re
-import argparse
-import chardet
-from typing import List, Pattern, Match, Iterator
+import mmap
+import time
+import codecs
+import fnmatch
+import itertools
+import importlib.machinery
+from typing import List, Dict, Set, FrozenSet, Tuple, Optional, Callable, Pattern, Match, Iterator, Iterable, \
+    TextIO, TYPE_CHECKING
 from functools import partial
 
+if TYPE_CHECKING:
+    import argparse
+    from .stats import Stats
+    from .binindex import BinaryIndex
+
 
 class DeclarationType:
     """
@@ -34,6 +45,7 @@ class DeclarationType:
     :param pattern: a pattern to match a declaration in a string
     :type pattern: Pattern
     """
+    __slots__ = ('name', 'pattern')
 
     def __init__(self, name: str, pattern: Pattern):
         self.name = name
@@ -79,6 +91,28 @@ declaration_types: List[DeclarationType] = [
     ),
 ]
 
+#: types of declaration exported by compiled extension modules, they are matched against names of symbols
+extension_declaration_types: List[DeclarationType] = [
+    DeclarationType(
+        name='ext',
+        pattern=re.compile(r'^PyInit_(?P<name>[A-Za-z_][A-Za-z0-9_]*)$'),
+    ),
+    DeclarationType(
+        name='sym',
+        pattern=re.compile(r'^(?P<name>[A-Za-z_][A-Za-z0-9_]*)$'),
+    ),
+]
+
+
+def get_declaration_types() -> List[DeclarationType]:
+    """
+    Returns all known declaration types: types of python code and types of extension modules
+
+    :return: a list of declaration types
+    :rtype: List[DeclarationType]
+    """
+    return declaration_types + extension_declaration_types
+
 
 class Declaration:
     """
@@ -91,6 +125,9 @@ class Declaration:
     :param module_path: a path to python_module where the declaration was found
     :type module_path: str
     """
+    # a declaration holds references to a shared type, an interned name and a path shared by declarations
+    # of the same file, so a declaration costs a fixed size object without a __dict__
+    __slots__ = ('declaration_type', 'name', 'module_path')
 
     def __init__(self, declaration_type: DeclarationType, name: str, module_path: str):
         self.declaration_type = declaration_type
@@ -151,6 +188,22 @@ def re_filter_declaration(search: Pattern, declarations: Iterator[Declaration],
             yield declaration
 
 
+def set_filter_declaration(names: FrozenSet[str], declarations: Iterator[Declaration], ) -> Iterator[Declaration]:
+    """
+    This generator will filter declarations by exact names of declarations
+    using a hash set of names
+    :param names: names of declarations to search for
+    :type names: FrozenSet[str]
+    :param declarations: An iterable of declarations
+    :type declarations: Iterator[Declaration]
+    :return: generator of filtered declarations
+    :rtype: Iterator[Declaration]
+    """
+    for declaration in declarations:
+        if declaration.name in names:
+            yield declaration
+
+
 class FileLine:
     """
     A line of a file
@@ -162,6 +215,7 @@ class FileLine:
     :param line: a content of this line
     :type line: str
     """
+    __slots__ = ('file_path', 'line_number', 'line')
 
     def __init__(self, file_path: str, line_number: int, line: str):
         self.file_path: str = file_path
@@ -172,26 +226,336 @@ class FileLine:
         return '%i: %s: %s' % (self.line_number, self.file_path, self.line.rstrip())
 
 
-def get_declarations(lines: Iterator[FileLine]) -> Iterator[Declaration]:
+#: a repetition quantifier of a regex, e.g. {2}, {0,1} or {2,}
+REGEX_QUANTIFIER: Pattern = re.compile(r'\{\d*(?:,\d*)?\}')
+
+#: escapes of regex character classes and anchors, they match no literal character
+REGEX_CLASS_ESCAPES: str = 'dDwWsSbBAZ'
+
+
+def get_regex_literal(pattern: str, flags: int = 0) -> str:
+    """
+    Returns the longest literal substring which any string matched by a regex pattern contains,
+    or an empty string if such literal can not be extracted.
+    The extraction is conservative: patterns with alternatives or verbose patterns give an empty string,
+    scanning of a pattern stops at the first group and at the first escape with an argument (e.g. \\x41, \\1)
+
+    :param pattern: a regex pattern
+    :type pattern: str
+    :param flags: flags of the regex pattern
+    :type flags: int
+    :return: a literal or an empty string
+    :rtype: str
+    """
+    if flags & re.VERBOSE or re.search(r'(?<!\\)(?:\\\\)*\|', pattern):
+        return ''
+    literals: List[str] = []
+    literal: str = ''
+    i: int = 0
+    while i < len(pattern):
+        char: str = pattern[i]
+        next_char: str = pattern[i + 1] if i + 1 < len(pattern) else ''
+        if char == '\\':
+            if next_char and next_char in REGEX_CLASS_ESCAPES:
+                char = ''  # a character class (\w, \d ...) or an anchor
+            elif not next_char or next_char.isalnum():
+                break  # a code of a character (\x41, \u0041, \N{...}, \012) or a back reference (\1)
+            else:
+                char = next_char
+            i += 1
+            next_char = pattern[i + 1] if i + 1 < len(pattern) else ''
+        elif char in '([':
+            break
+        elif char == '{':
+            quantifier: Optional[Match] = REGEX_QUANTIFIER.match(pattern, i)
+            if quantifier:
+                i = quantifier.end() - 1  # the quantifier made the previous character optional
+            char = ''
+        elif char in '.^$*+?':
+            char = ''
+        if not char:
+            literals.append(literal)
+            literal = ''
+        elif next_char and next_char in '*?{':
+            literals.append(literal)  # the character is optional
+            literal = ''
+        elif next_char == '+':
+            literals.append(literal + char)  # the character is repeated
+            literal = ''
+        else:
+            literal += char
+        i += 1
+    literals.append(literal)
+    return max(literals, key=len)
+
+
+class NameFilter:
+    """
+    A predicate which checks a name of a declaration against a search string or a regex pattern.
+    Instances can be pickled, so they can be passed to worker processes
+
+    :param search: a string or a regex pattern to search for
+    :type search: str
+    :param regex: *search* is a regex pattern
+    :type regex: bool
+    :param ignore_case: case insensitive search
+    :type ignore_case: bool
+    """
+
+    def __init__(self, search: str, regex: bool = False, ignore_case: bool = False):
+        self.search: str = search.lower() if ignore_case and not regex else search
+        self.regex: bool = regex
+        self.pattern: Optional[Pattern] = re.compile(search, re.IGNORECASE if ignore_case else 0) if regex else None
+        #: the pattern can enable case insensitive search using inline flags
+        self.ignore_case: bool = ignore_case or bool(self.pattern and self.pattern.flags & re.IGNORECASE)
+        literal: str = get_regex_literal(self.pattern.pattern, self.pattern.flags) if self.pattern else search
+        if self.ignore_case:
+            literal = literal.lower()
+        #: bytes which any file containing an accepted name contains, None if it is unknown.
+        #: Only ASCII literals are used, because they are the same in all ASCII compatible encodings
+        self.needle: Optional[bytes] = None
+        try:
+            self.needle = literal.encode('ascii') or None
+        except UnicodeEncodeError:
+            pass
+
+    def __call__(self, name: str) -> bool:
+        if self.pattern:
+            return bool(self.pattern.search(name))
+        if self.ignore_case:
+            return self.search in name.lower()
+        return self.search in name
+
+
+class NameSet:
+    """
+    A predicate which accepts names of declarations equal to one of many names (e.g. in the batch mode).
+    Names are looked up in a hash set, so the cost of a check does not depend on a count of names.
+    Instances can be pickled, so they can be passed to worker processes
+
+    :param names: names to search for
+    :type names: Iterable[str]
+    """
+
+    def __init__(self, names: Iterable[str]):
+        self.names: FrozenSet[str] = frozenset(names)
+
+    def __call__(self, name: str) -> bool:
+        return name in self.names
+
+
+def read_names(stream: TextIO) -> List[str]:
+    """
+    Reads names to search for in the batch mode: one name per line,
+    empty lines and comments (#) are skipped, repeated names are read once
+
+    :param stream: a stream of names (e.g. a file or stdin)
+    :type stream: TextIO
+    :return: a list of names in order of the stream
+    :rtype: List[str]
+    """
+    names: List[str] = []
+    seen: Set[str] = set()
+    for line in stream:
+        name: str = line.split('#', 1)[0].strip()
+        if name and name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def group_declarations(
+        names: List[str],
+        declarations: Iterator[Declaration],
+        limit: Optional[int] = None,
+) -> Iterator[Tuple[str, List[Declaration]]]:
+    """
+    This generator groups declarations by names in the batch mode,
+    declarations are consumed in a single pass, groups are yielded in order of *names*
+
+    :param names: names to search for
+    :type names: List[str]
+    :param declarations: An iterable of declarations with names from *names*
+    :type declarations: Iterator[Declaration]
+    :param limit: an optional maximal count of declarations of a name
+    :type limit: Optional[int]
+    :return: a generator of names and lists of their declarations, a list is empty if a name was not found
+    :rtype: Iterator[Tuple[str, List[Declaration]]]
+    """
+    groups: Dict[str, List[Declaration]] = {name: [] for name in names}
+    for declaration in declarations:
+        group: Optional[List[Declaration]] = groups.get(declaration.name)
+        if group is not None and (limit is None or len(group) < limit):
+            group.append(declaration)
+    for name in names:
+        yield name, groups[name]
+
+
+def file_contains(file_path: str, needle: bytes, ignore_case: bool = False) -> bool:
+    """
+    Checks that raw bytes of a file contain *needle*,
+    case sensitive search is performed on a memory mapped file without copying of its content.
+    Only names of symbols are checked in an extension module (see *elf.symbols_contain*)
+
+    :param file_path: A path to a file
+    :type file_path: str
+    :param needle: bytes to search for, must be in lower case if *ignore_case* is True
+    :type needle: bytes
+    :param ignore_case: case insensitive search of ASCII letters
+    :type ignore_case: bool
+    :return: True if the file contains *needle*
+    :rtype: bool
+    """
+    if is_extension(file_path):
+        from .elf import symbols_contain
+        return symbols_contain(file_path, needle, ignore_case)
+    with open(file_path, 'rb') as f:
+        if ignore_case:
+            return needle in f.read().lower()
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return data.find(needle) >= 0
+        except ValueError:
+            return False  # an empty file can not be mapped
+
+
+def filter_files(file_paths: Iterator[str], accept: Optional[Callable[[str], bool]]) -> Iterator[str]:
+    """
+    This generator skips files which can not contain a declaration accepted by *accept*,
+    files are checked by raw bytes before they are decoded
+
+    :param file_paths: An iterable of file paths
+    :type file_paths: Iterator[str]
+    :param accept: an optional predicate for names of declarations,
+        files are filtered only if it is a NameFilter with a known *needle*
+    :type accept: Optional[Callable[[str], bool]]
+    :return: a generator of file paths
+    :rtype: Iterator[str]
+    """
+    needle: Optional[bytes] = getattr(accept, 'needle', None)
+    if not needle:
+        yield from file_paths
+        return
+    ignore_case: bool = accept.ignore_case
+    for file_path in file_paths:
+        if not file_path.lower().endswith('.py') and not is_extension(file_path):
+            yield file_path  # bytes of a compressed archive can not be checked
+            continue
+        try:
+            if not file_contains(file_path, needle, ignore_case):
+                continue
+        except OSError:
+            pass  # the error will be handled by reading of the file
+        yield file_path
+
+
+#: a numbered back reference (\1) or a numbered group of a conditional pattern ((?(1)...)) of a regex,
+#: numbers of groups are shifted when patterns are combined
+REGEX_NUMBERED_REFERENCE: Pattern = re.compile(r'(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?\(\d)')
+
+
+class DeclarationMatcher:
+    """
+    Matches a line against all declaration types in a single pass.
+
+    Patterns of declaration types are combined to one compiled regex pattern,
+    each alternative contains the renamed *name* group of its declaration type.
+    Patterns are combined only if all of them are anchored to the beginning of a line, use the same flags
+    and do not refer to groups by numbers, otherwise declaration types are searched one by one as before.
+
+    :param types: declaration types to match, the first matched type wins
+    :type types: List[DeclarationType]
+    """
+
+    def __init__(self, types: List[DeclarationType]):
+        self.types: List[DeclarationType] = list(types)
+        self.pattern: Optional[Pattern] = None
+        #: a name of an alternative group: (a declaration type, a name of its renamed *name* group)
+        self.groups: Dict[str, Tuple[DeclarationType, str]] = {}
+        flags: Set[int] = {declaration_type.pattern.flags for declaration_type in self.types}
+        if len(flags) != 1 or not all(
+                declaration_type.pattern.pattern.startswith('^')
+                and not REGEX_NUMBERED_REFERENCE.search(declaration_type.pattern.pattern)
+                for declaration_type in self.types
+        ):
+            return
+        alternatives: List[str] = []
+        for type_index, declaration_type in enumerate(self.types):
+            prefix: str = 't%i_' % type_index
+            # renames groups of the pattern to avoid collisions with groups of other patterns
+            pattern: str = re.sub(
+                r'\(\?P([<=])([A-Za-z_][A-Za-z0-9_]*)', r'(?P\1%s\2' % prefix, declaration_type.pattern.pattern
+            )
+            alternatives.append('(?P<%s>%s)' % (prefix, pattern))
+            self.groups[prefix] = (declaration_type, prefix + 'name')
+        self.pattern = re.compile('|'.join(alternatives), flags.pop())
+
+    def match(self, line: str) -> Optional[Tuple[DeclarationType, str]]:
+        """
+        Matches a line, returns a declaration type and a name of a declaration or None
+
+        :param line: a line to match
+        :type line: str
+        :return: a declaration type and a name of a declaration or None if nothing was matched
+        :rtype: Optional[Tuple[DeclarationType, str]]
+        """
+        if self.pattern is None:
+            for declaration_type in self.types:
+                declaration_name: str = declaration_type.search(line=line)
+                if declaration_name:
+                    return declaration_type, declaration_name
+            return None
+        match: Match = self.pattern.match(line)
+        if not match:
+            return None
+        declaration_type, name_group = self.groups[match.lastgroup]
+        return declaration_type, match.group(name_group)
+
+
+_matcher: Optional[DeclarationMatcher] = None
+
+
+def get_declaration_matcher() -> DeclarationMatcher:
+    """
+    Returns a matcher of declaration types registered in *declaration_types*,
+    the matcher is rebuilt if *declaration_types* was changed
+
+    :return: a matcher of declaration types
+    :rtype: DeclarationMatcher
+    """
+    global _matcher
+    if _matcher is None or len(_matcher.types) != len(declaration_types) or any(
+            a is not b for a, b in zip(_matcher.types, declaration_types)
+    ):
+        _matcher = DeclarationMatcher(declaration_types)
+    return _matcher
+
+
+def get_declarations(
+        lines: Iterator[FileLine],
+        accept: Optional[Callable[[str], bool]] = None,
+) -> Iterator[Declaration]:
     """
     This generator creates instances of declaration
     from lines of code which contains declaration of variables or functions or classes
 
     :param lines: an iterable of lines of code
     :type lines: Iterator[FileLine]
+    :param accept: an optional predicate for names of declarations (e.g. NameFilter),
+        declarations with not accepted names are skipped before they are created
+    :type accept: Optional[Callable[[str], bool]]
     :return: a generator of instances of declaration
     :rtype: Iterator[Declaration]
     """
+    match: Callable[[str], Optional[Tuple[DeclarationType, str]]] = get_declaration_matcher().match
     for line in lines:
-        for declaration_type in declaration_types:
-            declaration_name: str = declaration_type.search(line=line.line)
-            if declaration_name:
-                yield Declaration(
-                    declaration_type=declaration_type,
-                    name=declaration_name,
-                    module_path=line.file_path,
-                )
-                break
+        matched: Optional[Tuple[DeclarationType, str]] = match(line.line)
+        if matched and (accept is None or accept(matched[1])):
+            yield Declaration(
+                declaration_type=matched[0],
+                name=sys.intern(matched[1]),
+                module_path=line.file_path,
+            )
 
 
 def get_file_lines(file_path: str, encoding: str) -> Iterator[FileLine]:
@@ -216,65 +580,344 @@ def get_file_lines(file_path: str, encoding: str) -> Iterator[FileLine]:
             line_number += 1
 
 
-def get_files_lines(file_paths: Iterator[str]) -> Iterator[FileLine]:
+#: a pattern of the PEP 263 coding cookie, it is searched in the first two lines of a file
+CODING_COOKIE_PATTERN: Pattern = re.compile(br'^[ \t\f]*#.*?coding[:=][ \t]*([-\w.]+)')
+
+#: a count of bytes of a file used by chardet to detect an encoding
+CHARDET_SAMPLE_SIZE: int = 64 * 1024
+
+#: a callback which receives a path to a file, an encoding and a strategy used to decode the file
+DecodeCallback = Callable[[str, str, str], None]
+
+
+def get_coding_cookie(raw: bytes) -> str:
+    """
+    Returns an encoding declared by the PEP 263 coding cookie in the first two lines of a file,
+    or an empty string if the cookie was not found
+
+    :param raw: raw bytes of a file
+    :type raw: bytes
+    :return: a declared encoding or an empty string
+    :rtype: str
+    """
+    for line in raw.split(b'\n', 2)[:2]:
+        match: Match = CODING_COOKIE_PATTERN.match(line)
+        if match:
+            return match.group(1).decode('ascii')
+        if not line.lstrip().startswith(b'#') and line.strip():
+            break  # the cookie can be only in a comment preceded by comments or blank lines
+    return ''
+
+
+def decode_source(raw: bytes) -> Tuple[str, str, str]:
+    """
+    Decodes raw bytes of a python file.
+    The encoding is resolved by the BOM, by the PEP 263 coding cookie, then utf-8 is tried,
+    then chardet detects an encoding by a bounded sample of the file, latin-1 is the last resort
+
+    :param raw: raw bytes of a file
+    :type raw: bytes
+    :return: a decoded text, an encoding and a strategy used to resolve the encoding
+        (bom, cookie, utf-8, chardet or fallback)
+    :rtype: Tuple[str, str, str]
+    """
+    if raw.startswith(codecs.BOM_UTF8):
+        return raw[len(codecs.BOM_UTF8):].decode('utf-8', errors='replace'), 'utf-8-sig', 'bom'
+    encoding: str = get_coding_cookie(raw)
+    if encoding:
+        try:
+            return raw.decode(encoding), encoding, 'cookie'
+        except (LookupError, UnicodeDecodeError):
+            pass  # an unknown encoding or the cookie lies
+    try:
+        return raw.decode('utf-8'), 'utf-8', 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    import chardet  # chardet is slow to import, it is used only for a few files
+    encoding = chardet.detect(raw[:CHARDET_SAMPLE_SIZE])['encoding'] or ''
+    if encoding:
+        try:
+            return raw.decode(encoding), encoding, 'chardet'
+        except (LookupError, UnicodeDecodeError):
+            pass  # the sample was not enough to detect the encoding
+    return raw.decode('ISO-8859-1'), 'ISO-8859-1', 'fallback'
+
+
+def get_source_lines(file_path: str, raw: bytes, on_decode: Optional[DecodeCallback] = None) -> Iterator[FileLine]:
+    """
+    This generator decodes raw bytes of a python file and creates instances of its lines
+
+    :param file_path: A path to a file reported in lines
+    :type file_path: str
+    :param raw: raw bytes of the file
+    :type raw: bytes
+    :param on_decode: an optional callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file
+    :type on_decode: Optional[DecodeCallback]
+    :return: a generator of instances of lines of the file
+    :rtype: Iterator[FileLine]
+    """
+    text, encoding, strategy = decode_source(raw)
+    if on_decode:
+        on_decode(file_path, encoding, strategy)
+    line_number: int = 0
+    for line in io.StringIO(text, newline=None):
+        yield FileLine(
+            file_path=file_path,
+            line_number=line_number,
+            line=line,
+        )
+        line_number += 1
+
+
+#: suffixes of compiled extension modules of the running interpreter
+EXTENSION_SUFFIXES: Tuple[str, ...] = tuple(importlib.machinery.EXTENSION_SUFFIXES)
+
+
+def is_extension(file_path: str) -> bool:
+    """
+    Checks that a path is a compiled extension module by its suffix (e.g. .cpython-38-x86_64-linux-gnu.so)
+
+    :param file_path: A path to check
+    :type file_path: str
+    :return: True if the path has a suffix of extension modules of the running interpreter
+    :rtype: bool
+    """
+    return file_path.lower().endswith(EXTENSION_SUFFIXES)
+
+
+def is_archive(file_path: str) -> bool:
+    """
+    Checks that a path is a zip archive (e.g. .zip, .egg, .pyz), python files can be imported from it
+
+    :param file_path: A path to check
+    :type file_path: str
+    :return: True if the path is a zip archive
+    :rtype: bool
+    """
+    if not os.path.isfile(file_path):
+        return False
+    import zipfile  # zipfile is slow to import, archives in search paths are rare
+    return zipfile.is_zipfile(file_path)
+
+
+def get_archive_lines(archive_path: str, on_decode: Optional[DecodeCallback] = None) -> Iterator[FileLine]:
+    """
+    This generator creates instances of lines of python files stored in a zip archive without extracting it.
+    Members are read one at a time, a path of a member is reported as *archive.zip/inner/path.py*
+
+    :param archive_path: A path to a zip archive
+    :type archive_path: str
+    :param on_decode: an optional callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file
+    :type on_decode: Optional[DecodeCallback]
+    :return: a generator of instances of lines of python files
+    :rtype: Iterator[FileLine]
+    """
+    import zipfile
+    is_pruned: Callable[[str], bool] = _get_pruned_matcher(pruned_folders)
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                parts: List[str] = info.filename.split('/')
+                if info.is_dir() or not parts[-1].lower().endswith('.py') or any(map(is_pruned, parts)):
+                    continue
+                try:
+                    raw: bytes = archive.read(info)
+                except (OSError, zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+                    print(f"'{archive_path}/{info.filename}' can not be read: {e}", file=sys.stderr)
+                    continue  # skip this member (e.g. encrypted or compressed by an unsupported method)
+                yield from get_source_lines(os.path.join(archive_path, *parts), raw, on_decode=on_decode)
+    except (OSError, zipfile.BadZipFile) as e:
+        print(f"'{archive_path}' can not be read: {e}", file=sys.stderr)
+
+
+def get_files_lines(file_paths: Iterator[str], on_decode: Optional[DecodeCallback] = None) -> Iterator[FileLine]:
     """
     This generator creates instances of a line of file
-    from paths to files
+    from paths to files.
+    Each file is read once as bytes and decoded as a whole, see *decode_source*.
+    A path which is not a python file, but a zip archive, produces lines of python files stored in it
 
     :param file_paths: An iterable of file paths
     :type file_paths: Iterator[str]
+    :param on_decode: an optional callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file
+    :type on_decode: Optional[DecodeCallback]
     :return: a generator of instances of lines of files
     :rtype: Iterator[FileLine]
     """
     for file_path in file_paths:
-        line_number: int = 0
+        if not file_path.lower().endswith('.py') and is_archive(file_path):
+            yield from get_archive_lines(file_path, on_decode=on_decode)
+            continue
         try:
-            yield from get_file_lines(file_path, 'utf-8')
-            continue  # goto a next file
-        except UnicodeDecodeError as e:
-            pass
+            with open(file_path, 'rb') as raw_file:
+                raw: bytes = raw_file.read()
+        except OSError as e:
+            print(f"'{file_path}' can not be read: {e}", file=sys.stderr)
+            continue  # skip this file
+        yield from get_source_lines(file_path, raw, on_decode=on_decode)
+
+
+def get_file_declarations(
+        file_path: str,
+        accept: Optional[Callable[[str], bool]] = None,
+        on_decode: Optional[DecodeCallback] = None,
+        bytecode: bool = True,
+) -> List[Declaration]:
+    """
+    Returns declarations of a python file (or of python files stored in a zip archive).
+    If *bytecode* is True and the file has an up to date pyc file, declarations are read from the bytecode
+    (see *bytecode.get_bytecode_declarations*), otherwise the source is decoded and its lines are matched.
+    Declarations of a compiled extension module are read from its symbols, see *elf.get_extension_declarations*
+
+    :param file_path: A path to a python file, a zip archive or an extension module
+    :type file_path: str
+    :param accept: an optional predicate for names of declarations (e.g. NameFilter)
+    :type accept: Optional[Callable[[str], bool]]
+    :param on_decode: an optional callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file ('bytecode' if the pyc file was used)
+    :type on_decode: Optional[DecodeCallback]
+    :param bytecode: read declarations from an up to date pyc file instead of the source
+    :type bytecode: bool
+    :return: a list of declarations
+    :rtype: List[Declaration]
+    """
+    if is_extension(file_path):
+        from .elf import get_extension_declarations
+        return get_extension_declarations(file_path, accept=accept)
+    if bytecode and file_path.lower().endswith('.py'):
+        from .bytecode import get_bytecode_declarations
+        declarations: Optional[List[Declaration]] = get_bytecode_declarations(
+            file_path, accept=accept, on_decode=on_decode,
+        )
+        if declarations is not None:
+            return declarations
+    return list(get_declarations(get_files_lines([file_path], on_decode=on_decode), accept=accept))
+
+
+def print_decoding(file_path: str, encoding: str, strategy: str) -> None:
+    """
+    Prints a strategy and an encoding used to decode a file to stderr,
+    this function can be used as the *on_decode* callback of *get_files_lines*
+    """
+    print('%s: %s: %s' % (strategy, encoding, file_path), file=sys.stderr)
+
+
+#: names or glob patterns of folders and files which are never searched for python files
+pruned_folders: List[str] = ['__pycache__', '.git', 'node_modules']
+
+
+def _get_pruned_matcher(patterns: List[str]) -> Callable[[str], bool]:
+    """
+    Returns a predicate which checks a name of a folder or a file against *patterns*,
+    plain names are checked using a set, glob patterns are combined to one regex pattern
+    """
+    names: Set[str] = {pattern.lower() for pattern in patterns if not any(char in pattern for char in '*?[')}
+    globs: List[str] = [fnmatch.translate(pattern) for pattern in patterns if pattern.lower() not in names]
+    pattern: Optional[Pattern] = re.compile('|'.join(globs), re.IGNORECASE) if globs else None
+    if pattern is None:
+        return lambda name: name.lower() in names
+    return lambda name: name.lower() in names or bool(pattern.match(name))
+
+
+def _scandir(path: str) -> List[os.DirEntry]:
+    try:
+        with os.scandir(path) as entries:
+            return list(entries)
+    except OSError:
+        return []  # the folder was removed or it is not readable
+
+
+def walk_python_files(
+        search_paths: Iterator[str],
+        pruned: Optional[List[str]] = None,
+        extensions: bool = False,
+        scandir: Callable[[str], List[os.DirEntry]] = _scandir,
+        skip: Optional[Callable[[str], None]] = None,
+) -> Iterator[Tuple[str, str]]:
+    """
+    This generator yields search paths and paths of python files found in them.
+
+    Folders are read using *os.scandir*, types of entries are taken from *os.DirEntry*,
+    so only folders are stat'ed. Each folder is visited once by its (device, inode),
+    that protects from symlink loops. A search path nested in another search path
+    (e.g. site-packages in lib/python3) is searched only as itself,
+    so each python file belongs to the most specific search path.
+    A search path which is a zip archive is yielded as is.
+
+    :param search_paths: An iterable of search paths
+    :type search_paths: Iterator[str]
+    :param pruned: names or glob patterns of folders and files to skip, *pruned_folders* by default
+    :type pruned: Optional[List[str]]
+    :param extensions: yield compiled extension modules too
+    :type extensions: bool
+    :param scandir: a function which lists entries of a folder, it returns an empty list if the folder
+        can not be read (e.g. *prefetch.FolderPrefetcher* lists folders in advance)
+    :type scandir: Callable[[str], List[os.DirEntry]]
+    :param skip: an optional callback, which receives a path to a folder which is not walked because it was
+        visited before, e.g. *prefetch.FolderPrefetcher.discard* releases the listing requested in advance
+    :type skip: Optional[Callable[[str], None]]
+    :return: a generator of search paths and paths of python files
+    :rtype: Iterator[Tuple[str, str]]
+    """
+    is_pruned: Callable[[str], bool] = _get_pruned_matcher(pruned_folders if pruned is None else pruned)
+    roots: Dict[Tuple[int, int], str] = {}
+    for search_path in search_paths:
         try:
-            yield from get_file_lines(file_path, 'ascii')
+            stat: os.stat_result = os.stat(search_path)
+        except OSError:
             continue
-        except UnicodeDecodeError as e:
-            pass
-        # try to detect an encoding of the file
-        with open(file_path, 'rb') as raw_file:
-            encoding: str = chardet.detect(raw_file.read())['encoding']
-            if encoding and encoding!='utf-8' and encoding!='ascii':
-                try:
-                    yield from get_file_lines(file_path, encoding)
-                    continue
-                except UnicodeDecodeError as e:
-                    pass
-            if encoding.startswith('ISO-8859') and encoding!='ISO-8859-1':
-                try:
-                    yield from get_file_lines(file_path, 'ISO-8859-1')
-                except UnicodeDecodeError as e:
-                    print(f"'{file_path}', {encoding} raised encoding exception")
-                    # skip this file
+        roots.setdefault((stat.st_dev, stat.st_ino), search_path)  # skips duplicated search paths
+    visited: Set[Tuple[int, int]] = set(roots)
+    for root in roots.values():
+        if os.path.isfile(root):
+            yield root, root  # a zip archive, python files are read from it by *get_files_lines*
+            continue
+        stack: List[Iterator[os.DirEntry]] = [iter(scandir(root))]
+        while stack:
+            entry: Optional[os.DirEntry] = next(stack[-1], None)
+            if entry is None:
+                stack.pop()
+                continue
+            if is_pruned(entry.name):
+                continue
+            try:
+                if (entry.name.lower().endswith('.py') or extensions and is_extension(entry.name)) and entry.is_file():
+                    yield root, entry.path
+                elif entry.is_dir():
+                    stat = entry.stat()
+                    key: Tuple[int, int] = (stat.st_dev, stat.st_ino)
+                    if key in visited:
+                        if skip:
+                            skip(entry.path)
+                        continue  # a symlink loop, an already searched folder or another search path
+                    visited.add(key)
+                    stack.append(iter(scandir(entry.path)))
+            except OSError:
+                continue  # a broken symlink or the entry was removed
 
 
-def get_python_files(search_paths: Iterator[str]) -> Iterator[str]:
+def get_python_files(
+        search_paths: Iterator[str],
+        pruned: Optional[List[str]] = None,
+        extensions: bool = False,
+) -> Iterator[str]:
     """
-    This generator yields paths of python files from search paths
+    This generator yields paths of python files from search paths, see *walk_python_files*
 
     :param search_paths: An iterable of search paths
     :type search_paths: Iterator[str]
+    :param pruned: names or glob patterns of folders and files to skip, *pruned_folders* by default
+    :type pruned: Optional[List[str]]
+    :param extensions: yield compiled extension modules too
+    :type extensions: bool
     :return: a generator of paths of python files
     :rtype: Iterator[str]
     """
-    for search_path in search_paths:
-        for item in os.listdir(search_path):
-            if item.lower() == '__pychache__':
-                continue
-            item_path: str = os.path.join(search_path, item)
-            if os.path.isfile(item_path):
-                if item.lower().endswith('.py'):
-                    yield item_path
-            elif os.path.isdir(item_path):
-                for sub_item_path in get_python_files([item_path]):
-                    yield sub_item_path
+    for _, file_path in walk_python_files(search_paths, pruned=pruned, extensions=extensions):
+        yield file_path
 
 
 def get_paths(paths: Iterator[str]) -> Iterator[str]:
@@ -292,6 +935,21 @@ def get_paths(paths: Iterator[str]) -> Iterator[str]:
             yield path
 
 
+def get_search_paths(paths: Iterator[str]) -> Iterator[str]:
+    """
+    This generator filters an iterable of paths in their order,
+    remaining python libraries folders paths and zip archives (e.g. eggs, .pyz applications)
+
+    :param paths: An iterable of paths
+    :type paths: Iterator[str]
+    :return: a generator of paths of python libraries folders and zip archives
+    :rtype: Iterator[str]
+    """
+    for path in paths:
+        if os.path.isdir(path) or is_archive(path):
+            yield path
+
+
 def filter_delaration_type(
         declarations: Iterator[Declaration],
         remained_types: List[DeclarationType],
@@ -311,18 +969,638 @@ def filter_delaration_type(
             yield declaration
 
 
-def main():
-    parser: argparse.ArgumentParser = argparse.ArgumentParser()
-    parser.add_argument('-r', help='enables search using a regex pattern', action='store_true')
-    parser.add_argument('-i', help='ignore case', action='store_true')
-    parser.add_argument('search', help='a regex pattern (if using -r) or string to search for')
-    parser.add_argument('-v', help='show only variables, this option can be combined with the -c or -d options',
-                        action='store_true')
-    parser.add_argument('-c', help='show only classes, this option can be combined with the -v or -d options',
-                        action='store_true')
-    parser.add_argument('-d', help='show only functions, this option can be combined with the -v or -c options',
-                        action='store_true')
-    args: argparse.Namespace = parser.parse_args()
+def get_search_path(module_path: str, search_paths: List[str]) -> str:
+    """
+    Returns the most specific search path which contains a module
+
+    :param module_path: a path to a module
+    :type module_path: str
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :return: a search path or an empty string if the module is not in search paths
+    :rtype: str
+    """
+    found: str = ''
+    for search_path in search_paths:
+        if len(search_path) > len(found) and module_path.startswith(search_path) \
+                and module_path[len(search_path):len(search_path) + 1] in ('/', os.sep):
+            found = search_path
+    return found
+
+
+def get_import_depth(module_path: str, search_path: str) -> int:
+    """
+    Returns a count of parts of a dotted name used to import a module from a search path,
+    e.g. 1 for *mod.py* and *pkg/__init__.py*, 2 for *pkg/mod.py*
+
+    :param module_path: a path to a module
+    :type module_path: str
+    :param search_path: a search path which contains the module
+    :type search_path: str
+    :return: a depth of the module
+    :rtype: int
+    """
+    parts: List[str] = module_path[len(search_path) + 1:].replace(os.sep, '/').split('/')
+    return len(parts) - 1 if parts[-1] == '__init__.py' and len(parts) > 1 else len(parts)
+
+
+def sort_import_order(declarations: Iterator[Declaration], search_paths: List[str]) -> Iterator[Declaration]:
+    """
+    This generator sorts declarations in the order python imports them:
+    by the position of a search path in *search_paths*, then by the depth of a module.
+    Declarations are expected grouped by search paths in their order (as scans and the index yield them),
+    so only declarations of one search path are held at once and the following search paths are not
+    scanned until declarations of the current one are consumed
+
+    :param declarations: an iterable of declarations grouped by search paths
+    :type declarations: Iterator[Declaration]
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :return: a generator of sorted declarations
+    :rtype: Iterator[Declaration]
+    """
+    group: List[Tuple[int, Declaration]] = []
+    group_path: str = ''
+    module_path: Optional[str] = None
+    search_path: str = ''
+    depth: int = 0
+    for declaration in declarations:
+        if declaration.module_path != module_path:
+            module_path = declaration.module_path
+            search_path = get_search_path(module_path, search_paths)
+            depth = get_import_depth(module_path, search_path)
+        if search_path != group_path:
+            group.sort(key=lambda item: item[0])  # the sort is stable, so the order of files is kept
+            yield from (item[1] for item in group)
+            group = []
+            group_path = search_path
+        group.append((depth, declaration))
+    group.sort(key=lambda item: item[0])
+    yield from (item[1] for item in group)
+
+
+def write_lines(lines: Iterator[str], stream: Optional[TextIO] = None) -> int:
+    """
+    Writes lines to a stream (stdout by default) through its buffer,
+    a stream which is not a terminal is block buffered, so results are not flushed one by one.
+    Writing stops silently when the stream is a closed pipe (e.g. *whatprovides ... | head*)
+
+    :param lines: an iterable of lines without line endings
+    :type lines: Iterator[str]
+    :param stream: a stream to write to, stdout by default
+    :type stream: Optional[TextIO]
+    :return: a count of written lines
+    :rtype: int
+    """
+    stream = stream or sys.stdout
+    write: Callable[[str], int] = stream.write
+    written: int = 0
+    try:
+        for line in lines:
+            write(line)
+            write('\n')
+            written += 1
+        stream.flush()
+    except BrokenPipeError:
+        if stream is sys.stdout:
+            # stdout is redirected to devnull, so the interpreter does not fail to flush it at exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return written
+
+
+def scan_declarations(
+        search_paths: List[str],
+        jobs: int = 1,
+        accept: Optional[Callable[[str], bool]] = None,
+        on_decode: Optional[DecodeCallback] = None,
+        stats: Optional['Stats'] = None,
+        bytecode: bool = True,
+        io_threads: int = 1,
+        extensions: bool = True,
+) -> Iterator[Declaration]:
+    """
+    This generator scans python files and compiled extension modules in search paths
+    and yields found declarations
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param jobs: A count of worker processes, zero means a count of CPU cores, 1 means scan in the current process
+    :type jobs: int
+    :param accept: an optional picklable predicate for names of declarations (e.g. NameFilter)
+    :type accept: Optional[Callable[[str], bool]]
+    :param on_decode: an optional picklable callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param stats: optional statistics to measure stages of the scan,
+        only the whole scan is measured in worker processes or threads if *jobs* or *io_threads* is not 1
+    :type stats: Optional[Stats]
+    :param bytecode: read declarations from up to date pyc files instead of sources
+    :type bytecode: bool
+    :param io_threads: A count of threads which list folders and read files in the current process
+        if *jobs* is 1, see *prefetch.get_declarations_threaded*
+    :type io_threads: int
+    :param extensions: scan compiled extension modules too
+    :type extensions: bool
+    :return: a generator of declarations
+    :rtype: Iterator[Declaration]
+    """
+    if jobs == 1 and io_threads > 1:
+        from .prefetch import get_declarations_threaded
+        declarations: Iterator[Declaration] = get_declarations_threaded(
+            search_paths, io_threads, accept=accept, on_decode=on_decode, bytecode=bytecode, extensions=extensions,
+        )
+        yield from declarations if stats is None else stats.instrument('scan', declarations)
+        return
+    if stats is None:
+        if jobs == 1:
+            for file_path in filter_files(get_python_files(search_paths, extensions=extensions), accept):
+                yield from get_file_declarations(file_path, accept=accept, on_decode=on_decode, bytecode=bytecode)
+            return
+        from .parallel import get_declarations_parallel
+        yield from get_declarations_parallel(
+            get_python_files(search_paths, extensions=extensions), jobs=jobs, accept=accept, on_decode=on_decode,
+            bytecode=bytecode,
+        )
+        return
+    file_paths: Iterator[str] = stats.instrument('walk', get_python_files(search_paths, extensions=extensions))
+    if jobs == 1:
+        for file_path in stats.instrument('prefilter', filter_files(file_paths, accept)):
+            started: float = time.perf_counter()
+            if is_extension(file_path):
+                from .elf import get_extension_declarations
+                symbols: List[Declaration] = get_extension_declarations(file_path, accept=accept)
+                elapsed: float = time.perf_counter() - started
+                stats.add_time('elf', elapsed, len(symbols))
+                stats.add_file(file_path, 0, elapsed)
+                yield from symbols
+                continue
+            if bytecode and file_path.lower().endswith('.py'):
+                from .bytecode import get_bytecode_declarations
+                found: Optional[List[Declaration]] = get_bytecode_declarations(
+                    file_path, accept=accept, on_decode=on_decode,
+                )
+                if found is not None:
+                    elapsed = time.perf_counter() - started
+                    stats.add_time('bytecode', elapsed, len(found))
+                    stats.add_file(file_path, 0, elapsed)
+                    yield from found
+                    continue
+                started = time.perf_counter()
+            lines: List[FileLine] = list(get_files_lines([file_path], on_decode=on_decode))
+            decoded: float = time.perf_counter()
+            declarations = list(get_declarations(lines, accept=accept))
+            matched: float = time.perf_counter()
+            stats.add_time('decode', decoded - started, 1)
+            stats.add_time('match', matched - decoded, len(declarations))
+            stats.add_file(file_path, len(lines), matched - started)
+            yield from declarations
+        return
+    from .parallel import get_declarations_parallel
+    yield from stats.instrument(
+        'scan',
+        get_declarations_parallel(file_paths, jobs=jobs, accept=accept, on_decode=on_decode, bytecode=bytecode),
+    )
+
+
+#: the name of an environment variable which overrides the path to the index file
+CACHE_PATH_ENV: str = 'WHATPROVIDES_CACHE'
+
+
+def get_cache_path() -> str:
+    """
+    Returns a path to the index file in the user cache directory.
+    The path can be overridden using the *WHATPROVIDES_CACHE* environment variable
+
+    :return: a path to the index file
+    :rtype: str
+    """
+    cache_path: str = os.environ.get(CACHE_PATH_ENV, '')
+    if cache_path:
+        return cache_path
+    if sys.platform.startswith('win'):
+        cache_dir: str = os.environ.get('LOCALAPPDATA', '') or os.path.expanduser('~')
+    else:
+        cache_dir: str = os.environ.get('XDG_CACHE_HOME', '') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'whatprovides', 'index.sqlite3')
+
+
+def get_indexed_declarations(
+        search_paths: List[str],
+        rebuild: bool = False,
+        jobs: int = 1,
+        on_decode: Optional[DecodeCallback] = None,
+        accept: Optional[Callable[[str], bool]] = None,
+        stats: Optional['Stats'] = None,
+        bytecode: bool = True,
+        io_threads: int = 1,
+        refresh: bool = True,
+) -> Iterator[Declaration]:
+    """
+    This generator refreshes the persistent declarations index and yields declarations from it.
+    If the index can not be used (e.g. the cache directory is read only),
+    python files are scanned directly
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param rebuild: drop the index and scan all python files again
+    :type rebuild: bool
+    :param jobs: A count of worker processes used to scan changed files, zero means a count of CPU cores
+    :type jobs: int
+    :param on_decode: an optional picklable callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param accept: an optional predicate for names of declarations (e.g. NameFilter),
+        names are looked up using the trigram index
+    :type accept: Optional[Callable[[str], bool]]
+    :param stats: optional statistics to measure the refresh of the index and the query
+    :type stats: Optional[Stats]
+    :param bytecode: read declarations of changed files from up to date pyc files instead of sources
+    :type bytecode: bool
+    :param io_threads: A count of threads which list folders, stat and read files if *jobs* is 1
+    :type io_threads: int
+    :param refresh: refresh the index, otherwise it is used as is (e.g. it is kept up to date by *watch.watch*)
+    :type refresh: bool
+    :return: a generator of declarations
+    :rtype: Iterator[Declaration]
+    """
+    import sqlite3
+    from .cache import DeclarationIndex
+    started: float = time.perf_counter()
+    try:
+        index: DeclarationIndex = DeclarationIndex(get_cache_path())
+        if rebuild:
+            index.clear()
+        scanned: int = index.refresh(
+            search_paths, jobs=jobs, on_decode=on_decode, bytecode=bytecode, io_threads=io_threads,
+        ) if refresh or rebuild else 0
+    except (OSError, sqlite3.Error) as e:
+        print(f"declarations index is not available: {e}", file=sys.stderr)
+        yield from scan_declarations(
+            search_paths, jobs=jobs, on_decode=on_decode, stats=stats, bytecode=bytecode, io_threads=io_threads,
+        )
+        return
+    declarations: Iterator[Declaration] = index.declarations(search_paths, accept=accept)
+    if stats is not None:
+        stats.add_time('refresh', time.perf_counter() - started, scanned)
+        stats.files += scanned
+        declarations = stats.instrument('query', declarations)
+    try:
+        yield from declarations
+    finally:
+        index.close()
+
+
+def open_binary_index(
+        search_paths: List[str],
+        refresh: bool = True,
+        rebuild: bool = False,
+        jobs: int = 1,
+        on_decode: Optional[DecodeCallback] = None,
+        stats: Optional['Stats'] = None,
+        bytecode: bool = True,
+        io_threads: int = 1,
+) -> 'BinaryIndex':
+    """
+    Opens the memory-mapped binary index of search paths, see *binindex.BinaryIndex*.
+    The declarations index is refreshed first and the binary index is rewritten if the declarations index
+    was changed. If *refresh* is False, an existing binary index is used as is.
+    If the binary index is fresh (see *binindex.is_fresh*) and its generation is the generation
+    of the declarations index (e.g. kept up to date by --watch), it is used without a refresh
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param refresh: refresh the declarations index before the lookup
+    :type refresh: bool
+    :param rebuild: drop the declarations index and scan all python files again
+    :type rebuild: bool
+    :param jobs: A count of worker processes used to scan changed files, zero means a count of CPU cores
+    :type jobs: int
+    :param on_decode: an optional picklable callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param stats: optional statistics to measure the refresh of the index
+    :type stats: Optional[Stats]
+    :param bytecode: read declarations of changed files from up to date pyc files instead of sources
+    :type bytecode: bool
+    :param io_threads: A count of threads which list folders, stat and read files if *jobs* is 1
+    :type io_threads: int
+    :return: the binary index
+    :rtype: BinaryIndex
+    :raises OSError: if the index can not be used (e.g. the cache directory is read only)
+    :raises ValueError: if the binary index can not be read
+    :raises sqlite3.Error: if the declarations index can not be used
+    """
+    from .binindex import BinaryIndex, get_binary_index_path, write_binary_index, is_fresh, get_index_generation
+    index_path: str = get_binary_index_path(get_cache_path(), search_paths)
+    if not rebuild and (not refresh or is_fresh(index_path, search_paths)):
+        try:
+            fresh_index: BinaryIndex = BinaryIndex(index_path)
+            if not refresh or fresh_index.generation == get_index_generation(get_cache_path()):
+                return fresh_index
+            fresh_index.close()  # the declarations index was changed by another process
+        except (OSError, ValueError):
+            pass  # the binary index was not written yet
+    from .cache import DeclarationIndex
+    started: float = time.perf_counter()
+    index: DeclarationIndex = DeclarationIndex(get_cache_path())
+    try:
+        if rebuild:
+            index.clear()
+        scanned: int = index.refresh(
+            search_paths, jobs=jobs, on_decode=on_decode, bytecode=bytecode, io_threads=io_threads,
+        )
+        generation: str = index.get_generation()
+        binary_index: Optional[BinaryIndex] = None
+        try:
+            binary_index = BinaryIndex(index_path)
+        except (OSError, ValueError):
+            pass
+        if binary_index is None or binary_index.generation != generation:
+            if binary_index is not None:
+                binary_index.close()
+            write_binary_index(index_path, index.declarations(search_paths), generation, search_paths)
+            binary_index = BinaryIndex(index_path)
+        else:
+            try:
+                os.utime(index_path)  # the binary index is up to date, it is fresh again
+            except OSError:
+                pass  # e.g. the cache directory is read only, the index is refreshed on each lookup
+    finally:
+        index.close()
+    if stats is not None:
+        stats.add_time('refresh', time.perf_counter() - started, scanned)
+        stats.files += scanned
+    return binary_index
+
+
+def get_binary_declarations(
+        search_paths: List[str],
+        name: str,
+        prefix: bool = False,
+        refresh: bool = True,
+        rebuild: bool = False,
+        jobs: int = 1,
+        on_decode: Optional[DecodeCallback] = None,
+        stats: Optional['Stats'] = None,
+        bytecode: bool = True,
+        io_threads: int = 1,
+) -> Iterator[Declaration]:
+    """
+    This generator looks up declarations with a name or with names starting with a prefix
+    in the memory-mapped binary index of search paths, see *open_binary_index*.
+    If the index can not be used, python files are scanned directly
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param name: A name or a prefix of names
+    :type name: str
+    :param prefix: *name* is a prefix of names
+    :type prefix: bool
+    :param refresh: refresh the declarations index before the lookup
+    :type refresh: bool
+    :param rebuild: drop the declarations index and scan all python files again
+    :type rebuild: bool
+    :param jobs: A count of worker processes used to scan changed files, zero means a count of CPU cores
+    :type jobs: int
+    :param on_decode: an optional picklable callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param stats: optional statistics to measure the refresh of the index and the lookup
+    :type stats: Optional[Stats]
+    :param bytecode: read declarations of changed files from up to date pyc files instead of sources
+    :type bytecode: bool
+    :param io_threads: A count of threads which list folders, stat and read files if *jobs* is 1
+    :type io_threads: int
+    :return: a generator of declarations
+    :rtype: Iterator[Declaration]
+    """
+    import sqlite3
+    try:
+        binary_index: 'BinaryIndex' = open_binary_index(
+            search_paths, refresh=refresh, rebuild=rebuild, jobs=jobs, on_decode=on_decode, stats=stats,
+            bytecode=bytecode, io_threads=io_threads,
+        )
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"declarations index is not available: {e}", file=sys.stderr)
+        yield from scan_declarations(
+            search_paths, jobs=jobs, on_decode=on_decode, stats=stats, bytecode=bytecode, io_threads=io_threads,
+            accept=NameFilter('^%s%s' % (re.escape(name), '' if prefix else '$'), regex=True),
+        )
+        return
+    declarations: Iterator[Declaration] = binary_index.lookup(name, prefix=prefix)
+    if stats is not None:
+        declarations = stats.instrument('lookup', declarations)
+    try:
+        yield from declarations
+    finally:
+        binary_index.close()
+
+
+def get_completions(
+        search_paths: List[str],
+        prefix: str,
+        limit: int,
+        types: Optional[List[DeclarationType]] = None,
+        use_cache: bool = True,
+        refresh: bool = True,
+        rebuild: bool = False,
+        jobs: int = 1,
+        on_decode: Optional[DecodeCallback] = None,
+        stats: Optional['Stats'] = None,
+        bytecode: bool = True,
+        io_threads: int = 1,
+) -> List[Declaration]:
+    """
+    Returns top completions of a prefix: the best declaration of each name starting with the prefix,
+    names are ranked by a position of a search path in search paths, then by a type of a declaration
+    (classes, functions, variables, extension modules and symbols), names with the same rank are sorted.
+    Completions are found in the binary index (see *binindex.BinaryIndex.complete*),
+    if it can not be used or *use_cache* is False python files are scanned and ranked in memory
+
+    :param search_paths: A list of search paths in order of the PYTHON PATH
+    :type search_paths: List[str]
+    :param prefix: A prefix of names
+    :type prefix: str
+    :param limit: a maximal count of completions
+    :type limit: int
+    :param types: types of best declarations to complete, all types by default
+    :type types: Optional[List[DeclarationType]]
+    :param use_cache: use the declarations index and the binary index
+    :type use_cache: bool
+    :param refresh: refresh the declarations index before the lookup
+    :type refresh: bool
+    :param rebuild: drop the declarations index and scan all python files again
+    :type rebuild: bool
+    :param jobs: A count of worker processes used to scan changed files, zero means a count of CPU cores
+    :type jobs: int
+    :param on_decode: an optional picklable callback, which receives a path to a file,
+        an encoding and a strategy used to decode the file (e.g. print_decoding)
+    :type on_decode: Optional[DecodeCallback]
+    :param stats: optional statistics to measure the refresh of the index and the lookup
+    :type stats: Optional[Stats]
+    :param bytecode: read declarations of changed files from up to date pyc files instead of sources
+    :type bytecode: bool
+    :param io_threads: A count of threads which list folders, stat and read files if *jobs* is 1
+    :type io_threads: int
+    :return: a list of declarations
+    :rtype: List[Declaration]
+    """
+    import sqlite3
+    from .binindex import get_rank, get_root_position
+    type_names: Optional[Set[str]] = None if types is None else {declaration_type.name for declaration_type in types}
+    if use_cache:
+        try:
+            binary_index: 'BinaryIndex' = open_binary_index(
+                search_paths, refresh=refresh, rebuild=rebuild, jobs=jobs, on_decode=on_decode, stats=stats,
+                bytecode=bytecode, io_threads=io_threads,
+            )
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"declarations index is not available: {e}", file=sys.stderr)
+        else:
+            started: float = time.perf_counter()
+            try:
+                completions: List[Declaration] = binary_index.complete(prefix, limit=limit, types=type_names)
+            finally:
+                binary_index.close()
+            if stats is not None:
+                stats.add_time('complete', time.perf_counter() - started, len(completions))
+            return completions
+    positions: Dict[str, int] = {}
+    best: Dict[str, Tuple[int, Declaration]] = {}  # a name: a rank and the best declaration
+    for declaration in scan_declarations(
+            search_paths, jobs=jobs, on_decode=on_decode, stats=stats, bytecode=bytecode, io_threads=io_threads,
+            accept=NameFilter('^%s' % re.escape(prefix), regex=True),
+    ):
+        if not declaration.name.startswith(prefix):
+            continue
+        rank: int = get_rank(
+            declaration.declaration_type, get_root_position(declaration.module_path, search_paths, positions),
+        )
+        if declaration.name not in best or rank < best[declaration.name][0]:
+            best[declaration.name] = (rank, declaration)
+    ranked: List[Tuple[int, Declaration]] = sorted(
+        (item for item in best.values() if type_names is None or item[1].declaration_type.name in type_names),
+        key=lambda item: (item[0], item[1].name.encode('utf-8', 'surrogatepass')),
+    )
+    return [declaration for _, declaration in ranked[:max(limit, 0)]]
+
+
+def get_distribution_map(search_paths: List[str], use_cache: bool = True) -> Dict[str, Tuple[str, str]]:
+    """
+    Returns a map of normalized paths of installed files to distributions (a name and a version),
+    the map is cached in the declarations index if *use_cache* is True
+
+    :param search_paths: A list of search paths
+    :type search_paths: List[str]
+    :param use_cache: use the declarations index
+    :type use_cache: bool
+    :return: a map of normalized paths to distributions
+    :rtype: Dict[str, Tuple[str, str]]
+    """
+    import sqlite3
+    from .cache import DeclarationIndex
+    from .dists import build_distribution_map
+    if use_cache:
+        try:
+            index: DeclarationIndex = DeclarationIndex(get_cache_path())
+            try:
+                return index.distributions(search_paths)
+            finally:
+                index.close()
+        except (OSError, sqlite3.Error) as e:
+            print(f"declarations index is not available: {e}", file=sys.stderr)
+    return build_distribution_map(search_paths)
+
+
+def main() -> None:
+    """
+    Runs the command line interface (see *cli.main*), it is kept for scripts which call *whatprovides.main*
+    """
+    from .cli import main as cli_main
+    cli_main()
+
+
+def run(args: 'argparse.Namespace', parser: 'argparse.ArgumentParser') -> None:
+    """
+    Runs a search (or a daemon, or a watcher) by parsed arguments of the command line (see *cli.get_parser*)
+
+    :param args: parsed arguments of the command line
+    :type args: argparse.Namespace
+    :param parser: the parser of the command line, errors of arguments are reported by it
+    :type parser: argparse.ArgumentParser
+    """
+    pruned_folders.extend(args.exclude)
+    on_decode: Optional[DecodeCallback] = print_decoding if args.show_encoding else None
+    stats: Optional['Stats'] = None
+    environment_paths: List[str] = []
+    if args.python or args.venv:
+        from .environments import get_environment_paths
+        try:
+            environment_paths = get_environment_paths(args.python, args.venv)
+        except RuntimeError as e:
+            parser.error(str(e))
+    paths: Iterator[str] = get_search_paths(args.path + environment_paths or sys.path)
+    if args.stats:
+        from .stats import Stats
+        stats = Stats(on_decode=on_decode)
+        on_decode = stats.on_decode
+        paths = stats.instrument('paths', paths)
+    search_paths: List[str] = list(paths)
+    from .prefetch import get_io_threads
+    args.io_threads = get_io_threads(args.io_threads, search_paths)
+    if args.serve:
+        if args.exclude or args.no_bytecode:
+            parser.error('argument --serve: not allowed with --exclude or --no-bytecode')
+        from .daemon import serve
+        try:
+            serve(search_paths=search_paths, jobs=args.j, io_threads=args.io_threads)
+        except RuntimeError as e:
+            parser.error(str(e))
+        return
+    if args.x and (args.r or args.i or args.fuzzy or args.batch is not None):
+        parser.error('argument -x: not allowed with -r, -i, --fuzzy or --batch')
+    if args.prefix and (args.r or args.i or args.x or args.fuzzy or args.batch is not None):
+        parser.error('argument --prefix: not allowed with -r, -i, -x, --fuzzy or --batch')
+    if args.module and (args.x or args.prefix or args.batch is not None):
+        parser.error('argument --module: not allowed with -x, --prefix or --batch')
+    if args.watch:
+        from .watch import watch
+        watch(search_paths, jobs=args.j, on_decode=on_decode, bytecode=not args.no_bytecode, io_threads=args.io_threads)
+        return
+    if args.batch is not None:
+        if args.search is not None or args.r or args.i or args.fuzzy:
+            parser.error('argument --batch: not allowed with search, -r, -i or --fuzzy')
+        if args.batch == '-':
+            args.names = read_names(sys.stdin)
+        else:
+            try:
+                with open(args.batch, encoding='utf-8') as f:  # names are python identifiers, like in sources
+                    args.names = read_names(f)
+            except (OSError, UnicodeDecodeError) as e:
+                reason: object = getattr(e, 'strerror', None) or e  # a decoding error has no strerror
+                parser.error('argument --batch: can not read "%s": %s' % (args.batch, reason))
+    elif args.search is None and args.module:
+        args.search = ''  # all declarations of modules
+    elif args.search is None:
+        parser.error('the following arguments are required: search')
+    if args.profile:
+        from .stats import profile
+        with profile(args.profile):
+            _print_declarations(args, search_paths, on_decode, stats)
+    else:
+        _print_declarations(args, search_paths, on_decode, stats)
+    if stats is not None:
+        stats.report()
+
+
+def _print_declarations(
+        args: 'argparse.Namespace',
+        search_paths: List[str],
+        on_decode: Optional[DecodeCallback],
+        stats: Optional['Stats'],
+) -> None:
+    prefix: bool = bool(args.x and args.search.endswith('*'))
+    search: str = args.search[:-1] if prefix else args.search  # a name or a prefix for -x
     if args.r and args.i:
         _filter: partial = partial(re_filter_declaration, re.compile(args.search, re.IGNORECASE))
     elif args.r:
@@ -331,30 +1609,185 @@ def main():
         _filter: partial = partial(ifilter_declaration, args.search)
     else:
         _filter: partial = partial(filter_declaration, args.search)
-    results: Iterator[Declaration] = _filter(
-        declarations=get_declarations(
-            lines=get_files_lines(
-                file_paths=get_python_files(
-                    search_paths=get_paths(sys.path)
-                )
-            )
+    if args.batch is not None:
+        name_filter: Callable[[str], bool] = NameSet(args.names)
+        _filter = partial(set_filter_declaration, name_filter.names)
+    elif args.x or args.prefix:
+        name_filter = NameFilter(search='^%s%s' % (re.escape(search), '' if prefix or args.prefix else '$'),
+                                 regex=True)
+        _filter = partial(re_filter_declaration, name_filter.pattern)
+    else:
+        name_filter = NameFilter(search=args.search, regex=args.r, ignore_case=args.i)
+    scan_filter: Optional[Callable[[str], bool]] = name_filter
+    if args.fuzzy:
+        from .fuzzy import FuzzyQuery, filter_fuzzy
+        name_filter = FuzzyQuery(args.search)
+        _filter = partial(filter_fuzzy, name_filter)
+        scan_filter = None  # scanned names are indexed by *filter_fuzzy*, the distance is computed for candidates
+    remained_types: Optional[List[DeclarationType]] = _get_remained_types(args)
+    declarations: Optional[Iterator[Declaration]] = None
+    if args.module:
+        from .modules import get_module_declarations
+        declarations = get_module_declarations(
+            modules=args.module,
+            search_paths=search_paths,
+            accept=scan_filter,
+            on_decode=on_decode,
+            bytecode=not args.no_bytecode,
         )
-    )
-    if not args.v and not args.d and not args.c:
-        filtered_results: Iterator[Declaration] = results
-    elif args.v and args.d and args.c:
+    elif args.prefix:
+        from .binindex import COMPLETIONS_LIMIT
+        limit: Optional[int] = 1 if args.first else args.limit
+        declarations = iter(get_completions(
+            search_paths=search_paths,
+            prefix=search,
+            limit=COMPLETIONS_LIMIT if limit is None else limit,
+            types=remained_types,
+            use_cache=not args.no_cache,
+            refresh=not args.no_refresh,
+            rebuild=args.rebuild,
+            jobs=args.j,
+            on_decode=on_decode,
+            stats=stats,
+            bytecode=not args.no_bytecode,
+            io_threads=args.io_threads,
+        ))
+    elif args.x and not args.no_cache:
+        declarations = get_binary_declarations(
+            search_paths=search_paths,
+            name=search,
+            prefix=prefix,
+            refresh=not args.no_refresh,
+            rebuild=args.rebuild,
+            jobs=args.j,
+            on_decode=on_decode,
+            stats=stats,
+            bytecode=not args.no_bytecode,
+            io_threads=args.io_threads,
+        )
+    elif _use_daemon(args):
+        from .daemon import query
+        declarations = query(search_paths=search_paths, accept=name_filter)
+        if declarations is not None and stats is not None:
+            declarations = stats.instrument('daemon', declarations)
+    if declarations is None:
+        declarations = get_indexed_declarations(
+            search_paths=search_paths,
+            rebuild=args.rebuild,
+            jobs=args.j,
+            on_decode=on_decode,
+            accept=name_filter,
+            stats=stats,
+            bytecode=not args.no_bytecode,
+            io_threads=args.io_threads,
+            refresh=not args.no_refresh,
+        ) if not args.no_cache else scan_declarations(
+            search_paths=search_paths,
+            jobs=args.j,
+            accept=scan_filter,
+            on_decode=on_decode,
+            stats=stats,
+            bytecode=not args.no_bytecode,
+            io_threads=args.io_threads,
+            extensions=remained_types is None or any(t in extension_declaration_types for t in remained_types),
+        )
+    if stats is not None:
+        declarations = stats.instrument('other', declarations)  # e.g. imports and opening of the index
+    results: Iterator[Declaration] = _filter(declarations=declarations)
+    if remained_types is None:
         filtered_results: Iterator[Declaration] = results
     else:
-        remained_types: List[DeclarationType] = []
-        if args.v:
-            remained_types.append(declaration_types[0])
-        if args.d:
-            remained_types.append(declaration_types[1])
-        if args.c:
-            remained_types.append(declaration_types[2])
         filtered_results: Iterator[Declaration] = filter_delaration_type(results, remained_types=remained_types)
-    for result in filtered_results:
-        print(result)
+    if stats is not None:
+        filtered_results = stats.instrument('filter', filtered_results)
+    distributions: Dict[str, Tuple[str, str]] = {}
+    if args.dist or args.show_dist:
+        from .dists import filter_distribution
+        started: float = time.perf_counter()
+        distributions = get_distribution_map(search_paths, use_cache=not args.no_cache)
+        if stats is not None:
+            stats.add_time('dists', time.perf_counter() - started, len(distributions))
+        if args.dist:
+            filtered_results = filter_distribution(args.dist, filtered_results, distributions)
+    if args.import_order:
+        filtered_results = sort_import_order(filtered_results, search_paths)
+    limit = 1 if args.first else args.limit
+    if limit is not None and args.batch is None:
+        filtered_results = itertools.islice(filtered_results, max(limit, 0))  # stops the chain of generators
+    if args.dist or args.show_dist:
+        from .dists import get_declaration_distribution
+
+        def format_result(result: Declaration) -> str:
+            distribution: Optional[Tuple[str, str]] = get_declaration_distribution(result, distributions)
+            return '%s: %s' % (result, '%s==%s' % distribution if distribution else '-')
+    else:
+        format_result: Callable[[Declaration], str] = str
+    if args.show_import or args.module:
+        from .modules import ModuleNames, get_import_statement
+        module_names: ModuleNames = ModuleNames(search_paths)
+        format_declaration: Callable[[Declaration], str] = format_result
+
+        def format_result(result: Declaration) -> str:
+            statement: Optional[str] = get_import_statement(result, module_names.get(result.module_path))
+            return '%s: %s' % (format_declaration(result), statement or '-')
+    if args.batch is not None:
+        output: Iterator[str] = _get_batch_lines(
+            group_declarations(args.names, filtered_results, limit=None if limit is None else max(limit, 0)),
+            format_result,
+        )
+    else:
+        output: Iterator[str] = (format_result(result) for result in filtered_results)
+    if stats is None:
+        write_lines(output)
+        return
+    written: int = stats.measure('output', write_lines, output)
+    stats.add_time('output', 0.0, written)
+
+
+def _use_daemon(args: 'argparse.Namespace') -> bool:
+    """
+    Checks that a search is answered by the daemon if it is running. The daemon is not queried if:
+    the declarations index is not used or is rebuilt (--no-cache, --rebuild, --no-daemon),
+    the binary index or files of modules are used (-x, --prefix, --module),
+    the index is used as is without checking files (--no-refresh),
+    the scope differs from the scope of the daemon, which serves all files of search paths
+    read from up to date bytecode (--exclude, --no-bytecode), or decoding of files is reported (--show-encoding).
+    The daemon applies changes of files before it answers, results are streamed, so --first and --limit
+    stop reading them early
+    """
+    return not (
+        args.no_cache or args.rebuild or args.no_daemon or args.x or args.prefix or args.module or args.no_refresh
+        or args.exclude or args.no_bytecode or args.show_encoding
+    )
+
+
+def _get_remained_types(args: 'argparse.Namespace') -> Optional[List[DeclarationType]]:
+    """
+    Returns types of declarations selected by the -v, -d, -c and -e options, None means all types.
+    Declarations of extension modules (ext, sym) are shown only with -e,
+    all types of python code are shown without -v, -d and -c (or with all of them) unless only -e is given
+    """
+    code_types: bool = args.v and args.d and args.c or not args.v and not args.d and not args.c and not args.e
+    if code_types and args.e:
+        return None
+    remained_types: List[DeclarationType] = list(declaration_types)  # user defined types of python code too
+    if not code_types:
+        remained_types = [t for selected, t in zip((args.v, args.d, args.c), declaration_types) if selected]
+    if args.e:
+        remained_types.extend(extension_declaration_types)
+    return remained_types
+
+
+def _get_batch_lines(
+        groups: Iterator[Tuple[str, List[Declaration]]],
+        format_result: Callable[[Declaration], str],
+) -> Iterator[str]:
+    for name, declarations in groups:
+        yield '%s:' % name
+        if not declarations:
+            yield '  -'  # the name was not found
+        for declaration in declarations:
+            yield '  %s' % format_result(declaration)
 
 
 if __name__ == '__main__':